@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+
+"""Static asset build: fingerprinted names and precompressed variants.
+
+Copies `static/` into `static/dist/`, adding a copy of every file under a
+content-hashed name (`dashboard.<hash>.js`) and gzip/brotli variants of the
+compressible ones, and writes `assets.json` mapping each file to its hashed
+name. Templates refer to assets through `asset(path)`, so a new build is
+picked up without editing them.
+
+Original names are kept in `dist/`: the sketcher bundle loads its worker
+and WASM files by name, relative to its own location.
+"""
+
+import gzip
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_DIR = Path(__file__).parent / "static"
+DIST = "dist"
+MANIFEST = "assets.json"
+
+COMPRESSIBLE = {".js", ".wasm", ".map", ".css", ".html", ".json", ".svg", ".txt", ".ts"}
+# variants in order of preference, by Content-Encoding
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def fingerprinted(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}")
+
+
+def compress(path, content):
+    # precompressed once at build time, so as small as possible
+    if path.suffix not in COMPRESSIBLE:
+        return
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(content, quality=11))
+
+
+def build(static_dir=STATIC_DIR):
+    static_dir = Path(static_dir)
+    dist = static_dir / DIST
+    if dist.exists():
+        shutil.rmtree(dist)
+
+    manifest = {}
+    for path in sorted(static_dir.rglob("*")):
+        if not path.is_file() or dist in path.parents:
+            continue
+        name = path.relative_to(static_dir)
+        content = path.read_bytes()
+        hashed = fingerprinted(name, content)
+
+        for out in (name, hashed):
+            (dist / out).parent.mkdir(parents=True, exist_ok=True)
+            (dist / out).write_bytes(content)
+            compress(dist / out, content)
+        manifest[name.as_posix()] = hashed.as_posix()
+
+    (dist / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    if brotli is None:
+        print("WARNING: brotli is not installed, only gzip variants were built")
+    print(f"{len(manifest)} assets built in {dist}")
+    return manifest
+
+
+class Assets:
+    '''built assets, or the plain static files if there is no build'''
+
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = Path(static_dir)
+        try:
+            self.manifest = json.loads((self.static_dir / DIST / MANIFEST).read_text())
+        except FileNotFoundError:
+            self.manifest = {}
+        self.immutable = set(self.manifest.values())
+
+    def url(self, name):
+        '''URL for a file in static/, fingerprinted if assets were built'''
+        if name in self.manifest:
+            return f"/static/{DIST}/{self.manifest[name]}"
+        return f"/static/{name}"
+
+    def is_immutable(self, name):
+        '''hashed names never change content, and can be cached forever'''
+        return name.startswith(f"{DIST}/") and name[len(DIST) + 1:] in self.immutable
+
+    def variant(self, name, accept_encodings):
+        '''precompressed file to send for `name`, and its Content-Encoding (or None)'''
+        for encoding, suffix in ENCODINGS.items():
+            if accept_encodings[encoding] and (self.static_dir / (name + suffix)).is_file():
+                return name + suffix, encoding
+        return name, None
+
+
+if __name__ == "__main__":
+    build()
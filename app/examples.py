@@ -0,0 +1,93 @@
+import fcntl
+import gzip
+import os
+import re
+import time
+from pathlib import Path
+
+
+EXAMPLES_DIR = Path(__file__).parent / "examples"
+
+# example id (as used in the /examples page) -> query genome
+EXAMPLES = {
+    "Ralso": "Ralstonia solanacearum, GCF_002251655.1",
+    "Sal": "Salmonella enterica, GCF_000006945.2",
+    "Promar": "Prochlorococcus marinus, GCF_000015665.1",
+    "Canal": "Candida albicans, GCF_000182965.3",
+    "Aspsyd": "Aspergillus sydowii, GCF_001890705.1",
+    "Pelagi": "Candidatus Pelagibacter ubique, GCF_000012345.1",
+}
+
+
+def example_signature(example_id):
+    '''signature JSON for an example, as sent by the search forms'''
+    with gzip.open(EXAMPLES_DIR / f"{example_id}.sig.gz", "rt") as f:
+        return f.read()
+
+
+class ExampleCache:
+    '''search results for the examples, computed once per index version
+
+    Results are stored gzipped, in memory and in `cache_dir`, under the
+    index fingerprint: a new index (or metadata database) gets a new
+    fingerprint, and results are recomputed the first time they are asked
+    for. The directory is shared by all web workers, and a lock file per
+    example makes sure only one of them runs the search.
+    '''
+
+    def __init__(self, search, fingerprint, cache_dir, fingerprint_ttl=60):
+        self.search = search
+        self._fingerprint = fingerprint
+        self.cache_dir = Path(cache_dir)
+        self.fingerprint_ttl = fingerprint_ttl
+        self._current = (None, 0.)
+        self._results = {}
+
+    def fingerprint(self):
+        '''index fingerprint, checked at most every `fingerprint_ttl` seconds'''
+        fingerprint, checked = self._current
+        if fingerprint is None or time.monotonic() - checked > self.fingerprint_ttl:
+            # only used in file names
+            fingerprint = re.sub(r"[^A-Za-z0-9_-]", "", self._fingerprint())
+            self._current = (fingerprint, time.monotonic())
+        return fingerprint
+
+    def get(self, example_id):
+        '''gzipped JSON results for an example, and the fingerprint they are for'''
+        fingerprint = self.fingerprint()
+        key = (example_id, fingerprint)
+        if key not in self._results:
+            # results for older indices are not needed anymore
+            self._results = {k: v for k, v in self._results.items() if k[1] == fingerprint}
+            self._results[key] = self._load_or_compute(example_id, fingerprint)
+        return self._results[key], fingerprint
+
+    def _load_or_compute(self, example_id, fingerprint):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{example_id}-{fingerprint}.json.gz"
+
+        with open(self.cache_dir / f"{example_id}.lock", "w") as lock:
+            # another worker may be computing it, wait for it and reuse its results
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if path.exists():
+                return path.read_bytes()
+
+            print(f"Computing results for example {example_id}")
+            results = gzip.compress(self.search(example_signature(example_id)).encode())
+
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(results)
+            os.replace(tmp, path)
+            for old in self.cache_dir.glob(f"{example_id}-*.json.gz"):
+                if old != path:
+                    old.unlink(missing_ok=True)
+
+        return results
+
+    def warm(self):
+        '''compute results for all examples, e.g. at startup'''
+        for example_id in EXAMPLES:
+            try:
+                self.get(example_id)
+            except Exception as e:
+                print(f"Could not precompute example {example_id}: {e}")
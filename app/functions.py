@@ -2,7 +2,14 @@ import polars as pl
 import io
 import os
 import gzip
+import re
 import string
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from urllib.parse import quote, urlencode
+
+import urllib3
+
+import accessions
 
 
 DEFAULT_COLUMNS = {
@@ -11,26 +18,174 @@ DEFAULT_COLUMNS = {
     "cANI": pl.Float64
 }
 
+# results from /search/batch are tagged with the name of each query
+BATCH_COLUMNS = {
+    "query_name": pl.String,
+    "SRA_accession": pl.String,
+    "containment": pl.Float64,
+}
+
+
+# metadata column names are used as identifiers in the metadata queries
+COLUMN_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
 
 class SearchError(Exception):
     """Search index errors"""
 
 
+def check_columns(meta_list):
+    '''metadata column names as a list, ValueError unless all are plain identifiers'''
+    if isinstance(meta_list, str):
+        raise ValueError("metadata must be a list of column names")
+    meta_list = list(meta_list)
+    for c in meta_list:
+        if not isinstance(c, str) or not COLUMN_NAME.match(c):
+            raise ValueError(f"invalid metadata column: {c!r}")
+    return meta_list
+
+
+def index_shards(config):
+    '''base URLs of the index servers, each serving a disjoint slice of the collection'''
+    return config.get('index_shards') or [config.get('index_server', 'http://index-service')]
+
+
+def fan_out(method, path, config, http, read, shards=None, **kwargs):
+    '''send the same request to all index shards (or `shards`) at once
+
+    `path` can also be a function of the shard URL, for per-shard parameters.
+    `read(response)` runs in the worker threads, so each shard's results are
+    read as soon as they arrive. Returns the results by shard, in arrival
+    order, and the shards that failed or did not answer within
+    `shard_timeout` seconds. Only if every shard failed is the first error raised.
+    '''
+    if shards is None:
+        shards = index_shards(config)
+    if not shards:
+        return {}, []
+    shard_timeout = config.get('shard_timeout', 100)
+    timeout = urllib3.Timeout(connect=min(10, shard_timeout), read=shard_timeout)
+
+    def query(base_url):
+        shard_path = path(base_url) if callable(path) else path
+        r = http.request(method, f"{base_url}/{shard_path}", timeout=timeout,
+                         retries=urllib3.Retry(total=2, read=0, redirect=0), **kwargs)
+        return read(r)
+
+    pool = ThreadPoolExecutor(max_workers=len(shards))
+    futures = {pool.submit(query, base_url): base_url for base_url in shards}
+    pending = set(futures)
+    results, failed, errors = {}, [], []
+    try:
+        for future in as_completed(futures, timeout=shard_timeout):
+            pending.discard(future)
+            try:
+                result = future.result()
+            except (SearchError, urllib3.exceptions.HTTPError) as e:
+                print(f"Index shard {futures[future]} failed: {e}")
+                failed.append(futures[future])
+                errors.append(e)
+                continue
+            if result is not None:
+                results[futures[future]] = result
+    except FuturesTimeout:
+        # slow shards are left behind, their requests end with the read timeout
+        for future in pending:
+            print(f"Index shard {futures[future]} timed out")
+            failed.append(futures[future])
+            errors.append(SearchError(f"Index shard timed out after {shard_timeout}s", 504))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if len(failed) == len(shards):
+        error = errors[0]
+        raise error if isinstance(error, SearchError) else SearchError(str(error), 503)
+    return results, failed
+
+
 def getmetadata(config, http):
-    # GET metadata stats from index server
-    # base_url = config.get('index_server', 'https://branchwater-api.jgi.doe.gov')
-    base_url = 'http://index-service'
-    # base_url = 'https://branchwater-api.jgi.doe.gov'
-    r = http.request('GET', f"{base_url}/metadata/stats")
-    if r.status != 200:
-        raise SearchError(r.data.decode('utf-8'), r.status)
+    # GET metadata stats from all index shards, and add them up
+    def read(r):
+        if r.status != 200:
+            raise SearchError(r.data.decode('utf-8'), r.status)
+        return r.json()
 
-    metadata = r.json()
+    shard_stats, failed = fan_out('GET', "metadata/stats", config, http, read)
+    if failed:
+        print(f"WARNING: dataset count is missing {len(failed)} index shards")
+
+    shard_stats = list(shard_stats.values())
+    metadata = dict(shard_stats[0])
+    for stats in shard_stats[1:]:
+        if (stats['ksize'], stats['scaled']) != (metadata['ksize'], metadata['scaled']):
+            raise SearchError("Index shards were built with different sketch parameters", 500)
+        metadata['threshold'] = max(metadata['threshold'], stats['threshold'])
+    metadata['n_datasets'] = sum(stats['n_datasets'] for stats in shard_stats)
+    # index versions being served, changing when a shard switches to a new index
+    metadata['version'] = "-".join(sorted(str(stats.get('version', '')) for stats in shard_stats))
 
     return metadata
 
 
-def getacc(signatures, config, http):
+def getindexversion(config, http):
+    # the index servers tag their listings with an ETag that changes with the index
+    def read(r):
+        if r.status != 200:
+            raise SearchError(r.data.decode('utf-8'), r.status)
+        return r.headers.get('ETag', '')
+
+    versions, failed = fan_out('GET', "metadata/accessions?limit=0", config, http, read)
+    if failed:
+        raise SearchError("Index shards are not all available", 503)
+
+    # arrival order varies, the version should not
+    return "-".join(sorted(versions.values()))
+
+
+def getaccessionsat(positions, config, http):
+    # accession at a position in each shard's manifest
+    def read(r):
+        if r.status != 200:
+            raise SearchError(r.data.decode('utf-8'), r.status)
+        return r.data.decode('utf-8').strip()
+
+    accessions, failed = fan_out(
+        'GET', lambda base_url: f"metadata/accessions?{urlencode({'since': positions[base_url], 'limit': 1})}",
+        config, http, read, shards=list(positions))
+    if failed:
+        raise SearchError("Index shards are not all available", 503)
+    return accessions
+
+
+def getindexmarks(config, http):
+    '''number of datasets in each shard, and the accession of the last one
+
+    Index updates append datasets to the manifest, so the datasets from
+    position `n_datasets` on are the ones added since, as long as the
+    last accession is still in its place.
+    '''
+    def read(r):
+        if r.status != 200:
+            raise SearchError(r.data.decode('utf-8'), r.status)
+        return r.json()['n_datasets']
+
+    counts, failed = fan_out('GET', "metadata/stats", config, http, read)
+    if failed:
+        raise SearchError("Index shards are not all available", 503)
+
+    last = getaccessionsat({url: n - 1 for url, n in counts.items() if n}, config, http)
+    return {url: {"n_datasets": n, "last_accession": last.get(url, "")}
+            for url, n in counts.items()}
+
+
+def getacc(signatures, config, http, threshold=None, failed_shards=None, since=None,
+           downsampled=None):
+    # several signatures are searched together, sharing index lookups
+    batch = not isinstance(signatures, str)
+    if batch:
+        signatures = ",".join(signatures)
+    schema = BATCH_COLUMNS if batch else DEFAULT_COLUMNS
+
     # remove whitespace from string and compress signatures to gzipped bytes
     sig_str = signatures.translate({ord(c): None for c in string.whitespace})
     json_bytes = f"[{sig_str}]".encode('utf-8')
@@ -38,63 +193,242 @@ def getacc(signatures, config, http):
     with gzip.open(buf, 'w') as fout:
         fout.write(json_bytes)
 
-    # POST to mastiff
-    # base_url = config.get('index_server', 'https://branchwater-api.jgi.doe.gov')
-    base_url = 'http://index-service'
-    print(f'BASE URL {base_url}')
-    r = http.request('POST',
-                     f"{base_url}/search",
-                     body=buf.getvalue(),
-                     headers={'Content-Type': 'application/json'})
-    if r.status != 200:
-        raise SearchError(r.data.decode('utf-8'), r.status)
+    # containment threshold and max results are applied by the index server,
+    # so matches below the threshold are never sent
+    if threshold is None:
+        threshold = config.get('threshold', 0.1)
+    params = {'min_containment': threshold}
+    if config.get('max_results'):
+        params['max_results'] = config['max_results']
+    if downsampled is not None:
+        # the index server lowers its minimum match size to match the query
+        params['downsampled'] = downsampled
+
+    # POST to mastiff, the same sketch to every index shard
+    endpoint = "search/batch" if batch else "search"
+    path, shards = f"{endpoint}?{urlencode(params)}", None
+    if since is not None:
+        # only the datasets from a position in each shard's manifest on
+        path = lambda base_url: f"{endpoint}?{urlencode({**params, 'since': since[base_url]})}"
+        shards = list(since)
+    frames, failed = fan_out('POST', path, config, http,
+                             lambda r: read_matches(r, schema, threshold),
+                             shards=shards,
+                             body=buf.getvalue(),
+                             headers={'Content-Type': 'application/json'},
+                             preload_content=False)
+    if failed_shards is not None:
+        failed_shards.extend(failed)
+    return merge_matches(frames.values(), schema, threshold, config)
+
+
+def getacc_by_accession(accession, config, http, threshold=None, failed_shards=None):
+    # search with the signature of a dataset already in the index,
+    # no need to sketch or upload anything
+    if threshold is None:
+        threshold = config.get('threshold', 0.1)
+    params = {'min_containment': threshold}
+    if config.get('max_results'):
+        params['max_results'] = config['max_results']
+
+    # the dataset is in one shard only, the others answer 404
+    frames, failed = fan_out('GET',
+                             f"search/accession/{quote(accession, safe='')}?{urlencode(params)}",
+                             config, http,
+                             lambda r: read_matches(r, DEFAULT_COLUMNS, threshold, missing_ok=True),
+                             preload_content=False)
+    if not frames and not failed:
+        raise SearchError(f"Accession {accession} is not in the index", 404)
+    if failed_shards is not None:
+        failed_shards.extend(failed)
+    return merge_matches(frames.values(), DEFAULT_COLUMNS, threshold, config)
 
-    query_results_text = r.data.decode('utf-8')
 
-    results_wrap_fp = io.StringIO(query_results_text)
-    mastiff_df = pl.read_csv(results_wrap_fp, schema=DEFAULT_COLUMNS)
-    n_raw_results = len(mastiff_df)
+def read_matches(r, schema, threshold, missing_ok=False):
+    # search results streamed by an index shard, read and filtered as they arrive
+    try:
+        if missing_ok and r.status == 404:
+            return None
+        if r.status != 200:
+            raise SearchError(r.data.decode('utf-8'), r.status)
 
-    if n_raw_results == 0:
-        return pl.DataFrame(None, schema=DEFAULT_COLUMNS)
+        mastiff_df = pl.read_csv(r, schema=schema)
+    finally:
+        r.release_conn()
+
+    # filter for containment; potential to pass this from user
+    return mastiff_df.filter(pl.col("containment") >= threshold)
+
+
+def merge_matches(frames, schema, threshold, config):
+    # results from all shards, best matches first
+    frames = [df for df in frames if len(df)]
+    n_results = sum(len(df) for df in frames)
+    print(f"Search returned {n_results} results with >={threshold} containment.")
+
+    if n_results == 0:
+        return pl.DataFrame(None, schema={**schema, "cANI": pl.Float64, "acc_key": pl.Int64})
 
     ksize = int(config.metadata['ksize'])
 
-    threshold = config.get('threshold', 0.1)
-    print(
-        f"Search returned {n_raw_results} results. Now filtering results with <{threshold} containment...")
+    mastiff_df = pl.concat(frames).sort("containment", descending=True)
+    if config.get('max_results') and len(frames) > 1:
+        # each shard sent its own top matches
+        if "query_name" in mastiff_df.columns:
+            mastiff_df = mastiff_df.group_by("query_name", maintain_order=True).head(config['max_results'])
+        else:
+            mastiff_df = mastiff_df.head(config['max_results'])
 
-    mastiff_df = (mastiff_df
-        # filter for containment; potential to pass this from user
-        .filter(pl.col("containment") >= threshold)
-        .with_columns(
+    mastiff_df = mastiff_df.with_columns(
           # containment to ANI
           cANI=pl.col('containment') ** (1./ksize)
-        ))
+        )
 
     print(
         f"Returning {len(mastiff_df)} filtered results!")
 
     # remove spaces from columns
     mastiff_df = mastiff_df.rename(lambda c: c.replace(' ', '_'))
+
+    # integer accession keys for the metadata join;
+    # null for non-conforming accessions, resolved in getduckdb
+    mastiff_df = mastiff_df.with_columns(
+        acc_key=accessions.encode_expr("SRA_accession"))
     return mastiff_df
 
 
+# gather results from the index server
+GATHER_COLUMNS = {
+    "SRA_accession": pl.String,
+    "gather_result_rank": pl.Int64,
+    "intersect_bp": pl.Int64,
+    "f_orig_query": pl.Float64,
+    "f_match": pl.Float64,
+    "f_unique_to_query": pl.Float64,
+    "match_containment_ani": pl.Float64,
+}
+
+
+def getgather(signatures, config, http, threshold_bp=None):
+    # remove whitespace from string and compress signatures to gzipped bytes
+    sig_str = signatures.translate({ord(c): None for c in string.whitespace})
+    json_bytes = f"[{sig_str}]".encode('utf-8')
+    buf = io.BytesIO()
+    with gzip.open(buf, 'w') as fout:
+        fout.write(json_bytes)
+
+    params = {}
+    if threshold_bp is not None:
+        params['threshold_bp'] = threshold_bp
+
+    # min-set-cover needs every candidate match at once, and can't be merged
+    # across shards: results from one shard would silently miss the others
+    shards = index_shards(config)
+    if len(shards) > 1:
+        raise SearchError("gather is not available with a sharded index", 501)
+    base_url = shards[0]
+    r = http.request('POST',
+                     f"{base_url}/gather?{urlencode(params)}",
+                     body=buf.getvalue(),
+                     headers={'Content-Type': 'application/json'})
+    if r.status != 200:
+        raise SearchError(r.data.decode('utf-8'), r.status)
+
+    gather_df = pl.read_csv(io.BytesIO(r.data), schema=GATHER_COLUMNS)
+    print(f"Gather returned {len(gather_df)} results.")
+
+    ksize = int(config.metadata['ksize'])
+
+    # same columns as containment search, plus the gather statistics
+    return gather_df.with_columns(
+        containment=pl.col("f_orig_query"),
+        cANI=pl.col("f_orig_query") ** (1./ksize),
+        acc_key=accessions.encode_expr("SRA_accession"),
+    )
+
+
 def getduckdb(mastiff_df, meta_list, config, client):
     required = ["acc"]
     # make sure required keys are present, and show up first
-    meta_list = list(dict.fromkeys(required + list(meta_list)))
+    meta_list = list(dict.fromkeys(required + check_columns(meta_list)))
+
+    # extra columns from the search (query_name for batches, gather statistics)
+    # are kept, before the metadata
+    extra = [c for c in mastiff_df.columns
+             if c not in ("SRA_accession", "containment", "cANI", "acc_key")]
+    extra = "".join(f"accs.{c}, " for c in extra)
+
+    # MAGs linked to each run (from load_mags.py), probed by key in the same join
+    mags_columns, mags_join = "", ""
+    if config.get('annotate_mags'):
+        mags_columns = ", coalesce(mags.n_mags, 0) AS n_mags, mags.mag_catalogues"
+        mags_join = """
+        LEFT JOIN run_mag_summary mags
+        ON coalesce(accs.acc_key, fb.acc_key) = mags.acc_key"""
 
     query = f"""
         SELECT
-            subset.acc,
+            {extra}subset.acc,
             round(accs.containment, 2) as containment,
             round(accs.cANI, 2) as cANI,
-            subset.* EXCLUDE (acc)
+            subset.* EXCLUDE (acc, subset_key){mags_columns}
         FROM mastiff_df accs
-        LEFT JOIN (SELECT {", ".join(meta_list)} FROM metadata) subset
-        ON accs.SRA_accession = subset.acc;
+        LEFT JOIN acc_fallback fb
+        ON accs.acc_key IS NULL AND accs.SRA_accession = fb.acc
+        LEFT JOIN (SELECT acc_key AS subset_key, {", ".join(meta_list)} FROM metadata) subset
+        ON coalesce(accs.acc_key, fb.acc_key) = subset.subset_key{mags_join};
     """
     result = client.sql(query)
 
     return result
+
+
+def lookup_metadata(acc_list, meta_list, client, batch_rows=100_000):
+    meta_list = check_columns(meta_list)
+
+    # accessions from the request, registered as an Arrow table for DuckDB to scan
+    accs = (pl.DataFrame({"SRA_accession": acc_list}, schema={"SRA_accession": pl.String})
+        .with_columns(acc_key=accessions.encode_expr("SRA_accession"))
+        .to_arrow())
+    client.register("lookup_accs", accs)
+
+    # same join as getduckdb, accessions missing from metadata are kept with nulls
+    meta_list = [c for c in dict.fromkeys(meta_list) if c != "acc"]
+    columns = "".join(f", subset.{c}" for c in meta_list)
+    query = f"""
+        SELECT
+            coalesce(subset.acc, accs.SRA_accession) AS acc{columns}
+        FROM lookup_accs accs
+        LEFT JOIN acc_fallback fb
+        ON accs.acc_key IS NULL AND accs.SRA_accession = fb.acc
+        LEFT JOIN (SELECT acc_key AS subset_key, {", ".join(["acc"] + meta_list)} FROM metadata) subset
+        ON coalesce(accs.acc_key, fb.acc_key) = subset.subset_key;
+    """
+    # record batches, read as the join produces them
+    return client.execute(query).to_arrow_reader(batch_rows)
+
+
+def getmags(accession, catalogue, client):
+    # MAGs from a catalogue linked to a run, looked up by accession key
+    key = accessions.encode(accession)
+    if key is not None:
+        condition, value = "acc_key = ?", key
+    else:
+        # non-conforming accessions are rare, match them by name
+        condition, value = "acc = ?", accession
+
+    return client.execute(f"""
+        SELECT m.* EXCLUDE (acc_key)
+        FROM run_mags m
+        WHERE {condition} AND catalogue_id = ?
+        ORDER BY genome_accession;
+    """, [value, catalogue])
+
+
+def results_to_json(result_list):
+    # DATE columns from the typed metadata table are sent as strings,
+    # so missing values can be reported as "NP" like every other column
+    return (result_list
+        .with_columns(pl.col(pl.Date).cast(pl.String))
+        .fill_null("NP")
+        .write_json(None))
@@ -0,0 +1,20 @@
+# Production serving mode: `gunicorn main:app` picks this up from the app directory.
+#
+# The app is loaded once, before forking the workers, so the configuration,
+# index stats and accession sets are shared (copy-on-write) instead of being
+# rebuilt by each worker. Each worker then warms up DuckDB on its own, and
+# /ready only answers 200 once it is done.
+import os
+
+bind = os.environ.get("BRANCHWATER_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+timeout = 120
+accesslog = "-"
+preload_app = True
+
+
+def post_fork(server, worker):
+    # the app is already imported (preload_app); threads don't survive the fork,
+    # so warm-up starts here, in each worker
+    import main
+    main.start_warm_up()
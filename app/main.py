@@ -1,9 +1,18 @@
+import gzip
+import io
+import mimetypes
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import duckdb
+import pyarrow as pa
 import yaml
 import urllib3
-from flask import Flask, render_template, request, jsonify, g, current_app
+from flask import (Flask, render_template, request, jsonify, g, current_app, make_response,
+                   stream_with_context, abort, send_from_directory)
+from werkzeug.security import safe_join
 import polars as pl
 import json
 
@@ -15,7 +24,17 @@ sentry_sdk.init(
     profiles_sample_rate=1.0,
 )
 
-from functions import getacc, getmetadata, getduckdb, SearchError
+from functions import (getacc, getacc_by_accession, getgather, getmetadata, getindexversion,
+                       getindexmarks, getaccessionsat, getduckdb, getmags, lookup_metadata,
+                       results_to_json, index_shards, check_columns, SearchError)
+from accessions import AccessionSet, encode_expr
+from assets import Assets
+from examples import EXAMPLES, ExampleCache
+from progressive import downsample_signature
+from saved_searches import SavedSearches, appended_since, normalize_signature
+from schemas import AccessionSearch, MagsQuery, SavedSearch
+from sketching import SketchJobs, SketchBusy, UploadTooLarge, UploadTooSlow
+from validators import validate_json, validate_query
 
 
 def http_pool():
@@ -32,7 +51,8 @@ def duckdb_client(config):
     return g.duckdb_client
 
 def create_app():
-    app = Flask(__name__)
+    # static files are served by static_files(), with the built assets
+    app = Flask(__name__, static_folder=None)
 
     with app.app_context():
         # may not be needed/not yet integrated
@@ -66,12 +86,181 @@ def teardown_duckdb_client(exception):
         client.close()
 
 
+def failed_shards():
+    # index shards that failed or timed out during this request
+    return g.setdefault('failed_shards', [])
+
+@app.after_request
+def flag_partial_results(response):
+    # results are missing the datasets in the shards that did not answer
+    failed = g.get('failed_shards')
+    if failed:
+        response.headers['X-Partial-Results'] = f"{len(failed)} index shards did not answer"
+    return response
+
+
+# fingerprinted and precompressed by `python assets.py`, see asset() in templates
+ASSETS = Assets()
+app.jinja_env.globals['asset'] = ASSETS.url
+# for WebAssembly.instantiateStreaming
+mimetypes.add_type('application/wasm', '.wasm')
+
+
+@app.route('/static/<path:filename>', methods=['GET'])
+def static_files(filename):
+    path = safe_join(str(ASSETS.static_dir), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    sent, encoding = ASSETS.variant(filename, request.accept_encodings)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(ASSETS.static_dir, sent, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if ASSETS.is_immutable(filename):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+STATS_TTL = 60
+STATS_CHECKED = time.monotonic()
+
+
+def index_stats():
+    '''index stats, checked again every STATS_TTL seconds
+
+    The index servers switch to new index versions without a restart
+    (`--watch`), and report the version they serve with their stats.
+    '''
+    global STATS_CHECKED
+    if time.monotonic() - STATS_CHECKED > STATS_TTL:
+        STATS_CHECKED = time.monotonic()
+        try:
+            metadata = getmetadata(app.config, http_pool())
+        except SearchError as e:
+            print(f"Could not refresh index stats: {e}")
+        else:
+            if metadata.get('version') != app.config.metadata.get('version'):
+                print(f"Index version is now {metadata.get('version')}")
+            app.config.metadata = metadata
+    return app.config.metadata
+
+
 KSIZE = app.config.get('ksize', 21)
 THRESHOLD = app.config.get('threshold', 0.1)
 METADATA = app.config.get('metadata', {})
 print(f'ksize: {KSIZE}')
 print(f'threshold: {THRESHOLD}')
 
+# accession linkage list, encoded once for integer membership tests
+with open("my_accessions.json") as f:
+    LINKED_ACCESSIONS = AccessionSet(json.load(f)["accessions"])
+print(f'linked accessions: {len(LINKED_ACCESSIONS)}')
+
+
+def form_threshold(form_data):
+    '''optional minimum containment from a request, None if not set'''
+    threshold = form_data.get('threshold')
+    if threshold is None:
+        return None
+    try:
+        threshold = float(threshold)
+    except (TypeError, ValueError):
+        threshold = -1
+    if not 0 <= threshold <= 1:
+        raise ValueError("threshold must be a number between 0 and 1")
+    return threshold
+
+
+def form_metadata(form_data):
+    '''metadata columns requested (default: BASIC_METADATA), ValueError if not column names'''
+    meta_list = form_data.get('metadata') or BASIC_METADATA
+    if isinstance(meta_list, str):
+        meta_list = meta_list.split(",")
+    return check_columns(meta_list)
+
+
+# server-side sketching of uploaded sequences, in background processes
+# limited across all web workers
+SKETCH_JOBS = SketchJobs(app.config.get('sketch_dir', '/data/uploads'),
+                         workers=app.config.get('sketch_workers', 2),
+                         max_upload_mb=app.config.get('sketch_max_upload_mb', 2048),
+                         upload_timeout=app.config.get('sketch_upload_timeout', 60))
+
+
+# metadata returned by 'basic' queries
+BASIC_METADATA = ('bioproject', 'assay_type',
+                  'collection_date_sam', 'geo_loc_name_country_calc', 'organism', 'lat_lon')
+
+
+def search_example(signature):
+    # same search as the 'basic' query in the home page
+    with app.app_context():
+        failed = []
+        mastiff_df = getacc(signature, app.config, http_pool(), failed_shards=failed)
+        if failed:
+            # partial results are not worth keeping
+            raise SearchError("Index shards are not all available", 503)
+        result_list = getduckdb(mastiff_df, BASIC_METADATA, app.config,
+                                duckdb_client(app.config)).pl()
+        return results_to_json(result_list)
+
+
+def example_fingerprint():
+    # results change with the index, or with the metadata joined to them
+    with app.app_context():
+        version = getindexversion(app.config, http_pool())
+    metadata_mtime = int(os.path.getmtime(app.config['metadata_duckdb']))
+    return f"{version}-{metadata_mtime}"
+
+
+EXAMPLE_CACHE = ExampleCache(search_example, example_fingerprint,
+                             app.config.get('examples_cache_dir', '/tmp/branchwater-examples'))
+
+
+# set once this worker finished warming up, see /ready
+READY = threading.Event()
+# kept open for the life of the worker: connections opened for each request
+# share its database instance, with the catalog and cached pages
+WARM_DUCKDB = None
+
+
+def warm_up():
+    '''run the warm-up queries (warmup_queries in config.yml) in this worker
+
+    Everything loaded at import time is shared by the web workers when
+    gunicorn preloads the app (see gunicorn.conf.py); DuckDB is not safe
+    to use across a fork, so it is warmed up in each worker instead.
+    '''
+    global WARM_DUCKDB
+    try:
+        WARM_DUCKDB = duckdb.connect(database=app.config['metadata_duckdb'], read_only=True)
+        for query in app.config.get('warmup_queries') or []:
+            WARM_DUCKDB.execute(query).fetchall()
+
+        # the same join as searches, on the columns they return
+        accs = app.config.get('warmup_accessions') or []
+        mastiff_df = (pl.DataFrame({"SRA_accession": accs, "containment": [1.0] * len(accs)},
+                                   schema={"SRA_accession": pl.String, "containment": pl.Float64})
+            .with_columns(cANI=pl.lit(1.0), acc_key=encode_expr("SRA_accession")))
+        getduckdb(mastiff_df, BASIC_METADATA, app.config, WARM_DUCKDB).fetchall()
+
+        if app.config.get('precompute_examples', True):
+            EXAMPLE_CACHE.warm()
+    except Exception as e:
+        # a slow worker is better than no worker
+        print(f"Warm-up failed: {e}")
+
+    READY.set()
+    print(f"Worker {os.getpid()} is ready")
+
+
+def start_warm_up():
+    threading.Thread(target=warm_up, daemon=True).start()
+
 
 # define '/' and 'home' route
 @app.route('/', methods=['GET', "POST"])
@@ -84,33 +273,21 @@ def home():
         # get acc from mastiff (imported from acc.py)
         signatures = form_data['signatures']
         try:
-            mastiff_df = getacc(signatures, app.config, http_pool())
+            mastiff_df = getacc(signatures, app.config, http_pool(), failed_shards=failed_shards())
         except SearchError as e:
             return e.args
 
         # for 'basic' query, override metadata form with selected categories
-        meta_list = ('bioproject', 'assay_type',
-                     'collection_date_sam', 'geo_loc_name_country_calc', 'organism', 'lat_lon')
+        meta_list = BASIC_METADATA
 
         # get metadata from duckdb
         result_list = getduckdb(mastiff_df, meta_list, app.config, duckdb_client(app.config)).pl()
         print(f"FIRST RESULT for {result_list[0]}.")
         print(f"Metadata for {len(result_list)} acc returned.")
+        # runs linked to MGnify MAGs are flagged by getduckdb (annotate_mags in config.yml)
 
-        # TODO: complete mag run linkage using this
-        # with open("public_emg_runs.json") as f:
-        #     accession_data = json.load(f)
-        #
-        # # Convert to Polars Series for faster .is_in checks
-        # accession_series = pl.Series("acc", accession_data["accessions"])
-        #
-        # result_list = result_list.with_columns(
-        #     pl.col("acc").is_in(accession_series).alias("in_json_file")
-        # )
-
-
-        return result_list.fill_null("NP").write_json(None)  # return metadata results to client
-    return render_template('index.html', n_datasets=f"{app.config.metadata['n_datasets']:,}")
+        return results_to_json(result_list)  # return metadata results to client
+    return render_template('index.html', n_datasets=f"{index_stats()['n_datasets']:,}")
 
 
 @app.route('/advanced', methods=['GET', "POST"])
@@ -120,40 +297,423 @@ def advanced():
         form_data = request.get_json()
         # print(f"Form JSON is {sys.getsizeof(form_data)} bytes.")
 
+        # optional minimum containment set in the form (default: THRESHOLD),
+        # and the metadata columns selected
+        try:
+            threshold = form_threshold(form_data)
+            meta_list = check_columns(key for key, value in form_data['metadata'].items() if value)
+        except ValueError as e:
+            return jsonify({"error": "validation_error", "message": str(e)}), 422
+
         # get acc from mastiff (imported from acc.py)
         signatures = form_data['signatures']
         try:
-            mastiff_df = getacc(signatures, app.config, http_pool())
+            mastiff_df = getacc(signatures, app.config, http_pool(), threshold=threshold,
+                                failed_shards=failed_shards())
         except SearchError as e:
             return e.args
 
         # get metadata from duckdb
-        meta_dic = form_data['metadata']
-        meta_list = tuple([
-                          key for key, value in meta_dic.items() if value])
-
         result_list = getduckdb(mastiff_df, meta_list, app.config, duckdb_client(app.config)).pl()
         print(f"Metadata for {len(result_list)} acc returned.")
 
 
-        with open("my_accessions.json") as f:
-            accession_data = json.load(f)
-
-        # Convert to Polars Series for faster .is_in checks
-        accession_series = pl.Series("acc", accession_data["accessions"])
-
         result_list = result_list.with_columns(
-            pl.col("acc").is_in(accession_series).alias("in_json_file")
+            LINKED_ACCESSIONS.contains("acc").alias("in_json_file")
         )
 
         print(f"MGS ALTERED DATA  {result_list[0]}.")
-        return result_list.fill_null("NP").write_json(None)  # return metadata results to client
-    return render_template('advanced.html')
+        return results_to_json(result_list)  # return metadata results to client
+    return render_template('advanced.html', threshold=THRESHOLD)
+
+
+@app.route('/batch', methods=["POST"])
+def batch():
+    # several signatures in one request; results are tagged by query_name
+    form_data = request.get_json()
+
+    signatures = form_data['signatures']
+    if isinstance(signatures, str):
+        signatures = [signatures]
+    try:
+        threshold = form_threshold(form_data)
+        meta_list = form_metadata(form_data)
+    except ValueError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 422
+    try:
+        mastiff_df = getacc(signatures, app.config, http_pool(), threshold=threshold,
+                            failed_shards=failed_shards())
+    except SearchError as e:
+        return e.args
+
+    result_list = getduckdb(mastiff_df, meta_list, app.config, duckdb_client(app.config)).pl()
+    print(f"Metadata for {len(result_list)} acc returned for {len(signatures)} queries.")
+
+    return results_to_json(result_list)
+
+
+@app.route('/accession', methods=["POST"])
+@validate_json(AccessionSearch)
+def accession_search():
+    # search with a dataset already in the index, using its stored signature;
+    # results for popular accessions are cached by the index server
+    query = g.payload
+    try:
+        mastiff_df = getacc_by_accession(query.accession, app.config, http_pool(),
+                                         threshold=query.threshold,
+                                         failed_shards=failed_shards())
+    except SearchError as e:
+        return e.args
+
+    meta_list = query.metadata or BASIC_METADATA
+    result_list = getduckdb(mastiff_df, meta_list, app.config, duckdb_client(app.config)).pl()
+    print(f"Metadata for {len(result_list)} acc returned for {query.accession}.")
+
+    return results_to_json(result_list)
+
+
+@app.route('/upload', methods=["POST"])
+def upload():
+    # gzipped FASTA/FASTQ streamed in the request body, sketched here instead
+    # of in the browser; the sketch runs in the background, and the results
+    # are fetched from /upload/<job_id> once it is done
+    try:
+        threshold = form_threshold(request.args)
+        meta_list = check_columns(request.args.getlist('metadata') or BASIC_METADATA)
+    except ValueError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 422
+    name = request.args.get('name', 'uploaded sequences')
+
+    try:
+        job_id = SKETCH_JOBS.submit(request.stream, name,
+                                    {"threshold": threshold, "metadata": meta_list},
+                                    request.content_length)
+    except UploadTooLarge:
+        return jsonify({"error": "upload_too_large",
+                        "message": f"uploads are limited to {SKETCH_JOBS.max_upload // 2**20} MB"}), 413
+    except UploadTooSlow:
+        return jsonify({"error": "upload_too_slow",
+                        "message": f"uploads must be received within {SKETCH_JOBS.upload_timeout} seconds"}), 408
+    except SketchBusy:
+        return (jsonify({"error": "busy", "message": "too many uploads being sketched, try again later"}),
+                503, {"Retry-After": "30"})
+
+    return (jsonify({"id": job_id, "status": "sketching"}),
+            202, {"Location": f"/upload/{job_id}", "Retry-After": "5"})
+
+
+@app.route('/upload/<job_id>', methods=["GET"])
+def upload_results(job_id):
+    # 202 while the upload is being sketched, then the search results
+    try:
+        state, result = SKETCH_JOBS.status(job_id)
+    except KeyError:
+        return jsonify({"error": "not_found", "message": f"unknown upload {job_id}"}), 404
+    if state == 'sketching':
+        return jsonify({"id": job_id, "status": state}), 202, {"Retry-After": "5"}
+    if state == 'failed':
+        return jsonify({"error": "invalid_sequences", "message": result}), 422
+
+    signature, params = result
+    try:
+        mastiff_df = getacc(signature, app.config, http_pool(), threshold=params['threshold'],
+                            failed_shards=failed_shards())
+    except SearchError as e:
+        return e.args
+
+    result_list = getduckdb(mastiff_df, params['metadata'], app.config, duckdb_client(app.config)).pl()
+    print(f"Metadata for {len(result_list)} acc returned for upload {job_id}.")
+
+    return results_to_json(result_list)
+
+
+PREVIEW_FACTOR = app.config.get('preview_factor', 10)
+
+
+def progressive_results(signature, threshold, meta_list):
+    # the exact search starts right away, next to the preview
+    http = http_pool()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        exact = pool.submit(getacc, signature, app.config, http, threshold=threshold,
+                            failed_shards=failed_shards())
+        try:
+            preview = pool.submit(getacc, downsample_signature(signature, PREVIEW_FACTOR),
+                                  app.config, http, threshold=threshold,
+                                  downsampled=PREVIEW_FACTOR)
+        except (ValueError, KeyError) as e:
+            # e.g. a num sketch, which can't be downsampled
+            print(f"No preview: {e}")
+            preview = None
+
+        if preview is not None and not exact.done():
+            try:
+                preview_df = preview.result()
+            except SearchError as e:
+                print(f"Preview failed: {e}")
+            else:
+                if not exact.done():
+                    result_list = getduckdb(preview_df, meta_list, app.config,
+                                            duckdb_client(app.config)).pl()
+                    yield json.dumps({"phase": "preview", "approximate": True,
+                                      "results": json.loads(results_to_json(result_list))}) + "\n"
+
+        try:
+            mastiff_df = exact.result()
+        except SearchError as e:
+            message, status = e.args
+            yield json.dumps({"phase": "error", "status": status, "message": message}) + "\n"
+            return
+        result_list = getduckdb(mastiff_df, meta_list, app.config, duckdb_client(app.config)).pl()
+        yield json.dumps({"phase": "exact", "approximate": False, "partial": bool(g.get('failed_shards')),
+                          "results": json.loads(results_to_json(result_list))}) + "\n"
+
+
+@app.route('/progressive', methods=["POST"])
+def progressive():
+    # newline-delimited JSON: approximate results from a downsampled query
+    # first (if they arrive before the exact ones), then the exact results
+    # that replace them
+    form_data = request.get_json()
+    try:
+        threshold = form_threshold(form_data)
+        meta_list = form_metadata(form_data)
+    except ValueError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 422
+
+    return app.response_class(
+        stream_with_context(progressive_results(form_data['signatures'], threshold, meta_list)),
+        mimetype='application/x-ndjson')
+
+
+SAVED_SEARCHES = SavedSearches(app.config.get('saved_searches_dir', '/data/saved_searches'))
+
+
+@app.route('/saved', methods=["POST"])
+@validate_json(SavedSearch)
+def save_search():
+    # search, and keep the signature and results to re-run it after index updates
+    query = g.payload
+    try:
+        signature = normalize_signature(query.signatures)
+    except ValueError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 422
+
+    failed = []
+    try:
+        # marks from before the search: datasets added during it are searched again
+        # in the next re-run, and are only kept once
+        marks = getindexmarks(app.config, http_pool())
+        mastiff_df = getacc(signature, app.config, http_pool(), threshold=query.threshold,
+                            failed_shards=failed)
+    except SearchError as e:
+        return e.args
+    if failed:
+        # a re-run would never search the missing shards' current datasets
+        return jsonify({"error": "partial_results",
+                        "message": "index shards are not all available, try again later"}), 503
+
+    meta_list = query.metadata or BASIC_METADATA
+    search_id = SAVED_SEARCHES.create(signature, query.threshold, meta_list, marks, mastiff_df)
+    print(f"Saved search {search_id} with {len(mastiff_df)} results.")
+
+    result_list = getduckdb(mastiff_df, meta_list, app.config, duckdb_client(app.config)).pl()
+    return results_to_json(result_list), 201, {'Location': f"/saved/{search_id}",
+                                                'Content-Type': 'application/json'}
+
+
+@app.route('/saved/<search_id>', methods=["GET"])
+def saved_search(search_id):
+    # stored results, with the current metadata
+    try:
+        info, mastiff_df = SAVED_SEARCHES.load(search_id)
+    except KeyError:
+        return jsonify({"error": "not_found", "message": f"unknown saved search {search_id}"}), 404
+
+    result_list = getduckdb(mastiff_df, info['metadata'], app.config, duckdb_client(app.config)).pl()
+    return results_to_json(result_list), {'Content-Type': 'application/json'}
+
+
+@app.route('/saved/<search_id>/rerun', methods=["POST"])
+def rerun_saved_search(search_id):
+    # search only the datasets added to the index since the last run,
+    # and return the new matches; they are added to the stored results
+    try:
+        info, _ = SAVED_SEARCHES.load(search_id)
+    except KeyError:
+        return jsonify({"error": "not_found", "message": f"unknown saved search {search_id}"}), 404
+
+    with SAVED_SEARCHES.lock(search_id):
+        # another re-run may have finished while waiting
+        info, stored_df = SAVED_SEARCHES.load(search_id)
+        saved = info['index']
+        failed = []
+        try:
+            current = getindexmarks(app.config, http_pool())
+            accessions_at = getaccessionsat(
+                {url: saved[url]['n_datasets'] - 1 for url, mark in current.items()
+                 if url in saved and 0 < saved[url]['n_datasets'] <= mark['n_datasets']},
+                app.config, http_pool())
+            since = appended_since(saved, current, accessions_at)
+            if since is None:
+                print(f"Index was rebuilt, re-running saved search {search_id} in full")
+            found_df = getacc(info['signature'], app.config, http_pool(), threshold=info['threshold'],
+                              failed_shards=failed, since=since)
+        except SearchError as e:
+            return e.args
+
+        if since is None and failed:
+            return jsonify({"error": "partial_results",
+                            "message": "index shards are not all available, try again later"}), 503
+
+        new_df = found_df.join(stored_df.select("SRA_accession"), on="SRA_accession", how="anti")
+        # if dataset positions changed, the full results replace the stored ones
+        merged_df = (found_df if since is None else pl.concat([stored_df, new_df], how="vertical_relaxed"))
+        merged_df = merged_df.sort("containment", descending=True)
+
+        # shards that did not answer are searched from the same position next time
+        marks = {url: mark for url, mark in current.items() if url not in failed}
+        marks.update({url: saved[url] for url in failed if url in saved})
+        SAVED_SEARCHES.save(search_id, info, marks, merged_df)
+        print(f"Saved search {search_id}: {len(new_df)} new results, {len(merged_df)} in total.")
+
+    result_list = getduckdb(new_df, info['metadata'], app.config, duckdb_client(app.config)).pl()
+    return results_to_json(result_list), {'Content-Type': 'application/json'}
+
+
+# response formats for metadata lookups; all but json are streamed
+LOOKUP_FORMATS = {
+    "json": "application/json",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+LOOKUP_MAX_ACCESSIONS = app.config.get('lookup_max_accessions', 1_000_000)
+
+
+def lookup_format():
+    # ?format= wins over the Accept header
+    fmt = request.args.get('format')
+    if fmt in LOOKUP_FORMATS:
+        return fmt
+    best = request.accept_mimetypes.best_match(list(LOOKUP_FORMATS.values()), "application/json")
+    return next(f for f, mime in LOOKUP_FORMATS.items() if mime == best)
+
+
+def lookup_frames(reader):
+    # metadata rows in batches, flagged if linked to MGnify analyses
+    empty = True
+    for batch in reader:
+        empty = False
+        yield pl.from_arrow(batch).with_columns(LINKED_ACCESSIONS.contains("acc").alias("in_json_file"))
+    if empty:
+        yield pl.from_arrow(reader.schema.empty_table()).with_columns(
+            LINKED_ACCESSIONS.contains("acc").alias("in_json_file"))
+
+
+def stream_lookup(reader, fmt):
+    header = True
+    sink = io.BytesIO()
+    writer = None
+    for df in lookup_frames(reader):
+        if fmt == "csv":
+            yield df.write_csv(include_header=header)
+            header = False
+        elif fmt == "ndjson":
+            yield df.write_ndjson()
+        else:
+            table = df.to_arrow()
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, table.schema)
+            writer.write_table(table)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+
+@app.route('/lookup', methods=["POST"])
+def lookup():
+    # metadata for a list of accessions, without a signature search.
+    # JSON body {"accessions": [...], "metadata": [...]}, or a file upload
+    # ('accessions' field, one per line) with 'metadata' form fields
+    if 'accessions' in request.files:
+        acc_list = [line.strip() for line in
+                    request.files['accessions'].read().decode('utf-8').splitlines()]
+        meta_list = request.form.getlist('metadata')
+    else:
+        form_data = request.get_json(silent=True) or {}
+        acc_list = form_data.get('accessions') or []
+        meta_list = form_data.get('metadata') or []
+    if isinstance(meta_list, str):
+        meta_list = meta_list.split(",")
+    acc_list = [acc for acc in acc_list if isinstance(acc, str) and acc and not acc.startswith("#")]
+    meta_list = [c.strip() for c in meta_list] or list(BASIC_METADATA)
+
+    if not acc_list:
+        return jsonify({"error": "validation_error", "message": "no accessions given"}), 422
+    if len(acc_list) > LOOKUP_MAX_ACCESSIONS:
+        return jsonify({"error": "validation_error",
+                        "message": f"at most {LOOKUP_MAX_ACCESSIONS:,} accessions per lookup"}), 422
+    try:
+        reader = lookup_metadata(acc_list, meta_list, duckdb_client(app.config))
+    except (ValueError, duckdb.BinderException) as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 422
+    print(f"Metadata lookup for {len(acc_list)} accessions.")
+
+    fmt = lookup_format()
+    if fmt == "json":
+        return results_to_json(pl.concat(lookup_frames(reader)))
+    return app.response_class(stream_with_context(stream_lookup(reader, fmt)),
+                              mimetype=LOOKUP_FORMATS[fmt])
+
+
+@app.route('/mags', methods=["GET"])
+@validate_query(MagsQuery)
+def mags():
+    # MAGs in an MGnify catalogue built from a run (tables from metadata/load_mags.py)
+    query = g.query
+    try:
+        result_list = getmags(query.accession, query.catalogue, duckdb_client(app.config)).pl()
+    except duckdb.CatalogException:
+        return jsonify({"error": "not_available", "message": "MAG linkage is not loaded"}), 503
+
+    return results_to_json(result_list)
+
+
+@app.route('/gather', methods=["POST"])
+def gather():
+    # non-redundant matches (min-set-cover) instead of every containment match
+    form_data = request.get_json()
+
+    threshold_bp = form_data.get('threshold_bp')
+    if threshold_bp is not None:
+        if not isinstance(threshold_bp, int) or threshold_bp < 0:
+            return jsonify({"error": "validation_error",
+                            "message": "threshold_bp must be a non-negative integer"}), 422
+    try:
+        meta_list = form_metadata(form_data)
+    except ValueError as e:
+        return jsonify({"error": "validation_error", "message": str(e)}), 422
+
+    try:
+        gather_df = getgather(form_data['signatures'], app.config, http_pool(),
+                              threshold_bp=threshold_bp)
+    except SearchError as e:
+        return e.args
+
+    result_list = (getduckdb(gather_df, meta_list, app.config, duckdb_client(app.config))
+        .pl()
+        .sort("gather_result_rank"))
+    print(f"Metadata for {len(result_list)} gather results returned.")
+
+    return results_to_json(result_list)
 
 
 @app.route('/about', methods=['GET', "POST"])
 def metadata():
-    return render_template('about.html', n_datasets=f"{app.config.metadata['n_datasets']:,}")
+    return render_template('about.html', n_datasets=f"{index_stats()['n_datasets']:,}")
 
 @app.route('/contact', methods=['GET', "POST"])
 def contact():
@@ -162,10 +722,64 @@ def contact():
 @app.route('/examples', methods=['GET', "POST"])
 def examples():
     # note, fetch call sends to '/' route to return 'simple search' results
-    return render_template('examples.html', n_datasets=f"{app.config.metadata['n_datasets']:,}")
+    return render_template('examples.html', n_datasets=f"{index_stats()['n_datasets']:,}")
+
+
+@app.route('/examples/<example_id>', methods=['GET'])
+def example_results(example_id):
+    # precomputed results for the examples page, no live search needed
+    if example_id not in EXAMPLES:
+        return jsonify({"error": "not_found", "message": f"unknown example {example_id}"}), 404
+    try:
+        results, fingerprint = EXAMPLE_CACHE.get(example_id)
+    except SearchError as e:
+        return e.args
+
+    if request.accept_encodings['gzip']:
+        response = make_response(results)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(gzip.decompress(results))
+    response.mimetype = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(fingerprint)
+    return response.make_conditional(request)
+
+
+# health checks answer quickly, even if an index server doesn't
+HEALTH_TIMEOUT = urllib3.Timeout(connect=2, read=5)
+
+
+def index_healthy(http, base_url):
+    try:
+        r = http.request('GET', f"{base_url}/health", timeout=HEALTH_TIMEOUT, retries=False)
+    except urllib3.exceptions.HTTPError:
+        return False
+    return r.status == 200
+
+
+@app.route('/health', methods=['GET'])
+def check_health():
+    # liveness: this worker answers, and can reach every index shard
+    http = http_pool()
+    shards = index_shards(current_app.config)
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        if not all(pool.map(lambda base_url: index_healthy(http, base_url), shards)):
+            return jsonify({'status': 'index_unavailable'}), 503
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/ready', methods=['GET'])
+def check_ready():
+    # readiness: only once warmed up, so new workers join the load balancer already fast
+    if not READY.is_set():
+        return jsonify({'status': 'warming_up'}), 503, {'Retry-After': '5'}
+    return jsonify({'status': 'ready'})
 
 
 # in production this changes:
 #
 if __name__ == '__main__':
+    start_warm_up()
     app.run(debug=False, host='0.0.0.0', port=8000)
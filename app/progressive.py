@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+
+"""Progressive search: a quick preview from a downsampled query, then exact results.
+
+A query keeps only its hashes below `max_hash / factor`, like a sketch
+with a `factor` times coarser scaled, but it is still sent at the index
+scaled so the index server accepts it. Containment is estimated on the
+kept hashes, and a search costs about `factor` times less. The index
+server is told the query was downsampled, so its minimum match size
+(threshold_bp) shrinks by the same factor instead of dropping the
+smaller matches from the preview.
+
+Run as a script to measure the recall of the preview against the exact
+search, for the example signatures or the signature files given.
+"""
+
+import hashlib
+import json
+
+import polars as pl
+
+
+def downsample_signature(signature, factor):
+    '''signature JSON with only the hashes a `factor` times coarser sketch keeps'''
+    sig = json.loads(signature)
+    if isinstance(sig, list):
+        sig = sig[0]
+
+    for sketch in sig['signatures']:
+        if not sketch.get('max_hash'):
+            raise ValueError("only scaled signatures can be downsampled")
+        max_hash = sketch['max_hash'] // factor
+        keep = [i for i, h in enumerate(sketch['mins']) if h < max_hash]
+        sketch['mins'] = [sketch['mins'][i] for i in keep]
+        if sketch.get('abundances'):
+            sketch['abundances'] = [sketch['abundances'][i] for i in keep]
+        # same as sourmash, so the sketch still identifies itself correctly
+        md5 = hashlib.md5(str(sketch['ksize']).encode())
+        for h in sketch['mins']:
+            md5.update(str(h).encode())
+        sketch['md5sum'] = md5.hexdigest()
+
+    return json.dumps(sig, separators=(',', ':'))
+
+
+def recall(preview_df, exact_df, top=None):
+    '''fraction of the (`top`) exact matches that are also in the preview'''
+    exact = exact_df.sort("containment", descending=True)
+    if top is not None:
+        exact = exact.head(top)
+    if len(exact) == 0:
+        return 1.0
+    found = exact.join(preview_df.select("SRA_accession"), on="SRA_accession", how="semi")
+    return len(found) / len(exact)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from pathlib import Path
+
+    import urllib3
+    import yaml
+
+    from examples import EXAMPLES, example_signature
+    from functions import getacc, getmetadata
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("signatures", nargs="*", help="signature files (default: the examples)")
+    parser.add_argument("-c", "--config", default="config.yml")
+    parser.add_argument("-f", "--factor", type=int, action="append",
+                        help="downsampling factors to compare (default: preview_factor)")
+    args = parser.parse_args()
+
+    class Config(dict):
+        pass
+
+    with open(args.config) as f:
+        config = Config(yaml.safe_load(f))
+    http = urllib3.PoolManager()
+    config.metadata = getmetadata(config, http)
+    factors = args.factor or [config.get('preview_factor', 10)]
+
+    queries = {Path(p).name: Path(p).read_text() for p in args.signatures} or \
+        {example_id: example_signature(example_id) for example_id in EXAMPLES}
+
+    rows = []
+    for name, signature in queries.items():
+        start = time.perf_counter()
+        exact_df = getacc(signature, config, http)
+        exact_time = time.perf_counter() - start
+        for factor in factors:
+            start = time.perf_counter()
+            preview_df = getacc(downsample_signature(signature, factor), config, http,
+                                downsampled=factor)
+            rows.append({
+                "query": name,
+                "factor": factor,
+                "exact_matches": len(exact_df),
+                "preview_matches": len(preview_df),
+                "exact_s": round(exact_time, 2),
+                "preview_s": round(time.perf_counter() - start, 2),
+                "recall": round(recall(preview_df, exact_df), 3),
+                "recall_top100": round(recall(preview_df, exact_df, top=100), 3),
+            })
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(pl.DataFrame(rows))
@@ -0,0 +1,108 @@
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import polars as pl
+
+
+SEARCH_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def normalize_signature(signature):
+    '''compact JSON for a single signature, as stored and sent to the index'''
+    try:
+        sig = json.loads(signature)
+    except (TypeError, ValueError):
+        raise ValueError("signatures must be a signature in JSON format")
+    if isinstance(sig, list):
+        if len(sig) != 1:
+            raise ValueError("saved searches have a single signature")
+        sig = sig[0]
+    if not isinstance(sig, dict):
+        raise ValueError("signatures must be a signature in JSON format")
+    return json.dumps(sig, separators=(',', ':'), sort_keys=True)
+
+
+def appended_since(saved, current, accessions_at):
+    '''position of the first new dataset in each shard, None if the index was rebuilt
+
+    `saved` and `current` are index marks (see `getindexmarks`), and
+    `accessions_at` the accession now at each shard's last saved position.
+    Shards without new datasets are left out; new shards are searched whole.
+    '''
+    since = {}
+    for url, mark in current.items():
+        old = saved.get(url)
+        if old is None:
+            since[url] = 0
+            continue
+        n = old['n_datasets']
+        if mark['n_datasets'] < n or (n and accessions_at.get(url) != old['last_accession']):
+            # datasets were removed or reordered, positions can't be compared
+            return None
+        if mark['n_datasets'] > n:
+            since[url] = n
+    return since
+
+
+class SavedSearches:
+    '''searches stored to be re-run as datasets are added to the index
+
+    Each search is a directory in `directory`, with the normalized signature,
+    the search parameters and the index marks it was last run against
+    (search.json), and its matches without metadata (results.parquet), so
+    results are always shown with the current metadata.
+    '''
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path(self, search_id):
+        if not SEARCH_ID.match(search_id):
+            raise KeyError(search_id)
+        return self.directory / search_id
+
+    def create(self, signature, threshold, meta_list, marks, results):
+        search_id = uuid.uuid4().hex
+        self.path(search_id).mkdir(parents=True)
+        info = {
+            "signature": signature,
+            "threshold": threshold,
+            "metadata": list(meta_list),
+            "created": time.time(),
+        }
+        self.save(search_id, info, marks, results)
+        return search_id
+
+    def load(self, search_id):
+        '''search info and stored results, KeyError if there is no such search'''
+        path = self.path(search_id)
+        try:
+            info = json.loads((path / "search.json").read_text())
+        except FileNotFoundError:
+            raise KeyError(search_id)
+        return info, pl.read_parquet(path / "results.parquet")
+
+    def save(self, search_id, info, marks, results):
+        path = self.path(search_id)
+        info = {**info, "index": marks, "updated": time.time()}
+
+        # results first: a search.json always has the results it describes
+        tmp = path / "results.parquet.tmp"
+        results.write_parquet(tmp)
+        os.replace(tmp, path / "results.parquet")
+        tmp = path / "search.json.tmp"
+        tmp.write_text(json.dumps(info))
+        os.replace(tmp, path / "search.json")
+
+    @contextmanager
+    def lock(self, search_id):
+        # re-runs of the same search wait for each other, across web workers
+        with open(self.path(search_id) / "lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
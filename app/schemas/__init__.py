@@ -1,7 +1,10 @@
+from .accession_search import AccessionSearch
 from .mags_query import MagsQuery
+from .saved_search import SavedSearch
 
 
 __all__ = (
+    "AccessionSearch",
     "MagsQuery",
+    "SavedSearch",
 )
-
@@ -0,0 +1,11 @@
+from typing import Annotated, List, Optional
+
+from pydantic import BaseModel, Field, ConfigDict
+
+
+class AccessionSearch(BaseModel):
+    accession: str = Field(min_length=3, pattern=r"^[A-Za-z0-9_.-]+$")
+    threshold: Optional[float] = Field(default=None, ge=0, le=1)
+    # metadata columns to return, used as column names in the metadata query
+    metadata: Optional[List[Annotated[str, Field(pattern=r"^[A-Za-z_][A-Za-z0-9_]*$")]]] = None
+    model_config = ConfigDict(extra="forbid")
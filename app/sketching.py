@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+
+import fcntl
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+
+KSIZE = 21
+SCALED = 1000
+
+# bytes read from the upload at a time
+CHUNK_SIZE = 1024 * 1024
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SketchBusy(Exception):
+    """All sketching slots are taken"""
+
+
+class UploadTooLarge(Exception):
+    """Upload is over the size limit"""
+
+
+class UploadTooSlow(Exception):
+    """Upload took longer than the time allowed to receive it"""
+
+
+def sketch_file(path, name, ksize=KSIZE, scaled=SCALED):
+    '''sketch a (possibly gzipped) FASTA/FASTQ file, returning the signature JSON
+
+    Records are streamed from disk and decompressed as they are read,
+    so the sequences are never all in memory.
+    '''
+    # imported here: only needed in the sketching processes
+    import screed
+    from sourmash import MinHash, SourmashSignature
+    from sourmash.signature import save_signatures_to_json
+
+    mh = MinHash(n=0, ksize=ksize, scaled=scaled)
+    with screed.open(path) as records:
+        for record in records:
+            mh.add_sequence(record.sequence, force=True)
+
+    sig = SourmashSignature(mh, name=name)
+    # a single signature object, like the ones sent by the browser
+    return json.dumps(json.loads(save_signatures_to_json([sig]))[0])
+
+
+def write_json(path, data):
+    # written whole or not at all, for the web workers polling the job
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def run_job(path):
+    '''sketch the upload of the job in `path`, saving the signature or the error'''
+    path = Path(path)
+    job = json.loads((path / "job.json").read_text())
+    try:
+        signature = sketch_file(str(path / "upload"), job['name'])
+    except Exception as e:
+        write_json(path / "error.json", {"message": str(e) or type(e).__name__})
+    else:
+        (path / "signature.json.tmp").write_text(signature)
+        os.replace(path / "signature.json.tmp", path / "signature.json")
+    finally:
+        (path / "upload").unlink(missing_ok=True)
+
+
+class SketchJobs:
+    '''uploads sketched in their own processes, outside of the web workers
+
+    Each job is a directory in `directory`, with the search parameters
+    (job.json), the upload while it is sketched, and then the signature
+    (signature.json) or why sketching failed (error.json). Jobs are on disk
+    so any web worker can report on them, and the uploads are sketched by a
+    separate process, so a long sketch never holds a web worker or runs
+    into its timeout.
+
+    At most `workers` uploads are received or sketched at once, across all
+    web workers: each job holds one of the slot locks in `directory` from
+    the start of its upload until its sketching process exits.
+    '''
+
+    def __init__(self, directory, workers=2, max_upload_mb=2048, upload_timeout=60,
+                 keep_hours=24):
+        self.directory = Path(directory)
+        self.workers = workers
+        self.max_upload = max_upload_mb * 1024 * 1024
+        self.upload_timeout = upload_timeout
+        self.keep = keep_hours * 3600
+        # sketching processes started by this web worker, to be reaped
+        self._running = []
+
+    def path(self, job_id):
+        if not JOB_ID.match(job_id):
+            raise KeyError(job_id)
+        return self.directory / job_id
+
+    def take_slot(self):
+        '''open file locked for one of the sketching slots, SketchBusy if all are taken'''
+        slots = self.directory / "slots"
+        slots.mkdir(parents=True, exist_ok=True)
+        for i in range(self.workers):
+            lock = open(slots / f"{i}.lock", "w")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+            else:
+                return lock
+        raise SketchBusy()
+
+    def submit(self, stream, name, params, content_length=None):
+        '''receive an upload and start sketching it, returning the job id'''
+        if content_length is not None and content_length > self.max_upload:
+            raise UploadTooLarge(content_length)
+        self.cleanup()
+        slot = self.take_slot()
+
+        try:
+            job_id = uuid.uuid4().hex
+            path = self.path(job_id)
+            path.mkdir()
+            # held while the job runs, see status()
+            running = open(path / "lock", "w")
+            fcntl.flock(running, fcntl.LOCK_EX)
+            try:
+                self.receive(stream, path / "upload")
+                write_json(path / "job.json", {"name": name, "params": params,
+                                               "created": time.time()})
+                # the process inherits both locks and holds them until it exits
+                self._running.append(subprocess.Popen(
+                    [sys.executable, __file__, str(path)],
+                    pass_fds=[slot.fileno(), running.fileno()], start_new_session=True))
+            except BaseException:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+            finally:
+                running.close()
+        finally:
+            slot.close()
+        return job_id
+
+    def receive(self, stream, target):
+        # a slow client would hold the web worker until its timeout
+        deadline = time.monotonic() + self.upload_timeout
+        size = 0
+        with open(target, "wb") as upload:
+            while chunk := stream.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_upload:
+                    raise UploadTooLarge(size)
+                if time.monotonic() > deadline:
+                    raise UploadTooSlow(size)
+                upload.write(chunk)
+
+    def status(self, job_id):
+        '''(state, result) of a job: ('sketching', None), ('failed', message)
+        or ('done', (signature, params)); KeyError if there is no such job
+        '''
+        path = self.path(job_id)
+        try:
+            job = json.loads((path / "job.json").read_text())
+        except FileNotFoundError:
+            raise KeyError(job_id)
+
+        if (path / "signature.json").exists():
+            return 'done', ((path / "signature.json").read_text(), job['params'])
+        if (path / "error.json").exists():
+            return 'failed', json.loads((path / "error.json").read_text())['message']
+        with open(path / "lock", "w") as running:
+            try:
+                fcntl.flock(running, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 'sketching', None
+        if (path / "signature.json").exists() or (path / "error.json").exists():
+            # finished since the checks above
+            return self.status(job_id)
+        # the sketching process exited without saving anything
+        return 'failed', "sketching was interrupted"
+
+    def cleanup(self):
+        '''reap finished sketching processes and remove jobs older than `keep_hours`'''
+        self._running = [p for p in self._running if p.poll() is None]
+        if not self.directory.exists():
+            return
+        cutoff = time.time() - self.keep
+        for path in self.directory.iterdir():
+            if JOB_ID.match(path.name) and path.stat().st_mtime < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # started by SketchJobs.submit for each upload
+    run_job(sys.argv[1])
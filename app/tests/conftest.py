@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# the app is run from its own directory, and shares some modules with the
+# metadata build (e.g. accessions.py)
+ROOT = Path(__file__).parent.parent.parent
+sys.path[:0] = [str(ROOT / "app"), str(ROOT / "metadata")]
@@ -0,0 +1,81 @@
+import duckdb
+import polars as pl
+import pytest
+
+import accessions
+from functions import getduckdb, lookup_metadata
+
+
+def test_encode_roundtrip():
+    for acc in ("SRR000001", "ERR1234567", "DRR046817", "SRR00000001", "ZZZ9999999999999"):
+        key = accessions.encode(acc)
+        assert key > 0
+        assert accessions.decode(key) == acc
+
+
+def test_encode_non_conforming():
+    for acc in ("SRR12345", "srr123456", "SAMN12345678", "SRR123456X", ""):
+        assert accessions.encode(acc) is None
+
+
+def test_encode_expr_matches_encode():
+    accs = ["SRR000001", "ERR1234567", "DRR046817", "weird", None]
+    keys = pl.select(accessions.encode_expr(pl.lit(pl.Series(accs)))).to_series().to_list()
+    assert keys == [accessions.encode(a) if a else None for a in accs]
+
+
+def test_accession_set():
+    linked = accessions.AccessionSet(["SRR000001", "weird"])
+    df = pl.DataFrame({"acc": ["SRR000001", "SRR000002", "weird", None]})
+    assert df.select(linked.contains("acc")).to_series().to_list() == [True, False, True, False]
+
+
+def test_getduckdb_joins_on_keys():
+    fallback = accessions.fallback_keys(["SRR000001", "weird"])
+    metadata = (pl.DataFrame({"acc": ["SRR000001", "weird", "SRR000003"],
+                              "organism": ["soil", "marine", "gut"]})
+        .join(fallback.rename({"acc_key": "fallback_key"}), on="acc", how="left")
+        .with_columns(acc_key=pl.coalesce(accessions.encode_expr("acc"), "fallback_key"))
+        .drop("fallback_key"))
+
+    client = duckdb.connect()
+    client.register("metadata", metadata)
+    client.register("acc_fallback", fallback)
+
+    mastiff_df = (pl.DataFrame({"SRA_accession": ["SRR000001", "weird", "SRR000002"],
+                                "containment": [0.9, 0.5, 0.2],
+                                "cANI": [0.99, 0.97, 0.93]})
+        .with_columns(acc_key=accessions.encode_expr("SRA_accession")))
+
+    result = getduckdb(mastiff_df, ("organism",), {}, client).pl().sort("containment")
+    assert result.columns == ["acc", "containment", "cANI", "organism"]
+    assert result.get_column("organism").to_list() == [None, "marine", "soil"]
+
+
+def test_lookup_metadata_keeps_missing():
+    fallback = accessions.fallback_keys(["weird"])
+    metadata = (pl.DataFrame({"acc": ["SRR000001", "weird"], "organism": ["soil", "marine"]})
+        .join(fallback.rename({"acc_key": "fallback_key"}), on="acc", how="left")
+        .with_columns(acc_key=pl.coalesce(accessions.encode_expr("acc"), "fallback_key"))
+        .drop("fallback_key"))
+
+    client = duckdb.connect()
+    client.register("metadata", metadata)
+    client.register("acc_fallback", fallback)
+
+    reader = lookup_metadata(["SRR000001", "weird", "SRR000002"], ["acc", "organism"], client,
+                             batch_rows=2)
+    result = pl.concat(pl.from_arrow(batch) for batch in reader).sort("acc")
+    assert result.columns == ["acc", "organism"]
+    assert result.rows() == [("SRR000001", "soil"), ("SRR000002", None), ("weird", "marine")]
+
+
+def test_getduckdb_rejects_column_names():
+    client = duckdb.connect()
+    mastiff_df = pl.DataFrame({"SRA_accession": ["SRR000001"], "containment": [0.9], "cANI": [0.99]})
+    leak = "(SELECT string_agg(column0, '|') FROM read_csv('/etc/hostname', header=false)) AS leak"
+    for meta_list in ([leak], ["organism", "geo_loc_name_country; --"], "organism"):
+        with pytest.raises(ValueError):
+            getduckdb(mastiff_df, meta_list, {}, client)
+        with pytest.raises(ValueError):
+            lookup_metadata(["SRR000001"], meta_list, client)
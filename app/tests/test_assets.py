@@ -0,0 +1,37 @@
+import gzip
+
+from werkzeug.datastructures import Accept
+
+from assets import Assets, build
+
+
+def test_build_and_negotiate(tmp_path):
+    (tmp_path / "mgnify-component").mkdir()
+    (tmp_path / "mgnify-component" / "bundle.js").write_text("console.log('sketch');\n" * 100)
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG")
+
+    manifest = build(tmp_path)
+    hashed = manifest["mgnify-component/bundle.js"]
+    assert hashed.startswith("mgnify-component/bundle.") and hashed.endswith(".js")
+
+    dist = tmp_path / "dist"
+    # original names are kept for files loaded by name from the bundle
+    assert (dist / "mgnify-component" / "bundle.js").is_file()
+    assert gzip.decompress((dist / (hashed + ".gz")).read_bytes()) == \
+        (tmp_path / "mgnify-component" / "bundle.js").read_bytes()
+    assert not (dist / "logo.png.gz").exists()
+
+    assets = Assets(tmp_path)
+    assert assets.url("mgnify-component/bundle.js") == f"/static/dist/{hashed}"
+    assert assets.url("missing.js") == "/static/missing.js"
+    assert assets.is_immutable(f"dist/{hashed}")
+    assert not assets.is_immutable("dist/mgnify-component/bundle.js")
+
+    sent, encoding = assets.variant(f"dist/{hashed}", Accept([("gzip", 1)]))
+    assert (sent, encoding) == (f"dist/{hashed}.gz", "gzip")
+    assert assets.variant(f"dist/{hashed}", Accept([])) == (f"dist/{hashed}", None)
+
+
+def test_no_build(tmp_path):
+    assets = Assets(tmp_path)
+    assert assets.url("dashboard.js") == "/static/dashboard.js"
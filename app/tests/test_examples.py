@@ -0,0 +1,36 @@
+import gzip
+import json
+
+from examples import EXAMPLES, ExampleCache, example_signature
+
+
+def test_example_signatures():
+    for example_id in EXAMPLES:
+        sig = json.loads(example_signature(example_id))
+        assert sig["signatures"][0]["ksize"] == 21
+
+
+def test_results_cached_per_fingerprint(tmp_path):
+    searches = []
+    version = ["v1"]
+
+    def search(signature):
+        searches.append(signature)
+        return f'[{{"version": "{version[0]}"}}]'
+
+    cache = ExampleCache(search, lambda: version[0], tmp_path, fingerprint_ttl=0)
+    results, fingerprint = cache.get("Promar")
+    assert fingerprint == "v1"
+    assert json.loads(gzip.decompress(results)) == [{"version": "v1"}]
+
+    # from memory, and from disk for other workers
+    cache.get("Promar")
+    ExampleCache(search, lambda: version[0], tmp_path).get("Promar")
+    assert len(searches) == 1
+
+    # a new index invalidates previous results
+    version[0] = "v2"
+    results, fingerprint = cache.get("Promar")
+    assert json.loads(gzip.decompress(results)) == [{"version": "v2"}]
+    assert len(searches) == 2
+    assert [p.name for p in tmp_path.glob("*.json.gz")] == ["Promar-v2.json.gz"]
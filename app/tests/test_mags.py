@@ -0,0 +1,59 @@
+import duckdb
+import polars as pl
+
+import accessions
+import load_mags
+from functions import getduckdb, getmags
+
+
+def metadata_db(tmp_path):
+    database = str(tmp_path / "metadata.duckdb")
+    fallback = accessions.fallback_keys(["weird"])
+    metadata = (pl.DataFrame({"acc": ["SRR000001", "weird", "SRR000003"],
+                              "organism": ["soil", "marine", "gut"]})
+        .join(fallback.rename({"acc_key": "fallback_key"}), on="acc", how="left")
+        .with_columns(acc_key=pl.coalesce(accessions.encode_expr("acc"), "fallback_key"))
+        .drop("fallback_key"))
+
+    conn = duckdb.connect(database)
+    conn.register("orig_metadata", metadata)
+    conn.register("orig_fallback", fallback)
+    conn.sql("""
+        CREATE TABLE metadata AS SELECT * FROM orig_metadata;
+        CREATE TABLE acc_fallback AS SELECT * FROM orig_fallback;
+    """)
+    conn.close()
+
+    (tmp_path / "catalogues.csv").write_text("catalogue_id,name\ngut-v2,Human gut\nsoil-v1,Soil\n")
+    (tmp_path / "run_mags.tsv").write_text(
+        "run_accession\tcatalogue_id\tgenome_accession\n"
+        "SRR000001\tgut-v2\tMGYG000000002\n"
+        "SRR000001\tgut-v2\tMGYG000000001\n"
+        "SRR000001\tsoil-v1\tMGYG000300001\n"
+        "weird\tsoil-v1\tMGYG000300002\n")
+    load_mags.main(catalogues=tmp_path / "catalogues.csv", run_mags=tmp_path / "run_mags.tsv",
+                   database=database)
+    return duckdb.connect(database, read_only=True)
+
+
+def test_getmags(tmp_path):
+    client = metadata_db(tmp_path)
+
+    result = getmags("SRR000001", "gut-v2", client).pl()
+    assert result.get_column("genome_accession").to_list() == ["MGYG000000001", "MGYG000000002"]
+    # non-conforming accessions are found by name
+    assert getmags("weird", "soil-v1", client).pl().height == 1
+    assert getmags("SRR000003", "soil-v1", client).pl().height == 0
+
+
+def test_getduckdb_annotates_mags(tmp_path):
+    client = metadata_db(tmp_path)
+    mastiff_df = (pl.DataFrame({"SRA_accession": ["SRR000001", "weird", "SRR000003"],
+                                "containment": [0.9, 0.5, 0.2],
+                                "cANI": [0.99, 0.97, 0.93]})
+        .with_columns(acc_key=accessions.encode_expr("SRA_accession")))
+
+    result = getduckdb(mastiff_df, ("organism",), {"annotate_mags": True}, client).pl().sort("acc")
+    assert result.columns == ["acc", "containment", "cANI", "organism", "n_mags", "mag_catalogues"]
+    assert result.get_column("n_mags").to_list() == [3, 0, 1]
+    assert result.get_column("mag_catalogues").to_list() == ["gut-v2,soil-v1", None, "soil-v1"]
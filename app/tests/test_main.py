@@ -1,5 +1,6 @@
 from flask import Flask
-from google.auth.transport import urllib3
+import urllib3
+from urllib3.exceptions import MaxRetryError
 
 from app.main import check_health
 
@@ -13,7 +14,7 @@ def test_health_route(monkeypatch):
             self.status = status
             self.data = data
 
-    def dummy_request(self, method, url, headers=None):
+    def dummy_request(self, method, url, headers=None, **kwargs):
         return DummyResponse(200)
 
     monkeypatch.setattr(urllib3.PoolManager, "request", dummy_request)
@@ -23,4 +24,20 @@ def test_health_route(monkeypatch):
     client = app.test_client()
     response = client.get('/health')
     assert response.status_code == 200
-    assert response.get_json() == {'status': 'ok'}
\ No newline at end of file
+    assert response.get_json() == {'status': 'ok'}
+
+
+# /health answers 503 when the index can't be reached
+def test_health_route_index_unreachable(monkeypatch):
+    def dummy_request(self, method, url, headers=None, **kwargs):
+        assert kwargs.get('retries') is False
+        raise MaxRetryError(None, url, "connection refused")
+
+    monkeypatch.setattr(urllib3.PoolManager, "request", dummy_request)
+
+    app = Flask(__name__)
+    app.route('/health', methods=["GET"])(check_health)
+    client = app.test_client()
+    response = client.get('/health')
+    assert response.status_code == 503
+    assert response.get_json() == {'status': 'index_unavailable'}
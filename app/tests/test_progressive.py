@@ -0,0 +1,35 @@
+import json
+
+import polars as pl
+import pytest
+
+from examples import example_signature
+from progressive import downsample_signature, recall
+
+
+def test_downsample_signature():
+    signature = example_signature("Sal")
+    sketch = json.loads(signature)["signatures"][0]
+
+    downsampled = json.loads(downsample_signature(signature, 10))["signatures"][0]
+    cutoff = sketch["max_hash"] // 10
+    assert downsampled["max_hash"] == sketch["max_hash"]
+    assert downsampled["mins"] == [h for h in sketch["mins"] if h < cutoff]
+    assert 0 < len(downsampled["mins"]) < len(sketch["mins"])
+    assert downsampled["md5sum"] != sketch["md5sum"]
+
+    # the md5sum is computed like sourmash does
+    assert json.loads(downsample_signature(signature, 1))["signatures"][0]["md5sum"] == sketch["md5sum"]
+
+    num_sketch = json.dumps({"signatures": [{"ksize": 21, "max_hash": 0, "mins": [1, 2]}]})
+    with pytest.raises(ValueError):
+        downsample_signature(num_sketch, 10)
+
+
+def test_recall():
+    exact = pl.DataFrame({"SRA_accession": ["SRR1", "SRR2", "SRR3", "SRR4"],
+                          "containment": [0.9, 0.5, 0.3, 0.2]})
+    preview = pl.DataFrame({"SRA_accession": ["SRR1", "SRR3"], "containment": [0.8, 0.4]})
+    assert recall(preview, exact) == 0.5
+    assert recall(preview, exact, top=1) == 1.0
+    assert recall(preview, exact.head(0)) == 1.0
@@ -0,0 +1,51 @@
+import polars as pl
+import pytest
+
+from saved_searches import SavedSearches, appended_since, normalize_signature
+
+
+MARKS = {
+    "http://a": {"n_datasets": 10, "last_accession": "SRR000010"},
+    "http://b": {"n_datasets": 5, "last_accession": "SRR000105"},
+}
+
+
+def test_normalize_signature():
+    assert normalize_signature('[{"name": "q",\n "email": ""}]') == '{"email":"","name":"q"}'
+    with pytest.raises(ValueError):
+        normalize_signature('[{}, {}]')
+    with pytest.raises(ValueError):
+        normalize_signature('not json')
+
+
+def test_appended_since():
+    current = {
+        "http://a": {"n_datasets": 12, "last_accession": "SRR000012"},
+        "http://b": {"n_datasets": 5, "last_accession": "SRR000105"},
+        "http://c": {"n_datasets": 3, "last_accession": "SRR000203"},
+    }
+    accessions_at = {"http://a": "SRR000010", "http://b": "SRR000105"}
+    # b has nothing new, c is a new shard
+    assert appended_since(MARKS, current, accessions_at) == {"http://a": 10, "http://c": 0}
+
+    # a was rebuilt: something else is where its last dataset was
+    assert appended_since(MARKS, current, {**accessions_at, "http://a": "SRR999999"}) is None
+
+    shrunk = {**current, "http://b": {"n_datasets": 4, "last_accession": "SRR000104"}}
+    assert appended_since(MARKS, shrunk, accessions_at) is None
+
+
+def test_saved_search_roundtrip(tmp_path):
+    saved = SavedSearches(tmp_path)
+    results = pl.DataFrame({"SRA_accession": ["SRR000001"], "containment": [0.5]})
+    search_id = saved.create('{"name":"q"}', 0.1, ["organism"], MARKS, results)
+
+    info, stored = saved.load(search_id)
+    assert info["index"] == MARKS
+    assert info["metadata"] == ["organism"]
+    assert stored.equals(results)
+
+    with pytest.raises(KeyError):
+        saved.load("0" * 32)
+    with pytest.raises(KeyError):
+        saved.load("../" + search_id)
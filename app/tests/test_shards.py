@@ -0,0 +1,134 @@
+import io
+import json
+
+import pytest
+import urllib3
+
+from functions import SearchError, getacc, getacc_by_accession, getgather, getmetadata
+
+
+class Config(dict):
+    metadata = {'ksize': 21}
+
+
+class Response(io.BytesIO):
+    def __init__(self, status, body, headers=None):
+        super().__init__(body.encode())
+        self.status = status
+        self.headers = headers or {}
+
+    @property
+    def data(self):
+        return self.getvalue()
+
+    def json(self):
+        return json.loads(self.getvalue())
+
+    def release_conn(self):
+        pass
+
+
+class ShardedHTTP:
+    '''fake connection pool, answering for each shard'''
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def request(self, method, url, **kwargs):
+        shard = url.split("/")[2]
+        answer = self.answers[shard]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer()
+
+
+SHARDS = Config(index_shards=["http://a", "http://b"], max_results=2)
+
+
+def test_search_merges_shards():
+    http = ShardedHTTP({
+        "a": lambda: Response(200, "SRA accession,containment,cANI\nSRR000001,0.5,\nSRR000002,0.05,\n"),
+        "b": lambda: Response(200, "SRA accession,containment,cANI\nSRR000003,0.9,\nSRR000004,0.2,\n"),
+    })
+    failed = []
+    df = getacc("{}", SHARDS, http, threshold=0.1, failed_shards=failed)
+    assert df.get_column("SRA_accession").to_list() == ["SRR000003", "SRR000001"]
+    assert failed == []
+
+
+def test_search_partial_results():
+    http = ShardedHTTP({
+        "a": lambda: Response(200, "SRA accession,containment,cANI\nSRR000001,0.5,\n"),
+        "b": urllib3.exceptions.ReadTimeoutError(None, "http://b", "timed out"),
+    })
+    failed = []
+    df = getacc("{}", SHARDS, http, failed_shards=failed)
+    assert df.get_column("SRA_accession").to_list() == ["SRR000001"]
+    assert failed == ["http://b"]
+
+    http.answers["a"] = lambda: Response(400, "invalid signature")
+    with pytest.raises(SearchError):
+        getacc("{}", SHARDS, http)
+
+
+def test_accession_in_one_shard():
+    http = ShardedHTTP({
+        "a": lambda: Response(404, "not found"),
+        "b": lambda: Response(200, "SRA accession,containment,cANI\nSRR000001,1.0,\n"),
+    })
+    df = getacc_by_accession("SRR000001", SHARDS, http)
+    assert df.get_column("SRA_accession").to_list() == ["SRR000001"]
+
+    http.answers["b"] = http.answers["a"]
+    with pytest.raises(SearchError):
+        getacc_by_accession("SRR000001", SHARDS, http)
+
+
+def test_stats_add_up():
+    stats = '{{"ksize": 21, "scaled": 1000, "threshold": 50, "n_datasets": {}}}'
+    http = ShardedHTTP({
+        "a": lambda: Response(200, stats.format(10)),
+        "b": lambda: Response(200, stats.format(32)),
+    })
+    assert getmetadata(SHARDS, http)["n_datasets"] == 42
+
+
+def test_search_since():
+    urls = []
+
+    def answer():
+        return Response(200, "SRA accession,containment,cANI\nSRR000011,0.5,\n")
+
+    class Recording(ShardedHTTP):
+        def request(self, method, url, **kwargs):
+            urls.append(url)
+            return super().request(method, url, **kwargs)
+
+    http = Recording({"a": answer, "b": answer})
+    df = getacc("{}", SHARDS, http, since={"http://a": 10})
+    assert len(df) == 1
+    assert len(urls) == 1 and urls[0].startswith("http://a/search?") and "since=10" in urls[0]
+
+
+def test_gather_needs_single_index():
+    http = ShardedHTTP({})
+    with pytest.raises(SearchError) as e:
+        getgather("{}", SHARDS, http)
+    assert e.value.args[1] == 501
+
+
+def test_downsampled_search():
+    urls = []
+
+    def answer(method, url, **kwargs):
+        urls.append(url)
+        return Response(200, "SRA accession,containment,cANI\n")
+    http = ShardedHTTP({})
+    http.request = answer
+
+    # previews tell the index server how much the query was downsampled
+    getacc("{}", SHARDS, http, threshold=0.1, downsampled=10)
+    assert all("downsampled=10" in url for url in urls)
+    urls.clear()
+    getacc("{}", SHARDS, http, threshold=0.1)
+    assert not any("downsampled" in url for url in urls)
@@ -0,0 +1,137 @@
+import gzip
+import io
+import json
+import random
+import time
+
+import pytest
+
+from sketching import SketchJobs, SketchBusy, UploadTooLarge, UploadTooSlow, sketch_file
+
+
+def random_fasta(path, length=50_000):
+    # a random sequence, long enough to keep some hashes at scaled=1000
+    rng = random.Random(42)
+    seq = "".join(rng.choice("ACGT") for _ in range(length))
+    with gzip.open(path, "wt") as f:
+        f.write(f">contig1\n{seq[:30_000]}\n>contig2\n{seq[30_000:]}\n")
+    return seq
+
+
+def wait_for(jobs, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while (status := jobs.status(job_id))[0] == 'sketching':
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    return status
+
+
+def test_upload_size_limit(tmp_path):
+    jobs = SketchJobs(tmp_path, max_upload_mb=1)
+
+    # declared size is checked before reading anything
+    with pytest.raises(UploadTooLarge):
+        jobs.submit(io.BytesIO(b""), "q", {}, content_length=2 * 1024 * 1024)
+
+    # and the actual size while streaming, for chunked uploads
+    with pytest.raises(UploadTooLarge):
+        jobs.submit(io.BytesIO(b"A" * (2 * 1024 * 1024)), "q", {})
+
+    # nothing is left behind, and the slot is free again
+    assert [p.name for p in tmp_path.iterdir()] == ["slots"]
+    jobs.take_slot().close()
+
+
+def test_upload_timeout(tmp_path):
+    jobs = SketchJobs(tmp_path, upload_timeout=0)
+    with pytest.raises(UploadTooSlow):
+        jobs.submit(io.BytesIO(b">q\nACGT\n" * 1000), "q", {})
+
+
+def test_busy_across_workers(tmp_path):
+    # slots are file locks, shared with the other web workers
+    other_worker = SketchJobs(tmp_path, workers=1)
+    slot = other_worker.take_slot()
+
+    jobs = SketchJobs(tmp_path, workers=1)
+    with pytest.raises(SketchBusy):
+        jobs.submit(io.BytesIO(b">q\nACGT\n"), "q", {})
+
+    slot.close()
+    jobs.take_slot().close()
+
+
+def test_unknown_job(tmp_path):
+    jobs = SketchJobs(tmp_path)
+    with pytest.raises(KeyError):
+        jobs.status("0" * 32)
+    with pytest.raises(KeyError):
+        jobs.status("../etc")
+
+
+def test_sketch_job(tmp_path):
+    pytest.importorskip("sourmash")
+    pytest.importorskip("screed")
+
+    path = tmp_path / "query.fa.gz"
+    random_fasta(path)
+    jobs = SketchJobs(tmp_path / "jobs", workers=1)
+    with open(path, "rb") as upload:
+        job_id = jobs.submit(upload, "query", {"threshold": 0.2})
+
+    # any web worker can report on the job
+    state, (signature, params) = wait_for(SketchJobs(tmp_path / "jobs"), job_id)
+    assert state == 'done'
+    assert params == {"threshold": 0.2}
+    assert json.loads(signature) == json.loads(sketch_file(str(path), "query"))
+
+    # the slot is released when the sketching process exits
+    for process in jobs._running:
+        process.wait()
+    jobs.take_slot().close()
+
+
+def test_failed_job(tmp_path):
+    pytest.importorskip("sourmash")
+    pytest.importorskip("screed")
+
+    jobs = SketchJobs(tmp_path)
+    job_id = jobs.submit(io.BytesIO(b"not a sequence file"), "query", {})
+    state, message = wait_for(jobs, job_id)
+    assert state == 'failed'
+    assert message
+
+
+def test_sketch_file(tmp_path):
+    sourmash = pytest.importorskip("sourmash")
+    pytest.importorskip("screed")
+    from sourmash.signature import load_one_signature_from_json
+
+    path = tmp_path / "query.fa.gz"
+    seq = random_fasta(path)
+
+    # a single signature object, like the ones sent by the browser
+    signature = json.loads(sketch_file(str(path), "query"))
+    assert isinstance(signature, dict)
+    sig = load_one_signature_from_json(json.dumps([signature]))
+    assert sig.name == "query"
+    assert sig.minhash.ksize == 21
+    assert sig.minhash.scaled == 1000
+    assert sig.minhash.moltype == "DNA"
+    assert len(sig.minhash) > 0
+
+    # same hashes as sketching the sequence directly
+    mh = sourmash.MinHash(n=0, ksize=21, scaled=1000)
+    mh.add_sequence(seq[:30_000])
+    mh.add_sequence(seq[30_000:])
+    assert sig.minhash == mh
+
+
+def test_interrupted_job(tmp_path):
+    jobs = SketchJobs(tmp_path)
+    job_id = jobs.submit(io.BytesIO(b">q\nACGT\n"), "query", {})
+    # killed before it could import sourmash, let alone save anything
+    for process in jobs._running:
+        process.kill()
+        process.wait()
+    assert jobs.status(job_id) == ('failed', "sketching was interrupted")
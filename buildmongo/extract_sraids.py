@@ -18,11 +18,11 @@ Notes:
 """
 
 import argparse
-import csv
-import os
 import sys
 from pathlib import Path
 
+import polars as pl
+
 
 def determine_output_path(dest_arg: str) -> Path:
     """Determine the output path for the sraids file.
@@ -59,28 +59,31 @@ def extract_first_column_from_third_row(manifest_path: Path) -> list[str]:
 
     - Ignores empty rows.
     - Strips whitespace from the extracted values.
+
+    The CSV is read with Polars in a single vectorized pass,
+    instead of row by row with the csv module.
     """
-    rows = []
-    # Use utf-8-sig to gracefully handle BOM if present
-    with manifest_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.reader(f)
-        # Skip first two rows
-        for _ in range(2):
-            try:
-                next(reader)
-            except StopIteration:
-                # If the file has fewer than 3 rows, nothing to return
-                return []
-        for rec in reader:
-            if not rec:
-                continue
-            first = (rec[0] if len(rec) > 0 else "").strip()
-            # Remove trailing .sig extension if present (case-insensitive)
-            if first.lower().endswith('.sig'):
-                first = first[:-4]
-            if first:
-                rows.append(first)
-    return rows
+    lf = (
+        pl.scan_csv(
+            manifest_path,
+            has_header=False,
+            skip_rows=2,
+            infer_schema_length=0,
+            truncate_ragged_lines=True,
+            encoding="utf8-lossy",
+        )
+        # Strip a byte order mark, like reading with utf-8-sig did
+        .select(pl.first().str.strip_prefix("\ufeff").str.strip_chars().alias("value"))
+        # Remove trailing .sig extension if present (case-insensitive)
+        .with_columns(pl.col("value").str.replace(r"(?i)\.sig$", ""))
+        .filter(pl.col("value").is_not_null() & (pl.col("value") != ""))
+    )
+    try:
+        first = lf.collect()
+    except pl.exceptions.NoDataError:
+        # If the file has fewer than 3 rows, nothing to return
+        return []
+    return first.get_column("value").to_list()
 
 
 def main(argv: list[str]) -> int:
@@ -0,0 +1,23 @@
+from extract_sraids import extract_first_column_from_third_row
+
+MANIFEST_HEADER = "# SOURMASH-MANIFEST-VERSION: 1.0\n"
+HEADER = "internal_location,md5,md5short,ksize,moltype,num,scaled,n_hashes,with_abundance,name,filename\n"
+
+
+def write_manifest(path, records):
+    '''records as (md5, ksize, name)'''
+    lines = [
+        f"signatures/{md5}.sig.gz,{md5},{md5[:8]},{ksize},DNA,0,1000,10,TRUE,{name},-\n"
+        for md5, ksize, name in records
+    ]
+    path.write_text(MANIFEST_HEADER + HEADER + "".join(lines))
+    return path
+
+
+def test_extract_sraids(tmp_path):
+    path = write_manifest(tmp_path / "manifest.csv", [("aaaa0001", 21, "SRR000001")])
+    assert extract_first_column_from_third_row(path) == ["signatures/aaaa0001.sig.gz"]
+
+    empty = tmp_path / "empty.csv"
+    empty.write_text("\ufeff" + MANIFEST_HEADER + HEADER)
+    assert extract_first_column_from_third_row(empty) == []
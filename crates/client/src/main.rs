@@ -1,12 +1,24 @@
 use std::collections::HashMap;
+use std::io::Write;
 use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::Arc;
 
-use clap::Parser;
+use arrow::array::{ArrayRef, Float64Array, StringArray};
+use arrow::datatypes::{DataType, Field, Schema, SchemaRef};
+use arrow::record_batch::RecordBatch;
+use clap::{Parser, ValueEnum};
 use color_eyre::{eyre::Result, eyre::WrapErr};
 use needletail::{parse_fastx_file, parse_fastx_stdin, Sequence};
-use reqwest_middleware::ClientBuilder;
+use parquet::arrow::ArrowWriter;
+use parquet::basic::Compression;
+use parquet::file::properties::WriterProperties;
+use reqwest::StatusCode;
+use reqwest_middleware::{ClientBuilder, ClientWithMiddleware};
 use reqwest_retry::{policies::ExponentialBackoff, RetryTransientMiddleware};
 use serde_json::json;
+use tokio::sync::{mpsc, Semaphore};
+use tokio::task::JoinSet;
 use tracing::info;
 use tracing_subscriber::{layer::SubscriberExt, util::SubscriberInitExt};
 
@@ -43,17 +55,31 @@ static ALLOC: jemallocator::Jemalloc = jemallocator::Jemalloc;
 #[derive(Parser, Debug)]
 #[clap(author, version, about, long_about = None)]
 struct Cli {
-    /// Input file. Can be:
+    /// Input files. Each one can be:
     ///   - sequences (FASTA/Q, compressed or not)
     ///   - an existing signature (use with --sig)
     ///   - a single dash ("-") for reading from stdin
-    #[clap(value_parser, verbatim_doc_comment)]
-    sequences: PathBuf,
+    /// Inputs are sketched in parallel and searched together in batch requests.
+    #[clap(
+        value_parser,
+        verbatim_doc_comment,
+        required_unless_present = "from_file",
+        num_args = 1..
+    )]
+    sequences: Vec<PathBuf>,
+
+    /// File with a list of inputs, one per line
+    #[clap(short = 'f', long = "from-file")]
+    from_file: Option<PathBuf>,
 
     /// Save results to this file. Default: stdout
     #[clap(value_parser, short, long)]
     output: Option<PathBuf>,
 
+    /// Output format. Default: parquet if the output file ends in .parquet, csv otherwise
+    #[clap(long = "format", value_enum)]
+    format: Option<OutputFormat>,
+
     /// Server to query. Default: https://api.branchwater.sourmash.bio
     #[clap(short, long, default_value = "https://api.branchwater.sourmash.bio")]
     server: String,
@@ -73,31 +99,45 @@ struct Cli {
     /// How many times to retry requests to the server (default: 3)
     #[clap(long = "retry", default_value = "3")]
     retry: u32,
-}
 
-#[tokio::main]
-async fn main() -> Result<()> {
-    tracing_subscriber::registry()
-        .with(tracing_subscriber::EnvFilter::new(
-            std::env::var("RUST_LOG").unwrap_or_else(|_| "branchwater=debug".into()),
-        ))
-        .with(tracing_subscriber::fmt::layer().json())
-        .init();
+    /// Number of inputs sketched at once. Default: number of CPUs
+    #[clap(short = 'j', long = "jobs")]
+    jobs: Option<usize>,
+
+    /// Number of queries sent in each batch request
+    #[clap(long = "batch-size", default_value = "50")]
+    batch_size: usize,
+
+    /// Number of requests to the server running at once
+    #[clap(long = "requests", default_value = "4")]
+    requests: usize,
+
+    /// Gzip level for the signatures sent to the server (1: fastest, 9: smallest)
+    #[clap(
+        long = "compression-level",
+        default_value = "6",
+        value_parser = clap::value_parser!(u8).range(1..=9)
+    )]
+    compression_level: u8,
+}
 
-    color_eyre::install()?;
+#[derive(ValueEnum, Clone, Copy, Debug, PartialEq)]
+enum OutputFormat {
+    Csv,
+    Parquet,
+}
 
-    let Cli {
-        sequences,
-        output,
-        is_sig,
-        server,
-        metadata_server,
-        full,
-        retry,
-    } = Cli::parse();
+/// A match for one of the queries
+#[derive(Debug, PartialEq)]
+struct Match {
+    accession: String,
+    containment: f64,
+    query: String,
+}
 
-    info!("Preparing signature");
-    let (sig, query_name): (Signature, String) = if !is_sig {
+/// Sketch (or load) a query, returning the signature and the query name
+fn load_query(sequences: &Path, is_sig: bool) -> Result<(Signature, String)> {
+    if !is_sig {
         let max_hash = max_hash_for_scaled(1000);
         let mh = KmerMinHashBTree::builder()
             .num(0)
@@ -110,11 +150,11 @@ async fn main() -> Result<()> {
             .hash_function("DNA")
             .build();
 
-        let (mut parser, mut query_name) = if sequences.as_path() == Path::new("-") {
+        let (mut parser, mut query_name) = if sequences == Path::new("-") {
             (parse_fastx_stdin()?, None)
         } else {
             (
-                parse_fastx_file(&sequences)?,
+                parse_fastx_file(sequences)?,
                 Some(sequences.to_string_lossy().to_string()),
             )
         };
@@ -128,9 +168,9 @@ async fn main() -> Result<()> {
             }
         }
 
-        (sig, query_name.expect("Couldn't determine query name"))
+        Ok((sig, query_name.expect("Couldn't determine query name")))
     } else {
-        let mut reader = std::io::BufReader::new(std::fs::File::open(&sequences)?);
+        let mut reader = std::io::BufReader::new(std::fs::File::open(sequences)?);
         let mut sigs = Signature::load_signatures(
             &mut reader,
             Some(21),
@@ -150,12 +190,290 @@ async fn main() -> Result<()> {
             .count();
         debug_assert_eq!(count, 1);
 
-        (sig, sequences.to_string_lossy().to_string())
+        Ok((sig, sequences.to_string_lossy().to_string()))
+    }
+}
+
+/// Inputs from the command line, followed by the ones listed in `from_file`
+fn input_paths(mut sequences: Vec<PathBuf>, from_file: Option<PathBuf>) -> Result<Vec<PathBuf>> {
+    if let Some(from_file) = from_file {
+        let list = std::fs::read_to_string(&from_file)
+            .wrap_err_with(|| format!("Error reading input list {}", from_file.display()))?;
+        sequences.extend(
+            list.lines()
+                .map(str::trim)
+                .filter(|line| !line.is_empty() && !line.starts_with('#'))
+                .map(PathBuf::from),
+        );
+    }
+    Ok(sequences)
+}
+
+/// Sketch (or load) every input, using up to `jobs` threads.
+///
+/// Sketching threads wait for room in `tx` before picking a new input, so
+/// only a bounded number of queries is held in memory while requests run.
+async fn sketch_all(
+    inputs: Vec<PathBuf>,
+    is_sig: bool,
+    jobs: usize,
+    tx: mpsc::Sender<Result<(Signature, String)>>,
+) -> Result<()> {
+    let permits = Arc::new(Semaphore::new(jobs));
+    for path in inputs {
+        let permit = Arc::clone(&permits).acquire_owned().await?;
+        let tx = tx.clone();
+        tokio::task::spawn_blocking(move || {
+            let query = load_query(&path, is_sig)
+                .wrap_err_with(|| format!("Error preparing query from {}", path.display()))
+                .map(|(mut sig, query_name)| {
+                    // the batch endpoint tags results with the signature name
+                    sig.set_name(&query_name);
+                    (sig, query_name)
+                });
+            // a closed channel means the search already failed, nothing to report
+            let _ = tx.blocking_send(query);
+            drop(permit);
+        });
+    }
+    Ok(())
+}
+
+fn gzip_level(level: u8) -> niffler::compression::Level {
+    use niffler::compression::Level;
+    match level {
+        1 => Level::One,
+        2 => Level::Two,
+        3 => Level::Three,
+        4 => Level::Four,
+        5 => Level::Five,
+        6 => Level::Six,
+        7 => Level::Seven,
+        8 => Level::Eight,
+        _ => Level::Nine,
+    }
+}
+
+/// Gzip-compressed JSON for a list of signatures
+fn compress_sigs(sigs: Vec<&Signature>, level: u8) -> Result<Vec<u8>> {
+    let mut sig_data = vec![];
+    {
+        let mut output = niffler::get_writer(
+            Box::new(&mut sig_data),
+            niffler::compression::Format::Gzip,
+            gzip_level(level),
+        )
+        .wrap_err_with(|| "Error preparing signature")?;
+
+        sigs.to_writer(&mut output)
+            .wrap_err_with(|| "Error preparing signature")?;
+    }
+    Ok(sig_data)
+}
+
+/// Matches from a search response.
+///
+/// Responses from `/search` have no query column, and all matches are for
+/// `query`. Responses from `/search/batch` have the query name first.
+fn parse_matches(data: &[u8], query: Option<&str>) -> Result<Vec<Match>> {
+    let mut rdr = csv::Reader::from_reader(data);
+    rdr.records()
+        .map(|record| {
+            let record = record?;
+            let (query, accession, containment) = match query {
+                Some(query) => (query, &record[0], &record[1]),
+                None => (&record[0], &record[1], &record[2]),
+            };
+            Ok(Match {
+                accession: accession.into(),
+                containment: containment
+                    .parse()
+                    .wrap_err_with(|| format!("Invalid containment: {containment}"))?,
+                query: query.into(),
+            })
+        })
+        .collect()
+}
+
+/// Search for a batch of queries.
+///
+/// Uses the batch endpoint unless the server doesn't have one, in which
+/// case `batch_endpoint` is cleared and queries are sent one at a time.
+async fn submit(
+    client: ClientWithMiddleware,
+    server: Arc<str>,
+    queries: Vec<(Signature, String)>,
+    compression_level: u8,
+    batch_endpoint: Arc<AtomicBool>,
+) -> Result<Vec<Match>> {
+    let queries = if batch_endpoint.load(Ordering::Relaxed) {
+        let (queries, sig_data) = tokio::task::spawn_blocking(move || {
+            let sig_data = compress_sigs(
+                queries.iter().map(|(sig, _)| sig).collect(),
+                compression_level,
+            );
+            (queries, sig_data)
+        })
+        .await?;
+
+        info!("Sending {} queries to {}", queries.len(), server);
+        let res = client
+            .post(format!("{}/search/batch", server))
+            .body(sig_data?)
+            .send()
+            .await?;
+        if matches!(
+            res.status(),
+            StatusCode::NOT_FOUND | StatusCode::METHOD_NOT_ALLOWED
+        ) {
+            info!("Server has no batch endpoint, sending queries one at a time");
+            batch_endpoint.store(false, Ordering::Relaxed);
+            queries
+        } else {
+            let data = res.error_for_status()?.bytes().await?;
+            return parse_matches(&data, None);
+        }
+    } else {
+        queries
     };
 
-    let output: Box<dyn std::io::Write> = match output {
+    search_each(&client, &server, queries, compression_level).await
+}
+
+async fn search_each(
+    client: &ClientWithMiddleware,
+    server: &str,
+    queries: Vec<(Signature, String)>,
+    compression_level: u8,
+) -> Result<Vec<Match>> {
+    let mut matches = vec![];
+    for (sig, query_name) in queries {
+        info!("Sending request to {}", server);
+        let sig_data = compress_sigs(vec![&sig], compression_level)?;
+        let data = client
+            .post(format!("{}/search", server))
+            .body(sig_data)
+            .send()
+            .await?
+            .error_for_status()?
+            .bytes()
+            .await?;
+        matches.extend(parse_matches(&data, Some(&query_name))?);
+    }
+    Ok(matches)
+}
+
+/// Tagged matches for all queries, as CSV or Parquet
+enum ResultsWriter {
+    Csv(csv::Writer<Box<dyn Write + Send>>),
+    Parquet(ArrowWriter<Box<dyn Write + Send>>, SchemaRef),
+}
+
+impl ResultsWriter {
+    fn new(output: Box<dyn Write + Send>, format: OutputFormat) -> Result<Self> {
+        Ok(match format {
+            OutputFormat::Csv => {
+                let mut wtr = csv::Writer::from_writer(output);
+                wtr.write_record(["SRA accession", "containment", "query"])?;
+                ResultsWriter::Csv(wtr)
+            }
+            OutputFormat::Parquet => {
+                let schema = Arc::new(Schema::new(vec![
+                    Field::new("SRA accession", DataType::Utf8, false),
+                    Field::new("containment", DataType::Float64, false),
+                    Field::new("query", DataType::Utf8, false),
+                ]));
+                let props = WriterProperties::builder()
+                    .set_compression(Compression::SNAPPY)
+                    .build();
+                let wtr = ArrowWriter::try_new(output, Arc::clone(&schema), Some(props))?;
+                ResultsWriter::Parquet(wtr, schema)
+            }
+        })
+    }
+
+    fn write(&mut self, matches: &[Match]) -> Result<()> {
+        match self {
+            ResultsWriter::Csv(wtr) => {
+                for m in matches {
+                    wtr.serialize((&m.accession, m.containment, &m.query))?;
+                }
+            }
+            ResultsWriter::Parquet(wtr, schema) => {
+                if matches.is_empty() {
+                    return Ok(());
+                }
+                let columns: Vec<ArrayRef> = vec![
+                    Arc::new(StringArray::from_iter_values(
+                        matches.iter().map(|m| m.accession.as_str()),
+                    )),
+                    Arc::new(Float64Array::from_iter_values(
+                        matches.iter().map(|m| m.containment),
+                    )),
+                    Arc::new(StringArray::from_iter_values(
+                        matches.iter().map(|m| m.query.as_str()),
+                    )),
+                ];
+                wtr.write(&RecordBatch::try_new(Arc::clone(schema), columns)?)?;
+            }
+        }
+        Ok(())
+    }
+
+    fn finish(self) -> Result<()> {
+        match self {
+            ResultsWriter::Csv(mut wtr) => wtr.flush()?,
+            ResultsWriter::Parquet(wtr, _) => {
+                wtr.close()?;
+            }
+        }
+        Ok(())
+    }
+}
+
+#[tokio::main]
+async fn main() -> Result<()> {
+    tracing_subscriber::registry()
+        .with(tracing_subscriber::EnvFilter::new(
+            std::env::var("RUST_LOG").unwrap_or_else(|_| "branchwater=debug".into()),
+        ))
+        .with(tracing_subscriber::fmt::layer().json())
+        .init();
+
+    color_eyre::install()?;
+
+    let Cli {
+        sequences,
+        from_file,
+        output,
+        format,
+        is_sig,
+        server,
+        metadata_server,
+        full,
+        retry,
+        jobs,
+        batch_size,
+        requests,
+        compression_level,
+    } = Cli::parse();
+
+    let inputs = input_paths(sequences, from_file)?;
+    if inputs.is_empty() {
+        color_eyre::eyre::bail!("No inputs to search");
+    }
+    if full && inputs.len() > 1 {
+        color_eyre::eyre::bail!("--full only supports a single input");
+    }
+
+    let format = format.unwrap_or_else(|| match &output {
+        Some(path) if path.extension().is_some_and(|ext| ext == "parquet") => OutputFormat::Parquet,
+        _ => OutputFormat::Csv,
+    });
+    let output: Box<dyn Write + Send> = match output {
         Some(path) => Box::new(std::io::BufWriter::new(
-            std::fs::File::create(path).unwrap(),
+            std::fs::File::create(&path)
+                .wrap_err_with(|| format!("Error creating {}", path.display()))?,
         )),
         None => Box::new(std::io::stdout()),
     };
@@ -169,35 +487,15 @@ async fn main() -> Result<()> {
     .with(RetryTransientMiddleware::new_with_policy(retry_policy))
     .build();
 
-    let res = if full {
-        info!("Sending request to {}", metadata_server);
+    if full {
+        info!("Preparing signatures");
+        let (sig, _) = load_query(&inputs[0], is_sig)?;
 
+        info!("Sending request to {}", metadata_server);
         let sig_data: HashMap<&str, String> = [("signatures", json!([sig]).to_string())].into();
-        client.post(metadata_server).json(&sig_data).send().await?
-    } else {
-        info!("Sending request to {}", server);
-        let mut sig_data = vec![];
-        {
-            let mut output = niffler::get_writer(
-                Box::new(&mut sig_data),
-                niffler::compression::Format::Gzip,
-                niffler::compression::Level::Nine,
-            )
-            .wrap_err_with(|| "Error preparing signature")?;
-
-            sig.to_writer(&mut output)
-                .wrap_err_with(|| "Error preparing signature")?;
-        }
-
-        client
-            .post(format!("{}/search", server))
-            .body(sig_data)
-            .send()
-            .await?
-    };
+        let res = client.post(metadata_server).json(&sig_data).send().await?;
 
-    info!("Writing matches to output");
-    if full {
+        info!("Writing matches to output");
         //let raw_results: serde_json::Value = serde_json::from_slice(&res.bytes()?)?;
         let raw_results: serde_json::Value = res.json().await?;
         let records = raw_results.as_array().unwrap();
@@ -216,28 +514,94 @@ async fn main() -> Result<()> {
                 }
             }))?;
         }
-    } else {
-        let data = res.bytes().await?;
 
-        let mut wtr = csv::Writer::from_writer(output);
-        let mut rdr = csv::Reader::from_reader(&data[..]);
+        info!("Finished!");
+        return Ok(());
+    }
 
-        let mut headers = rdr.headers()?.clone();
-        headers.push_field("query");
+    let jobs = jobs
+        .unwrap_or_else(|| {
+            std::thread::available_parallelism()
+                .map(usize::from)
+                .unwrap_or(1)
+        })
+        .max(1);
+    let batch_size = batch_size.max(1);
+    let requests = requests.max(1);
+
+    info!("Preparing signatures for {} inputs", inputs.len());
+    let (tx, mut rx) = mpsc::channel(jobs);
+    let sketching = tokio::spawn(sketch_all(inputs, is_sig, jobs, tx));
+
+    let server: Arc<str> = server.into();
+    let batch_endpoint = Arc::new(AtomicBool::new(true));
+    let mut writer = ResultsWriter::new(output, format)?;
+    let mut pending = JoinSet::new();
+    let mut batch = vec![];
+
+    loop {
+        let query = rx.recv().await;
+        let done = query.is_none();
+        if let Some(query) = query {
+            batch.push(query?);
+        }
 
-        wtr.write_record(&headers)?;
+        if batch.len() >= batch_size || (done && !batch.is_empty()) {
+            if pending.len() >= requests {
+                let matches = pending.join_next().await.expect("pending requests")??;
+                writer.write(&matches)?;
+            }
+            pending.spawn(submit(
+                client.clone(),
+                Arc::clone(&server),
+                std::mem::take(&mut batch),
+                compression_level,
+                Arc::clone(&batch_endpoint),
+            ));
+        }
 
-        for result in rdr.records() {
-            let mut record = result?;
-            record.push_field(query_name.as_str());
-            wtr.write_record(&record)?;
+        if done {
+            break;
         }
     }
 
+    info!("Writing matches to output");
+    while let Some(matches) = pending.join_next().await {
+        writer.write(&matches??)?;
+    }
+    sketching.await??;
+    writer.finish()?;
+
     info!("Finished!");
     Ok(())
 }
 
+#[test]
+fn parse_search_responses() {
+    let single = b"SRA accession,containment\nSRR1,0.5\nSRR2,0.25\n";
+    let matches = parse_matches(single, Some("q1")).unwrap();
+    assert_eq!(
+        matches,
+        vec![
+            Match {
+                accession: "SRR1".into(),
+                containment: 0.5,
+                query: "q1".into()
+            },
+            Match {
+                accession: "SRR2".into(),
+                containment: 0.25,
+                query: "q1".into()
+            }
+        ]
+    );
+
+    let batch = b"query_name,SRA accession,containment\n\"g1.fa, v2\",SRR1,0.5\n";
+    let matches = parse_matches(batch, None).unwrap();
+    assert_eq!(matches[0].query, "g1.fa, v2");
+    assert_eq!(matches[0].accession, "SRR1");
+}
+
 #[test]
 fn verify_cli() {
     use clap::CommandFactory;
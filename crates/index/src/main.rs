@@ -1,12 +1,13 @@
 use camino::Utf8Path as Path;
 use camino::Utf8PathBuf as PathBuf;
 use clap::{Parser, Subcommand};
-use tracing::info;
+use rayon::prelude::*;
+use tracing::{info, warn};
 use tracing_subscriber::{layer::SubscriberExt, util::SubscriberInitExt};
 
 use sourmash::collection::Collection;
 use sourmash::index::revindex::{prepare_query, RevIndex, RevIndexOps};
-use sourmash::manifest::Manifest;
+use sourmash::manifest::{Manifest, Record};
 use sourmash::prelude::*;
 use sourmash::signature::{Signature, SigsTrait};
 use sourmash::storage::{FSStorage, InnerStorage, ZipStorage};
@@ -94,6 +95,15 @@ enum Commands {
         /// The path for output
         #[clap(short, long)]
         output: Option<PathBuf>,
+
+        /// Number of threads loading signatures (default: all CPUs)
+        #[clap(short = 'j', long = "threads", default_value = "0")]
+        threads: usize,
+
+        /// Add records to the existing manifest in output,
+        /// skipping paths already in it
+        #[clap(long = "append", requires = "output")]
+        append: bool,
     },
     Metadata {
         /// Save metadata manifest to this file
@@ -394,54 +404,126 @@ fn convert<P: AsRef<Path>>(_input: P, _output: P) -> Result<(), Box<dyn std::err
     */
 }
 
+/// Manifest records for all signatures in a file.
+///
+/// `location` is the path recorded in the manifest, relative to the storage.
+fn load_records(path: &Path, location: &str) -> Result<Vec<Record>, Box<dyn std::error::Error>> {
+    Ok(Signature::from_path(path)?
+        .iter()
+        .flat_map(|sig| Record::from_sig(sig, location))
+        .collect())
+}
+
 fn manifest<P: AsRef<Path>>(
     pathlist: P,
     output: Option<P>,
     selection: Option<Selection>,
     basepath: Option<P>,
+    threads: usize,
+    append: bool,
 ) -> Result<(), Box<dyn std::error::Error>> {
+    use std::collections::HashSet;
     use std::fs::File;
     use std::io::{BufRead, BufReader, BufWriter, Write};
+    use std::sync::atomic::{AtomicUsize, Ordering};
 
-    let paths: Vec<PathBuf> = BufReader::new(File::open(pathlist.as_ref())?)
-        .lines()
-        .map(|line| {
-            let mut path = PathBuf::new();
-            path.push(line.unwrap());
-            path
-        })
-        .collect();
+    let existing = match &output {
+        Some(path) if append && path.as_ref().exists() => {
+            Manifest::from_reader(BufReader::new(File::open(path.as_ref())?))?
+        }
+        _ => Manifest::default(),
+    };
+    let known: HashSet<&str> = existing.internal_locations().collect();
+
+    let basepath = basepath.as_ref().map(|p| p.as_ref().as_str());
+    let mut paths = vec![];
+    let mut outside_basepath = 0;
+    for line in BufReader::new(File::open(pathlist.as_ref())?).lines() {
+        let line = line?;
+        let path = line.trim();
+        if path.is_empty() {
+            continue;
+        }
 
-    let manifest: Manifest = paths.as_slice().into();
+        let location = match basepath {
+            Some(base) => match Path::new(path).strip_prefix(base) {
+                Ok(location) => location.as_str(),
+                Err(_) => {
+                    warn!("skipping {path}: not under basepath {base}");
+                    outside_basepath += 1;
+                    continue;
+                }
+            },
+            None => path,
+        };
+        if !known.contains(location) {
+            paths.push((PathBuf::from(path), location.to_string()));
+        }
+    }
+    if append {
+        info!(
+            "{} records in existing manifest, {} new signature files",
+            existing.len(),
+            paths.len()
+        );
+    }
 
+    let pool = rayon::ThreadPoolBuilder::new()
+        .num_threads(threads)
+        .build()?;
+    info!(
+        "loading {} signature files with {} threads",
+        paths.len(),
+        pool.current_num_threads()
+    );
+
+    let total = paths.len();
+    let report_every = (total / 100).max(1000);
+    let processed = AtomicUsize::new(0);
+    let unreadable = AtomicUsize::new(0);
+
+    // par_iter keeps the order of the path list in the manifest
+    let records: Vec<Record> = pool.install(|| {
+        paths
+            .par_iter()
+            .flat_map_iter(|(path, location)| {
+                let records = load_records(path, location).unwrap_or_else(|e| {
+                    warn!("skipping {path}: {e}");
+                    unreadable.fetch_add(1, Ordering::Relaxed);
+                    vec![]
+                });
+
+                let n = processed.fetch_add(1, Ordering::Relaxed) + 1;
+                if n % report_every == 0 || n == total {
+                    info!("processed {n}/{total} signature files");
+                }
+                records
+            })
+            .collect()
+    });
+
+    let unreadable = unreadable.into_inner();
+    if unreadable > 0 || outside_basepath > 0 {
+        warn!("skipped {unreadable} unreadable files and {outside_basepath} outside basepath");
+    }
+
+    let manifest: Manifest = records.into();
     let manifest = if let Some(selection) = selection {
         manifest.select(&selection)?
     } else {
         manifest
     };
 
-    let manifest = if let Some(basepath) = basepath {
-        let path: &str = basepath.as_ref().as_str();
-        manifest
-            .iter()
-            .map(|r| {
-                let mut record = r.clone();
-                record.set_internal_location(
-                    r.internal_location()
-                        .strip_prefix(path)
-                        .expect("Error stripping")
-                        .into(),
-                );
-                record
-            })
-            .collect::<Vec<_>>()
-            .into()
-    } else {
-        manifest
-    };
+    let manifest: Manifest = existing
+        .iter()
+        .cloned()
+        .chain(manifest.iter().cloned())
+        .collect::<Vec<_>>()
+        .into();
+    info!("writing manifest with {} records", manifest.len());
 
     let out: Box<dyn Write + Send> = match output {
-        Some(path) => Box::new(BufWriter::new(File::create(path.as_ref()).unwrap())),
+        Some(path) => Box::new(BufWriter::new(File::create(path.as_ref())?)),
         None => Box::new(std::io::stdout()),
     };
 
@@ -563,10 +645,12 @@ fn main() -> Result<(), Box<dyn std::error::Error>> {
             output,
             ksize,
             basepath,
+            threads,
+            append,
         } => {
             let selection = ksize.map(|ksize| Selection::builder().ksize(ksize.into()).build());
 
-            manifest(pathlist, output, selection, basepath)?
+            manifest(pathlist, output, selection, basepath, threads, append)?
         }
         Metadata {
             index,
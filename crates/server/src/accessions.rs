@@ -0,0 +1,120 @@
+use sourmash::encodings::Idx;
+use sourmash::manifest::Manifest;
+
+/// Accession for each dataset in the index, resolved once at startup.
+///
+/// All accessions are stored back to back in a single buffer, and looked up
+/// by dataset index (the position of the record in the manifest).
+/// Dataset indices sorted by accession allow the reverse lookup.
+pub struct AccessionTable {
+    data: String,
+    ends: Vec<u32>,
+    sorted: Vec<Idx>,
+}
+
+impl AccessionTable {
+    pub fn from_manifest(manifest: &Manifest) -> Self {
+        manifest
+            .iter()
+            .map(|record| {
+                // same fallback as `matches_from_counter`: name, then filename, then md5
+                let name: &str = [record.name(), record.filename(), record.md5()]
+                    .into_iter()
+                    .find(|v| !v.is_empty())
+                    .unwrap(); // guaranteed to succeed because `md5` always exists
+                accession_from_name(name)
+            })
+            .collect()
+    }
+
+    pub fn get(&self, dataset_id: Idx) -> &str {
+        let idx = dataset_id as usize;
+        let start = if idx == 0 {
+            0
+        } else {
+            self.ends[idx - 1] as usize
+        };
+        &self.data[start..self.ends[idx] as usize]
+    }
+
+    /// Dataset index for an accession (the first one, if repeated)
+    pub fn find(&self, accession: &str) -> Option<Idx> {
+        let pos = self
+            .sorted
+            .partition_point(|idx| self.get(*idx) < accession);
+        self.sorted
+            .get(pos)
+            .copied()
+            .filter(|idx| self.get(*idx) == accession)
+    }
+
+    pub fn len(&self) -> usize {
+        self.ends.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.ends.is_empty()
+    }
+}
+
+impl<'a> FromIterator<&'a str> for AccessionTable {
+    fn from_iter<I: IntoIterator<Item = &'a str>>(iter: I) -> Self {
+        let mut data = String::new();
+        let mut ends = vec![];
+        for acc in iter {
+            data.push_str(acc);
+            ends.push(u32::try_from(data.len()).expect("accession table larger than 4 GiB"));
+        }
+        data.shrink_to_fit();
+        ends.shrink_to_fit();
+
+        let mut table = AccessionTable {
+            data,
+            ends,
+            sorted: vec![],
+        };
+        let mut sorted: Vec<Idx> = (0..table.len() as Idx).collect();
+        // stable, so repeated accessions resolve to the first dataset
+        sorted.sort_by(|a, b| table.get(*a).cmp(table.get(*b)));
+        table.sorted = sorted;
+        table
+    }
+}
+
+/// Accession from a dataset name or path (`sigs/SRR1234.sig.gz` -> `SRR1234`)
+pub fn accession_from_name(name: &str) -> &str {
+    let basename = name.rsplit('/').next().unwrap_or(name);
+    basename.split('.').next().unwrap_or(basename)
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    #[test]
+    fn accession_from_names_and_paths() {
+        assert_eq!(accession_from_name("SRR1234"), "SRR1234");
+        assert_eq!(accession_from_name("sigs/SRR1234.sig.gz"), "SRR1234");
+        assert_eq!(accession_from_name("/data/sigs/ERR42.sig"), "ERR42");
+    }
+
+    #[test]
+    fn table_lookup() {
+        let table: AccessionTable = ["SRR1", "ERR22", "", "DRR333"].into_iter().collect();
+        assert_eq!(table.len(), 4);
+        assert_eq!(table.get(0), "SRR1");
+        assert_eq!(table.get(1), "ERR22");
+        assert_eq!(table.get(2), "");
+        assert_eq!(table.get(3), "DRR333");
+    }
+
+    #[test]
+    fn reverse_lookup() {
+        let table: AccessionTable = ["SRR1", "ERR22", "DRR333", "ERR22"].into_iter().collect();
+        assert_eq!(table.find("SRR1"), Some(0));
+        assert_eq!(table.find("ERR22"), Some(1));
+        assert_eq!(table.find("DRR333"), Some(2));
+        assert_eq!(table.find("SRR2"), None);
+        assert_eq!(table.find(""), None);
+    }
+}
@@ -0,0 +1,202 @@
+use std::fmt;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Arc;
+use std::time::Duration;
+
+use tokio::sync::{OwnedSemaphorePermit, Semaphore};
+
+/// Rough memory used by the counters of a query, per hash in the sketch.
+///
+/// Counters hold one entry per matching dataset, and the number of datasets
+/// sharing hashes with a query grows with its size.
+pub const COUNTER_BYTES_PER_HASH: usize = 256;
+
+const MIB: usize = 1024 * 1024;
+
+/// Admission control for queries hitting the index.
+///
+/// Queries are routed to a lane by their cost, estimated from the number of
+/// hashes in the (downsampled) sketch, so a few large queries can't hold all
+/// the workers and starve the small ones. Each lane runs a bounded number of
+/// queries at once, within a memory budget for their counters, and only
+/// queues a bounded number of requests: past that, or after waiting for
+/// `queue_timeout`, the query is rejected so the client can retry later.
+pub struct Admission {
+    small: Lane,
+    large: Lane,
+    large_query_hashes: usize,
+}
+
+pub struct LaneConfig {
+    pub workers: usize,
+    pub memory_mb: usize,
+    pub max_queued: usize,
+}
+
+struct Lane {
+    name: &'static str,
+    workers: Arc<Semaphore>,
+    memory: Arc<Semaphore>,
+    memory_mb: usize,
+    max_queued: usize,
+    queued: AtomicUsize,
+    queue_timeout: Duration,
+}
+
+/// Resources held by an admitted query, released when dropped.
+pub struct Permit {
+    _worker: OwnedSemaphorePermit,
+    _memory: OwnedSemaphorePermit,
+}
+
+/// Query not admitted, the lane is busy.
+#[derive(Debug)]
+pub struct Rejected {
+    pub lane: &'static str,
+    pub retry_after: Duration,
+}
+
+impl fmt::Display for Rejected {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        write!(
+            f,
+            "server is busy with {} queries, try again in {} seconds",
+            self.lane,
+            self.retry_after.as_secs()
+        )
+    }
+}
+
+impl std::error::Error for Rejected {}
+
+impl Admission {
+    pub fn new(
+        small: LaneConfig,
+        large: LaneConfig,
+        large_query_hashes: usize,
+        queue_timeout: Duration,
+    ) -> Self {
+        Admission {
+            small: Lane::new("small", small, queue_timeout),
+            large: Lane::new("large", large, queue_timeout),
+            large_query_hashes,
+        }
+    }
+
+    /// Wait for a worker and counter memory for a query with `n_hashes`.
+    ///
+    /// `force_large` sends the query to the large lane no matter its size,
+    /// for operations doing more work per hash than a search (like gather).
+    pub async fn admit(&self, n_hashes: usize, force_large: bool) -> Result<Permit, Rejected> {
+        if force_large || n_hashes > self.large_query_hashes {
+            self.large.admit(n_hashes).await
+        } else {
+            self.small.admit(n_hashes).await
+        }
+    }
+}
+
+impl Lane {
+    fn new(name: &'static str, config: LaneConfig, queue_timeout: Duration) -> Self {
+        let memory_mb = config.memory_mb.clamp(1, Semaphore::MAX_PERMITS);
+        Lane {
+            name,
+            workers: Arc::new(Semaphore::new(config.workers.max(1))),
+            memory: Arc::new(Semaphore::new(memory_mb)),
+            memory_mb,
+            max_queued: config.max_queued,
+            queued: AtomicUsize::new(0),
+            queue_timeout,
+        }
+    }
+
+    /// Counter memory reserved for a query, in MiB.
+    ///
+    /// Capped at the lane budget, so a query larger than it still runs (alone).
+    fn memory_cost(&self, n_hashes: usize) -> u32 {
+        let mb = (n_hashes.saturating_mul(COUNTER_BYTES_PER_HASH)).div_ceil(MIB);
+        mb.clamp(1, self.memory_mb) as u32
+    }
+
+    fn rejected(&self) -> Rejected {
+        Rejected {
+            lane: self.name,
+            retry_after: self.queue_timeout.max(Duration::from_secs(1)),
+        }
+    }
+
+    async fn admit(&self, n_hashes: usize) -> Result<Permit, Rejected> {
+        if self.queued.fetch_add(1, Ordering::SeqCst) >= self.max_queued {
+            self.queued.fetch_sub(1, Ordering::SeqCst);
+            tracing::warn!(lane = self.name, n_hashes, "queue full, rejecting query");
+            return Err(self.rejected());
+        }
+
+        let cost = self.memory_cost(n_hashes);
+        let acquire = async {
+            let worker = Arc::clone(&self.workers).acquire_owned().await;
+            let memory = Arc::clone(&self.memory).acquire_many_owned(cost).await;
+            (worker, memory)
+        };
+        let acquired = tokio::time::timeout(self.queue_timeout, acquire).await;
+        self.queued.fetch_sub(1, Ordering::SeqCst);
+
+        match acquired {
+            Ok((Ok(worker), Ok(memory))) => Ok(Permit {
+                _worker: worker,
+                _memory: memory,
+            }),
+            _ => {
+                tracing::warn!(lane = self.name, n_hashes, "timed out waiting in queue");
+                Err(self.rejected())
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    fn admission(max_queued: usize) -> Admission {
+        let lane = || LaneConfig {
+            workers: 1,
+            memory_mb: 64,
+            max_queued,
+        };
+        Admission::new(lane(), lane(), 1000, Duration::from_millis(50))
+    }
+
+    #[test]
+    fn memory_cost_capped_by_budget() {
+        let admission = admission(1);
+        assert_eq!(admission.small.memory_cost(10), 1);
+        assert_eq!(admission.small.memory_cost(4096 * 10), 10);
+        assert_eq!(admission.large.memory_cost(usize::MAX), 64);
+    }
+
+    #[tokio::test]
+    async fn lanes_are_independent() {
+        let admission = admission(1);
+
+        let small = admission.admit(10, false).await.unwrap();
+        // the small lane worker is busy, this waits for it and times out
+        assert!(admission.admit(10, false).await.is_err());
+        // but large queries have their own workers
+        let large = admission.admit(10_000, false).await.unwrap();
+        assert!(admission.admit(10, true).await.is_err());
+
+        drop(small);
+        assert!(admission.admit(10, false).await.is_ok());
+        drop(large);
+        assert!(admission.admit(10, true).await.is_ok());
+    }
+
+    #[tokio::test]
+    async fn full_queue_rejects_immediately() {
+        let admission = admission(0);
+        let rejected = admission.admit(10, false).await.err().unwrap();
+        assert_eq!(rejected.lane, "small");
+        assert_eq!(rejected.retry_after, Duration::from_secs(1));
+    }
+}
@@ -0,0 +1,104 @@
+use std::collections::HashMap;
+use std::hash::Hash;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
+
+/// Bounded cache of results, evicting the least recently used entry.
+///
+/// Entries are looked up far more often than they are inserted, and the
+/// capacity is small (hundreds of entries), so eviction scans all entries
+/// instead of keeping a separate recency list.
+pub struct ResultsCache<K, V> {
+    capacity: usize,
+    inner: Mutex<Inner<K, V>>,
+    hits: AtomicU64,
+    misses: AtomicU64,
+}
+
+struct Inner<K, V> {
+    entries: HashMap<K, (Arc<V>, u64)>,
+    tick: u64,
+}
+
+impl<K: Hash + Eq + Clone, V> ResultsCache<K, V> {
+    pub fn new(capacity: usize) -> Self {
+        ResultsCache {
+            capacity,
+            inner: Mutex::new(Inner {
+                entries: HashMap::new(),
+                tick: 0,
+            }),
+            hits: AtomicU64::new(0),
+            misses: AtomicU64::new(0),
+        }
+    }
+
+    /// Lookups answered from the cache, and lookups that were not
+    pub fn hits_and_misses(&self) -> (u64, u64) {
+        (
+            self.hits.load(Ordering::Relaxed),
+            self.misses.load(Ordering::Relaxed),
+        )
+    }
+
+    pub fn get(&self, key: &K) -> Option<Arc<V>> {
+        let mut inner = self.inner.lock().unwrap();
+        inner.tick += 1;
+        let tick = inner.tick;
+        let found = inner.entries.get_mut(key).map(|(value, used)| {
+            *used = tick;
+            Arc::clone(value)
+        });
+        let counter = if found.is_some() {
+            &self.hits
+        } else {
+            &self.misses
+        };
+        counter.fetch_add(1, Ordering::Relaxed);
+        found
+    }
+
+    pub fn insert(&self, key: K, value: Arc<V>) {
+        if self.capacity == 0 {
+            return;
+        }
+
+        let mut inner = self.inner.lock().unwrap();
+        inner.tick += 1;
+        let tick = inner.tick;
+        if inner.entries.len() >= self.capacity && !inner.entries.contains_key(&key) {
+            let oldest = inner
+                .entries
+                .iter()
+                .min_by_key(|(_, (_, used))| *used)
+                .map(|(k, _)| k.clone());
+            if let Some(oldest) = oldest {
+                inner.entries.remove(&oldest);
+            }
+        }
+        inner.entries.insert(key, (value, tick));
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    #[test]
+    fn evicts_least_recently_used() {
+        let cache = ResultsCache::new(2);
+        cache.insert("a", Arc::new(1));
+        cache.insert("b", Arc::new(2));
+        assert_eq!(cache.get(&"a").as_deref(), Some(&1));
+
+        cache.insert("c", Arc::new(3));
+        assert_eq!(cache.get(&"b"), None);
+        assert_eq!(cache.get(&"a").as_deref(), Some(&1));
+        assert_eq!(cache.get(&"c").as_deref(), Some(&3));
+        assert_eq!(cache.hits_and_misses(), (3, 1));
+
+        let disabled = ResultsCache::new(0);
+        disabled.insert("a", Arc::new(1));
+        assert_eq!(disabled.get(&"a"), None);
+    }
+}
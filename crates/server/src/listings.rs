@@ -0,0 +1,286 @@
+use std::hash::{DefaultHasher, Hash, Hasher};
+use std::io::Write;
+
+use axum::{
+    body::{Body, Bytes},
+    http::{header, HeaderMap, HeaderName, HeaderValue, StatusCode},
+    response::{IntoResponse, Response},
+};
+use serde::Deserialize;
+use sourmash::manifest::Manifest;
+
+/// Manifest CSV and accession list for the index, serialized once.
+pub struct Listings {
+    pub etag: String,
+    pub manifest: Listing,
+    pub accessions: Listing,
+}
+
+/// A serialized list of records, with a gzip-compressed copy of the full
+/// body and the offset of each record for partial responses.
+pub struct Listing {
+    body: Bytes,
+    gzip: Bytes,
+    /// length of the header line, sent with every response
+    header_len: usize,
+    /// end of each record in `body`, including its line terminator
+    ends: Vec<usize>,
+}
+
+impl Listing {
+    fn new(body: Vec<u8>, header_len: usize, ends: Vec<usize>) -> Self {
+        let mut gzip = vec![];
+        {
+            let mut wtr = niffler::get_writer(
+                Box::new(&mut gzip),
+                niffler::compression::Format::Gzip,
+                niffler::compression::Level::Six,
+            )
+            .expect("error preparing compressed listing");
+            wtr.write_all(&body).expect("error compressing listing");
+        }
+
+        Listing {
+            body: body.into(),
+            gzip: gzip.into(),
+            header_len,
+            ends,
+        }
+    }
+
+    pub fn len(&self) -> usize {
+        self.ends.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.ends.is_empty()
+    }
+
+    /// Records from position `since` on (at most `limit` of them), after the header
+    pub fn slice(&self, since: usize, limit: Option<usize>) -> Bytes {
+        let since = since.min(self.len());
+        let until = limit.map_or(self.len(), |limit| {
+            since.saturating_add(limit).min(self.len())
+        });
+
+        let offset = |i: usize| {
+            if i == 0 {
+                self.header_len
+            } else {
+                self.ends[i - 1]
+            }
+        };
+        let records = self.body.slice(offset(since)..offset(until));
+
+        if self.header_len == 0 {
+            records
+        } else {
+            let mut body = Vec::with_capacity(self.header_len + records.len());
+            body.extend_from_slice(&self.body[..self.header_len]);
+            body.extend_from_slice(&records);
+            body.into()
+        }
+    }
+}
+
+impl Listings {
+    pub fn from_manifest(manifest: &Manifest) -> Self {
+        let mut manifest_csv = csv::Writer::from_writer(vec![]);
+        let mut header_len = 0;
+        let mut ends = Vec::with_capacity(manifest.len());
+        for (i, record) in manifest.iter().enumerate() {
+            manifest_csv
+                .serialize(record)
+                .expect("error writing record");
+            manifest_csv.flush().expect("error writing record");
+            ends.push(manifest_csv.get_ref().len());
+
+            if i == 0 {
+                // the header is written with the first record
+                let mut first = csv::WriterBuilder::new()
+                    .has_headers(false)
+                    .from_writer(vec![]);
+                first.serialize(record).expect("error writing record");
+                header_len = ends[0] - first.into_inner().expect("error writing record").len();
+            }
+        }
+        let manifest_csv = manifest_csv.into_inner().expect("error writing manifest");
+
+        let mut accessions = vec![];
+        let mut acc_ends = Vec::with_capacity(manifest.len());
+        for record in manifest.iter() {
+            accessions.extend_from_slice(record.name().as_bytes());
+            accessions.push(b'\n');
+            acc_ends.push(accessions.len());
+        }
+
+        // the listings only change with the index, so their content identifies it
+        let mut hasher = DefaultHasher::new();
+        manifest_csv.hash(&mut hasher);
+        let etag = format!("\"{:016x}-{}\"", hasher.finish(), manifest.len());
+
+        Listings {
+            etag,
+            manifest: Listing::new(manifest_csv, header_len, ends),
+            accessions: Listing::new(accessions, 0, acc_ends),
+        }
+    }
+}
+
+#[derive(Deserialize, Debug)]
+pub struct ListingParams {
+    /// skip the first `since` records (e.g. the number fetched in the last sync)
+    since: Option<usize>,
+    /// return at most `limit` records
+    limit: Option<usize>,
+}
+
+/// Whether `Accept-Encoding` lists gzip, without refusing it with `q=0`.
+fn accepts_gzip(headers: &HeaderMap) -> bool {
+    headers
+        .get_all(header::ACCEPT_ENCODING)
+        .iter()
+        .filter_map(|v| v.to_str().ok())
+        .flat_map(|v| v.split(','))
+        .any(|enc| {
+            let mut parts = enc.split(';').map(str::trim);
+            let name = parts.next().unwrap_or_default();
+            let quality = parts
+                .find_map(|p| p.strip_prefix("q=").or_else(|| p.strip_prefix("Q=")))
+                .map_or(1.0, |q| q.parse::<f32>().unwrap_or(0.0));
+            name.eq_ignore_ascii_case("gzip") && quality > 0.0
+        })
+}
+
+fn etag_matches(headers: &HeaderMap, etag: &str) -> bool {
+    headers
+        .get_all(header::IF_NONE_MATCH)
+        .iter()
+        .filter_map(|v| v.to_str().ok())
+        .any(|v| {
+            v.split(',').any(|tag| {
+                let tag = tag.trim();
+                tag == "*" || tag.trim_start_matches("W/") == etag
+            })
+        })
+}
+
+/// ETag of the gzipped representation, distinct from the identity one
+/// so caches never serve one in place of the other.
+fn gzip_etag(etag: &str) -> String {
+    format!("{}-gz\"", etag.trim_end_matches('"'))
+}
+
+/// Response for a listing, honoring If-None-Match, since/limit and gzip.
+///
+/// The ETag identifies the index (with a `-gz` suffix for the gzipped
+/// listing), so a client that already has it gets a 304 Not Modified no
+/// matter which part of the listing it asks for.
+pub fn listing_response(
+    listing: &Listing,
+    etag: &str,
+    headers: &HeaderMap,
+    params: ListingParams,
+    content_type: &'static str,
+) -> Response<Body> {
+    let gzip = params.since.is_none() && params.limit.is_none() && accepts_gzip(headers);
+    let etag = if gzip {
+        gzip_etag(etag)
+    } else {
+        etag.to_string()
+    };
+    let etag_value = HeaderValue::from_str(&etag).expect("invalid etag");
+
+    let mut response = if etag_matches(headers, &etag) {
+        StatusCode::NOT_MODIFIED.into_response()
+    } else if gzip {
+        let mut response = listing.gzip.clone().into_response();
+        response
+            .headers_mut()
+            .insert(header::CONTENT_ENCODING, HeaderValue::from_static("gzip"));
+        response
+    } else {
+        listing
+            .slice(params.since.unwrap_or(0), params.limit)
+            .into_response()
+    };
+
+    let ok = response.status() == StatusCode::OK;
+    let response_headers = response.headers_mut();
+    if ok {
+        response_headers.insert(header::CONTENT_TYPE, HeaderValue::from_static(content_type));
+    }
+    response_headers.insert(header::ETAG, etag_value);
+    response_headers.insert(header::CACHE_CONTROL, HeaderValue::from_static("no-cache"));
+    response_headers.insert(header::VARY, HeaderValue::from_static("accept-encoding"));
+    response_headers.insert(
+        HeaderName::from_static("x-total-count"),
+        HeaderValue::from(listing.len()),
+    );
+
+    response
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    fn listing() -> Listing {
+        let body = b"name\nSRR1\nSRR22\nSRR333\n".to_vec();
+        Listing::new(body, 5, vec![10, 16, 23])
+    }
+
+    #[test]
+    fn listing_slices() {
+        let listing = listing();
+        assert_eq!(listing.len(), 3);
+        assert_eq!(&listing.slice(0, None)[..], b"name\nSRR1\nSRR22\nSRR333\n");
+        assert_eq!(&listing.slice(1, None)[..], b"name\nSRR22\nSRR333\n");
+        assert_eq!(&listing.slice(1, Some(1))[..], b"name\nSRR22\n");
+        assert_eq!(&listing.slice(3, None)[..], b"name\n");
+        assert_eq!(&listing.slice(10, Some(5))[..], b"name\n");
+    }
+
+    #[test]
+    fn conditional_requests() {
+        let mut headers = HeaderMap::new();
+        headers.insert(header::IF_NONE_MATCH, HeaderValue::from_static("\"abc-3\""));
+        assert!(etag_matches(&headers, "\"abc-3\""));
+        assert!(!etag_matches(&headers, "\"abc-4\""));
+
+        headers.insert(
+            header::ACCEPT_ENCODING,
+            HeaderValue::from_static("br, gzip;q=0.8"),
+        );
+        assert!(accepts_gzip(&headers));
+    }
+
+    #[test]
+    fn etag_per_encoding() {
+        assert_eq!(gzip_etag("\"abc-3\""), "\"abc-3-gz\"");
+
+        let mut headers = HeaderMap::new();
+        headers.insert(header::IF_NONE_MATCH, HeaderValue::from_static("\"abc-3\""));
+        assert!(!etag_matches(&headers, &gzip_etag("\"abc-3\"")));
+        headers.insert(
+            header::IF_NONE_MATCH,
+            HeaderValue::from_static("W/\"abc-3-gz\""),
+        );
+        assert!(etag_matches(&headers, &gzip_etag("\"abc-3\"")));
+    }
+
+    #[test]
+    fn gzip_refused() {
+        let accepts = |value: &'static str| {
+            let mut headers = HeaderMap::new();
+            headers.insert(header::ACCEPT_ENCODING, HeaderValue::from_static(value));
+            accepts_gzip(&headers)
+        };
+        assert!(accepts("gzip"));
+        assert!(accepts("deflate, GZIP ; q=0.5"));
+        assert!(!accepts("gzip;q=0"));
+        assert!(!accepts("br, gzip; q=0.000"));
+        assert!(!accepts("gzipx, identity"));
+        assert!(!accepts("br"));
+    }
+}
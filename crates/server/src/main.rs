@@ -1,11 +1,16 @@
-use std::{borrow::Cow, sync::Arc, time::Duration};
+use std::{
+    borrow::Cow,
+    sync::atomic::{AtomicBool, Ordering},
+    sync::Arc,
+    time::{Duration, Instant},
+};
 
 use axum::{
     body::{Body, Bytes},
     error_handling::HandleErrorLayer,
-    extract::{DefaultBodyLimit, State},
+    extract::{DefaultBodyLimit, Path, Query, State},
     handler::Handler,
-    http::{header, StatusCode},
+    http::{header, HeaderMap, StatusCode},
     response::{IntoResponse, Response},
     routing::{get, post_service},
     Json, Router,
@@ -13,7 +18,6 @@ use axum::{
 use sentry::integrations::tower::{NewSentryLayer, SentryHttpLayer};
 use sentry::integrations::tracing as sentry_tracing;
 use tokio::net::TcpListener;
-use tokio::runtime::Runtime;
 use tower::{BoxError, ServiceBuilder};
 use tower_http::limit::RequestBodyLimitLayer;
 use tower_http::trace::TraceLayer;
@@ -22,17 +26,34 @@ use tracing_subscriber::{layer::SubscriberExt, util::SubscriberInitExt};
 use camino::Utf8PathBuf as PathBuf;
 use clap::Parser;
 use color_eyre::eyre::Result;
-use serde::Serialize;
-use sourmash::index::revindex::{prepare_query, RevIndex, RevIndexOps};
-use sourmash::manifest::Manifest;
+use serde::{Deserialize, Serialize};
+use sourmash::encodings::Idx;
+use sourmash::index::revindex::{prepare_query, RevIndexOps};
 use sourmash::prelude::*;
 use sourmash::selection::Selection;
 use sourmash::signature::{Signature, SigsTrait};
+use sourmash::sketch::minhash::KmerMinHash;
+
+mod accessions;
+mod admission;
+mod cache;
+mod listings;
+mod metrics;
+mod reload;
+mod search;
+mod stream;
+
+use admission::{Admission, LaneConfig, Rejected};
+use listings::ListingParams;
+use metrics::Metrics;
+use reload::{CurrentIndex, IndexVersion, Opener};
+use stream::{Format, Matches, QueryMatches};
 
 #[derive(Parser, Debug)]
 #[clap(author, version, about, long_about = None)]
 struct Cli {
-    /// Path to rocksdb index dir
+    /// Path to rocksdb index dir.
+    /// Can be a symlink to the current index version, see `--watch`
     index: PathBuf,
 
     /// Location of the data for signatures.
@@ -55,6 +76,80 @@ struct Cli {
     /// threshold_bp
     #[clap(short = 't', long = "threshold_bp", default_value = "50000")]
     threshold_bp: usize,
+
+    /// Queries running at once for small sketches (default: number of CPUs)
+    #[clap(long = "small-workers")]
+    small_workers: Option<usize>,
+
+    /// Queries running at once for large sketches and gather
+    #[clap(long = "large-workers", default_value = "2")]
+    large_workers: usize,
+
+    /// Sketches with more hashes than this (after downsampling) are large queries
+    #[clap(long = "large-query-hashes", default_value = "100000")]
+    large_query_hashes: usize,
+
+    /// Memory budget for the counters of small queries, in MiB
+    #[clap(long = "small-memory-mb", default_value = "4096")]
+    small_memory_mb: usize,
+
+    /// Memory budget for the counters of large queries, in MiB
+    #[clap(long = "large-memory-mb", default_value = "8192")]
+    large_memory_mb: usize,
+
+    /// Queries waiting for a worker in each lane before new ones are rejected
+    #[clap(long = "max-queued", default_value = "100")]
+    max_queued: usize,
+
+    /// Seconds a query waits for a worker before being rejected
+    #[clap(long = "queue-timeout", default_value = "60")]
+    queue_timeout: u64,
+
+    /// Searches by accession kept in memory (0 disables caching)
+    #[clap(long = "accession-cache-size", default_value = "1000")]
+    accession_cache_size: usize,
+
+    /// Check every this many seconds whether the index path points to a new
+    /// index version, and switch to it without a restart (0 disables it)
+    #[clap(long = "watch", default_value = "0")]
+    watch: u64,
+
+    /// Searches run on a newly opened index before it takes requests
+    #[clap(
+        long = "warmup-queries",
+        env = "BRANCHWATER_WARMUP_QUERIES",
+        default_value = "20"
+    )]
+    warmup_queries: usize,
+
+    /// Datasets with more hashes than this are not used for warm-up queries
+    #[clap(
+        long = "warmup-max-hashes",
+        env = "BRANCHWATER_WARMUP_MAX_HASHES",
+        default_value = "10000"
+    )]
+    warmup_max_hashes: usize,
+
+    /// Read all index files once before taking requests (/health answers
+    /// 503 until done), so index and filter blocks are in the page cache
+    #[clap(long = "preload-index", env = "BRANCHWATER_PRELOAD_INDEX")]
+    preload_index: bool,
+
+    /// Size of the reads used by --preload-index, in MiB (searches are not affected)
+    #[clap(
+        long = "preload-chunk-mb",
+        env = "BRANCHWATER_PRELOAD_CHUNK_MB",
+        default_value = "8"
+    )]
+    preload_chunk_mb: usize,
+
+    /// Threads available to run searches (and other blocking work)
+    #[clap(
+        long = "search-threads",
+        env = "BRANCHWATER_SEARCH_THREADS",
+        default_value = "512"
+    )]
+    search_threads: usize,
 }
 
 fn main() -> Result<()> {
@@ -83,10 +178,12 @@ fn main() -> Result<()> {
 
     let opts = Cli::parse();
 
-    let selection = Selection::builder()
-        .ksize(opts.ksize.into())
-        .scaled(opts.scaled as u32)
-        .build();
+    let selection = Arc::new(
+        Selection::builder()
+            .ksize(opts.ksize.into())
+            .scaled(opts.scaled as u32)
+            .build(),
+    );
 
     let threshold = opts.threshold_bp / opts.scaled;
 
@@ -98,10 +195,45 @@ fn main() -> Result<()> {
         }
     });
 
+    let opener = Arc::new(Opener {
+        location,
+        selection: Arc::clone(&selection),
+        accession_cache_size: opts.accession_cache_size,
+        warmup_queries: opts.warmup_queries,
+        warmup_max_hashes: opts.warmup_max_hashes,
+        preload_chunk: opts
+            .preload_index
+            .then_some(opts.preload_chunk_mb.max(1) * 1024 * 1024),
+    });
+    let index = Arc::new(CurrentIndex::new(opener.open(&opts.index)?));
+
+    let small_workers = opts.small_workers.unwrap_or_else(|| {
+        std::thread::available_parallelism()
+            .map(usize::from)
+            .unwrap_or(4)
+    });
+    let admission = Admission::new(
+        LaneConfig {
+            workers: small_workers,
+            memory_mb: opts.small_memory_mb,
+            max_queued: opts.max_queued,
+        },
+        LaneConfig {
+            workers: opts.large_workers,
+            memory_mb: opts.large_memory_mb,
+            max_queued: opts.max_queued,
+        },
+        opts.large_query_hashes,
+        Duration::from_secs(opts.queue_timeout),
+    );
+
     let state = Arc::new(AppState {
-        db: Arc::new(RevIndex::open(opts.index, true, location.as_deref())?),
-        selection: Arc::new(selection),
+        index: Arc::clone(&index),
+        selection,
         threshold,
+        admission,
+        ready: AtomicBool::new(false),
+        metrics: Metrics::default(),
     });
 
     // Build our application by composing routes
@@ -117,7 +249,23 @@ fn main() -> Result<()> {
                     .with_state(Arc::clone(&state)),
             ),
         )
-        .route("/health", get(health))
+        .route(
+            "/search/batch",
+            post_service(
+                search_batch
+                    .layer((
+                        DefaultBodyLimit::disable(),
+                        RequestBodyLimitLayer::new(1024 * 50_000 /* ~50mb */),
+                    ))
+                    .with_state(Arc::clone(&state)),
+            ),
+        )
+        .route(
+            "/search/accession/{accession}",
+            get(search_accession).with_state(Arc::clone(&state)),
+        )
+        .route("/health", get(health).with_state(Arc::clone(&state)))
+        .route("/metrics", get(metrics).with_state(Arc::clone(&state)))
         //.route("/metadata", get(metadata).with_state(Arc::clone(&state)))
         .route(
             "/metadata/accessions",
@@ -131,7 +279,17 @@ fn main() -> Result<()> {
             "/metadata/manifest",
             get(metadata_manifest).with_state(Arc::clone(&state)),
         )
-        //.route("/gather", post(gather))
+        .route(
+            "/gather",
+            post_service(
+                gather
+                    .layer((
+                        DefaultBodyLimit::disable(),
+                        RequestBodyLimitLayer::new(1024 * 5_000 /* ~5mb */),
+                    ))
+                    .with_state(Arc::clone(&state)),
+            ),
+        )
         // Add middleware to all routes
         .layer(
             ServiceBuilder::new()
@@ -147,10 +305,31 @@ fn main() -> Result<()> {
         );
 
     // Create the runtime
-    let rt = Runtime::new()?;
+    let rt = tokio::runtime::Builder::new_multi_thread()
+        .enable_all()
+        .max_blocking_threads(opts.search_threads.max(1))
+        .build()?;
 
     // Spawn the root task
     rt.block_on(async {
+        // requests are accepted (and /health answers 503) while warming up
+        let warming = Arc::clone(&state);
+        let warmup_opener = Arc::clone(&opener);
+        tokio::task::spawn_blocking(move || {
+            warmup_opener.warm_up(&warming.index.get());
+            warming.ready.store(true, Ordering::Release);
+            tracing::info!("index is ready");
+        });
+
+        if opts.watch > 0 {
+            tokio::spawn(reload::watch(
+                index,
+                opener,
+                opts.index,
+                Duration::from_secs(opts.watch),
+            ));
+        }
+
         let listener = TcpListener::bind(format!("0.0.0.0:{}", opts.port))
             .await
             .unwrap();
@@ -165,49 +344,173 @@ fn main() -> Result<()> {
 type SharedState = Arc<AppState>;
 
 struct AppState {
-    db: Arc<RevIndex>,
+    index: Arc<CurrentIndex>,
     selection: Arc<Selection>,
     threshold: usize,
+    admission: Admission,
+    /// set once the first index is warmed up
+    ready: AtomicBool,
+    metrics: Metrics,
 }
 
+/// Dataset searched and the limits of the search, for the accession cache
+type AccessionSearchKey = (Idx, Option<u64>, Option<usize>, Option<Idx>, Option<usize>);
+
 #[derive(Serialize)]
 struct Stats {
     ksize: u32,
     scaled: sourmash::ScaledType,
     threshold: usize,
     n_datasets: u32,
+    /// index version serving requests, changes when a new index is published
+    version: String,
 }
 
 impl AppState {
-    async fn search(&self, query: Signature) -> Result<Vec<String>, Box<dyn std::error::Error>> {
-        let db = self.db.clone();
-        let threshold = self.threshold;
+    /// Downsample queries to the index selection, with their names.
+    ///
+    /// Runs on a blocking thread: a metagenome sketch can hold millions of
+    /// hashes, and all of them are copied.
+    async fn prepare_queries(
+        &self,
+        queries: Vec<Signature>,
+    ) -> Result<Vec<(String, KmerMinHash)>, Box<dyn std::error::Error>> {
         let selection = self.selection.clone();
+        let prepared = tokio::task::spawn_blocking(move || {
+            queries
+                .into_iter()
+                .map(|sig| {
+                    let name = sig.name().unwrap_or_else(|| sig.md5sum());
+                    match prepare_query(sig, &selection) {
+                        Some(mh) => Ok((name, mh)),
+                        None => Err(format!(
+                            "Could not extract compatible sketch to compare for query '{name}'"
+                        )),
+                    }
+                })
+                .collect::<Result<Vec<_>, _>>()
+        })
+        .await??;
+        Ok(prepared)
+    }
 
-        let Ok((matches, query_size)) = tokio::task::spawn_blocking(move || {
-            if let Some(mh) = prepare_query(query, &selection) {
-                let counter = db.counter_for_query(&mh);
-                let matches = db.matches_from_counter(counter, threshold);
-                Ok((matches, mh.size() as f64))
-            } else {
-                Err("Could not extract compatible sketch to compare")
+    async fn search(
+        &self,
+        index: &IndexVersion,
+        query: Signature,
+        limits: SearchLimits,
+    ) -> Result<Matches, Box<dyn std::error::Error>> {
+        let db = index.db.clone();
+        let threshold = self.threshold;
+
+        let (_, mh) = self.prepare_queries(vec![query]).await?.swap_remove(0);
+        let permit = self.admission.admit(mh.size(), false).await?;
+
+        let start = Instant::now();
+        let matches = tokio::task::spawn_blocking(move || {
+            let _permit = permit;
+            let query_size = mh.size() as f64;
+            let min_count = limits.min_count(threshold, query_size);
+
+            let counter = db.counter_for_query(&mh);
+            let matches = search::select_matches(
+                counter
+                    .iter()
+                    .map(|(idx, size)| (*idx, *size))
+                    .filter(|(idx, _)| limits.includes(*idx)),
+                min_count,
+                limits.max_results,
+            );
+            Matches {
+                matches,
+                query_size,
             }
         })
+        .await?;
+        self.metrics.record_search(start.elapsed());
+
+        Ok(matches)
+    }
+
+    /// Search with the stored signature of a dataset in the index.
+    ///
+    /// Frequently searched datasets are served from `accession_cache`.
+    async fn search_dataset(
+        &self,
+        index: &IndexVersion,
+        dataset_id: Idx,
+        limits: SearchLimits,
+    ) -> Result<Arc<Matches>, Box<dyn std::error::Error>> {
+        let key = (
+            dataset_id,
+            limits.min_containment.map(f64::to_bits),
+            limits.max_results,
+            limits.since,
+            limits.downsampled,
+        );
+        if let Some(matches) = index.accession_cache.get(&key) {
+            return Ok(matches);
+        }
+
+        let db = index.db.clone();
+        let sig: Signature = tokio::task::spawn_blocking(move || {
+            db.collection()
+                .sig_for_dataset(dataset_id)
+                .map(Signature::from)
+        })
         .await?
-        else {
-            return Err("Could not extract compatible sketch to compare".into());
-        };
+        .map_err(|e| format!("Could not load stored signature: {e}"))?;
 
-        let mut csv = vec!["SRA accession,containment".into()];
-        csv.extend(matches.into_iter().map(|(path, size)| {
-            let containment = size as f64 / query_size;
-            format!(
-                "{},{}",
-                path.split('/').last().unwrap().split('.').next().unwrap(),
-                containment
-            )
-        }));
-        Ok(csv)
+        let matches = Arc::new(self.search(index, sig, limits).await?);
+        index.accession_cache.insert(key, Arc::clone(&matches));
+        Ok(matches)
+    }
+
+    async fn search_batch(
+        &self,
+        index: &IndexVersion,
+        queries: Vec<Signature>,
+        limits: SearchLimits,
+    ) -> Result<Vec<QueryMatches>, Box<dyn std::error::Error>> {
+        let db = index.db.clone();
+        let threshold = self.threshold;
+
+        let (names, sketches): (Vec<_>, Vec<_>) =
+            self.prepare_queries(queries).await?.into_iter().unzip();
+        // the batch runs as a single query over the union of its sketches
+        let n_hashes = sketches.iter().map(|mh| mh.size()).sum();
+        let permit = self.admission.admit(n_hashes, false).await?;
+
+        let start = Instant::now();
+        let results: Vec<QueryMatches> = tokio::task::spawn_blocking(move || {
+            let _permit = permit;
+            let counts = search::batch_counts(&db, &sketches);
+
+            names
+                .into_iter()
+                .zip(sketches.iter())
+                .zip(counts)
+                .map(|((name, mh), counts)| {
+                    let query_size = mh.size() as f64;
+                    let matches = search::select_matches(
+                        counts.into_iter().filter(|(idx, _)| limits.includes(*idx)),
+                        limits.min_count(threshold, query_size),
+                        limits.max_results,
+                    );
+                    QueryMatches {
+                        name,
+                        matches: Arc::new(Matches {
+                            matches,
+                            query_size,
+                        }),
+                    }
+                })
+                .collect()
+        })
+        .await?;
+        self.metrics.record_search(start.elapsed());
+
+        Ok(results)
     }
 
     fn parse_sig(&self, raw_data: &[u8]) -> Result<Signature, BoxError> {
@@ -216,26 +519,208 @@ impl AppState {
             .select(&self.selection)?)
     }
 
-    fn manifest(&self) -> &Manifest {
-        self.db.collection().manifest()
+    fn parse_sigs(&self, raw_data: &[u8]) -> Result<Vec<Signature>, BoxError> {
+        let sigs = Signature::from_reader(raw_data)?;
+        if sigs.is_empty() {
+            return Err("no signatures found".into());
+        }
+        Ok(sigs
+            .into_iter()
+            .map(|sig| sig.select(&self.selection))
+            .collect::<Result<_, _>>()?)
+    }
+
+    async fn gather(
+        &self,
+        query: Signature,
+        threshold_bp: Option<usize>,
+    ) -> Result<Vec<u8>, Box<dyn std::error::Error>> {
+        let db = self.index.get().db.clone();
+        let selection = self.selection.clone();
+        let (_, mh) = self.prepare_queries(vec![query]).await?.swap_remove(0);
+        // gather does many passes over the matches, always a large query
+        let permit = self.admission.admit(mh.size(), true).await?;
+
+        let threshold = match threshold_bp {
+            Some(bp) => bp / self.selection.scaled().expect("error extracting scaled") as usize,
+            None => self.threshold,
+        };
+
+        let csv = tokio::task::spawn_blocking(move || {
+            let _permit = permit;
+            let (counter, query_colors, hash_to_color) = db.prepare_gather_counters(&mh);
+            let matches = db.gather(
+                counter,
+                query_colors,
+                hash_to_color,
+                threshold,
+                &mh,
+                Some((*selection).clone()),
+            )?;
+
+            let mut wtr = csv::Writer::from_writer(vec![]);
+            wtr.write_record([
+                "SRA accession",
+                "gather_result_rank",
+                "intersect_bp",
+                "f_orig_query",
+                "f_match",
+                "f_unique_to_query",
+                "match_containment_ani",
+            ])?;
+            for m in matches {
+                wtr.serialize((
+                    accessions::accession_from_name(m.name()),
+                    m.gather_result_rank(),
+                    m.intersect_bp(),
+                    m.f_orig_query(),
+                    m.f_match(),
+                    m.f_unique_to_query(),
+                    m.match_containment_ani(),
+                ))?;
+            }
+            Ok::<_, Box<dyn std::error::Error + Send + Sync>>(
+                wtr.into_inner().map_err(|e| e.to_string())?,
+            )
+        })
+        .await?
+        .map_err(|e| e.to_string())?;
+
+        Ok(csv)
     }
 
     fn stats(&self) -> Stats {
-        let manifest = self.db.collection().manifest();
+        let index = self.index.get();
+        let manifest = index.db.collection().manifest();
         Stats {
             ksize: self.selection.ksize().expect("error extracting ksize"),
             scaled: self.selection.scaled().expect("error extracting scaled"),
             threshold: self.threshold,
             n_datasets: manifest.len() as u32,
+            version: index.version.clone(),
         }
     }
 }
 
+/// Per-query limits on the matches returned by `/search`
+#[derive(Debug, Default, Clone, Copy)]
+struct SearchLimits {
+    min_containment: Option<f64>,
+    max_results: Option<usize>,
+    /// only match datasets from this position in the manifest on,
+    /// e.g. the ones added since a previous search
+    since: Option<Idx>,
+    /// the query keeps one in `downsampled` of its hashes (e.g. a quick
+    /// preview), so its intersections are that many times smaller too
+    downsampled: Option<usize>,
+}
+
+impl SearchLimits {
+    fn includes(&self, dataset_id: Idx) -> bool {
+        self.since.map_or(true, |since| dataset_id >= since)
+    }
+
+    /// Minimum intersection size for a match, never below the server threshold
+    /// (scaled down with the query for downsampled queries)
+    fn min_count(&self, threshold: usize, query_size: f64) -> usize {
+        let min_containment = self.min_containment.unwrap_or(0.0);
+        // tolerance for containments computed as size / query_size downstream
+        let count = (min_containment * query_size - 1e-9).ceil().max(0.0) as usize;
+        count.max(threshold / self.downsampled.unwrap_or(1))
+    }
+}
+
+#[derive(Deserialize, Debug)]
+struct SearchParams {
+    format: Option<Format>,
+    min_containment: Option<f64>,
+    max_results: Option<usize>,
+    since: Option<Idx>,
+    downsampled: Option<usize>,
+}
+
+impl SearchParams {
+    /// Limits from the query string, or the `x-min-containment`,
+    /// `x-max-results`, `x-since` and `x-downsampled` headers
+    fn limits(&self, headers: &HeaderMap) -> Result<SearchLimits, String> {
+        fn header_value<T: std::str::FromStr>(
+            headers: &HeaderMap,
+            name: &str,
+        ) -> Result<Option<T>, String> {
+            headers
+                .get(name)
+                .map(|v| {
+                    v.to_str()
+                        .ok()
+                        .and_then(|v| v.trim().parse().ok())
+                        .ok_or_else(|| format!("Invalid value for {name} header"))
+                })
+                .transpose()
+        }
+
+        let limits = SearchLimits {
+            min_containment: match self.min_containment {
+                Some(v) => Some(v),
+                None => header_value(headers, "x-min-containment")?,
+            },
+            max_results: match self.max_results {
+                Some(v) => Some(v),
+                None => header_value(headers, "x-max-results")?,
+            },
+            since: match self.since {
+                Some(v) => Some(v),
+                None => header_value(headers, "x-since")?,
+            },
+            downsampled: match self.downsampled {
+                Some(v) => Some(v),
+                None => header_value(headers, "x-downsampled")?,
+            },
+        };
+
+        if let Some(c) = limits.min_containment {
+            if !(0.0..=1.0).contains(&c) {
+                return Err(format!("min_containment must be between 0 and 1, got {c}"));
+            }
+        }
+        if limits.max_results == Some(0) {
+            return Err("max_results must be at least 1".into());
+        }
+        if limits.downsampled == Some(0) {
+            return Err("downsampled must be at least 1".into());
+        }
+
+        Ok(limits)
+    }
+
+    /// Response format, from `?format=` or the `Accept` header (CSV by default)
+    fn format(&self, headers: &HeaderMap) -> Format {
+        self.format.unwrap_or_else(|| {
+            let accept = headers
+                .get(header::ACCEPT)
+                .and_then(|v| v.to_str().ok())
+                .unwrap_or_default();
+            if accept.contains(stream::ARROW_STREAM_MIME) {
+                Format::Arrow
+            } else {
+                Format::Csv
+            }
+        })
+    }
+}
+
 async fn search(
     State(state): State<SharedState>,
+    Query(params): Query<SearchParams>,
+    headers: HeaderMap,
     bytes: Bytes,
     //) -> Result<Json<serde_json::Value>, StatusCode> {
 ) -> impl IntoResponse {
+    let format = params.format(&headers);
+    let limits = match params.limits(&headers) {
+        Ok(limits) => limits,
+        Err(e) => return (StatusCode::BAD_REQUEST, e).into_response(),
+    };
+
     let sig = match state.parse_sig(&bytes) {
         Ok(sig) => sig,
         Err(e) => {
@@ -249,50 +734,201 @@ async fn search(
         }
     };
 
-    match state.search(sig).await {
+    // matches are named with the accessions of the index they were found in
+    let index = state.index.get();
+    match state.search(&index, sig, limits).await {
         Ok(matches) => (
             StatusCode::OK,
-            [(header::CONTENT_TYPE, "text/plain; charset=utf-8")],
-            matches.join("\n"),
+            [(header::CONTENT_TYPE, format.content_type())],
+            stream::matches_body(Arc::new(matches), Arc::clone(&index.accessions), format),
         )
             .into_response(),
-        Err(e) => (
-            StatusCode::INTERNAL_SERVER_ERROR,
-            format!("Something went wrong: {e}"),
+        Err(e) => error_response(e),
+    }
+}
+
+/// Search with a dataset already in the index, using its stored signature
+async fn search_accession(
+    State(state): State<SharedState>,
+    Path(accession): Path<String>,
+    Query(params): Query<SearchParams>,
+    headers: HeaderMap,
+) -> impl IntoResponse {
+    let format = params.format(&headers);
+    let limits = match params.limits(&headers) {
+        Ok(limits) => limits,
+        Err(e) => return (StatusCode::BAD_REQUEST, e).into_response(),
+    };
+
+    let index = state.index.get();
+    let Some(dataset_id) = index.accessions.find(&accession) else {
+        return (
+            StatusCode::NOT_FOUND,
+            format!("Accession {accession} not found in the index"),
+        )
+            .into_response();
+    };
+
+    match state.search_dataset(&index, dataset_id, limits).await {
+        Ok(matches) => (
+            StatusCode::OK,
+            [(header::CONTENT_TYPE, format.content_type())],
+            stream::matches_body(matches, Arc::clone(&index.accessions), format),
         )
             .into_response(),
+        Err(e) => error_response(e),
     }
 }
 
-async fn health() -> Response<Body> {
-    (StatusCode::OK, "I'm doing science and I'm still alive").into_response()
+/// Search for many queries at once, sharing index lookups for hashes they have in common
+async fn search_batch(
+    State(state): State<SharedState>,
+    Query(params): Query<SearchParams>,
+    headers: HeaderMap,
+    bytes: Bytes,
+) -> impl IntoResponse {
+    let format = params.format(&headers);
+    let limits = match params.limits(&headers) {
+        Ok(limits) => limits,
+        Err(e) => return (StatusCode::BAD_REQUEST, e).into_response(),
+    };
+
+    let sigs = match state.parse_sigs(&bytes) {
+        Ok(sigs) => sigs,
+        Err(e) => {
+            return (
+                StatusCode::BAD_REQUEST,
+                format!("Error parsing signatures: {e}"),
+            )
+                .into_response()
+        }
+    };
+
+    let index = state.index.get();
+    match state.search_batch(&index, sigs, limits).await {
+        Ok(results) => (
+            StatusCode::OK,
+            [(header::CONTENT_TYPE, format.content_type())],
+            stream::batch_body(results, Arc::clone(&index.accessions), format),
+        )
+            .into_response(),
+        Err(e) => error_response(e),
+    }
+}
+
+#[derive(Deserialize, Debug)]
+struct GatherParams {
+    threshold_bp: Option<usize>,
 }
 
-async fn metadata_manifest(State(state): State<SharedState>) -> Response<Body> {
-    let manifest = state.manifest();
-    let mut manifest_csv = Vec::new();
-    {
-        let mut wtr = csv::Writer::from_writer(&mut manifest_csv);
-        for record in manifest.iter() {
-            wtr.serialize(record).expect("error writing record");
+/// Min-set-cover of the query: a non-redundant list of datasets that explain it
+async fn gather(
+    State(state): State<SharedState>,
+    Query(params): Query<GatherParams>,
+    bytes: Bytes,
+) -> impl IntoResponse {
+    let sig = match state.parse_sig(&bytes) {
+        Ok(sig) => sig,
+        Err(e) => {
+            return (
+                StatusCode::BAD_REQUEST,
+                format!("Error parsing signature: {e}"),
+            )
+                .into_response()
         }
+    };
+
+    match state.gather(sig, params.threshold_bp).await {
+        Ok(csv) => (
+            StatusCode::OK,
+            [(header::CONTENT_TYPE, "text/plain; charset=utf-8")],
+            csv,
+        )
+            .into_response(),
+        Err(e) => error_response(e),
+    }
+}
+
+/// Response for a failed query: 503 with Retry-After if it was not admitted
+fn error_response(e: Box<dyn std::error::Error>) -> Response<Body> {
+    if let Some(rejected) = e.downcast_ref::<Rejected>() {
+        return (
+            StatusCode::SERVICE_UNAVAILABLE,
+            [(
+                header::RETRY_AFTER,
+                rejected.retry_after.as_secs().to_string(),
+            )],
+            rejected.to_string(),
+        )
+            .into_response();
     }
 
     (
-        StatusCode::OK,
-        [(header::CONTENT_TYPE, "text/csv; charset=utf-8")],
-        manifest_csv,
+        StatusCode::INTERNAL_SERVER_ERROR,
+        format!("Something went wrong: {e}"),
     )
         .into_response()
 }
 
-async fn metadata_accessions(State(state): State<SharedState>) -> Response<Body> {
-    let manifest = state.manifest();
+async fn health(State(state): State<SharedState>) -> Response<Body> {
+    if !state.ready.load(Ordering::Acquire) {
+        return (
+            StatusCode::SERVICE_UNAVAILABLE,
+            [(header::RETRY_AFTER, "10")],
+            "warming up the index",
+        )
+            .into_response();
+    }
+    (StatusCode::OK, "I'm doing science and I'm still alive").into_response()
+}
 
-    let accs: Vec<String> = manifest.iter().map(|r| r.name().into()).collect();
-    let accs = accs.join("\n");
+/// Search and cache statistics, in the Prometheus text format
+async fn metrics(State(state): State<SharedState>) -> Response<Body> {
+    let index = state.index.get();
+    let body = metrics::render(
+        &state.metrics,
+        metrics::Snapshot {
+            ready: state.ready.load(Ordering::Acquire),
+            n_datasets: index.accessions.len(),
+            accession_cache: index.accession_cache.hits_and_misses(),
+        },
+    );
+    (
+        StatusCode::OK,
+        [(header::CONTENT_TYPE, "text/plain; version=0.0.4")],
+        body,
+    )
+        .into_response()
+}
 
-    (StatusCode::OK, accs).into_response()
+async fn metadata_manifest(
+    State(state): State<SharedState>,
+    Query(params): Query<ListingParams>,
+    headers: HeaderMap,
+) -> Response<Body> {
+    let listings = Arc::clone(&state.index.get().listings);
+    listings::listing_response(
+        &listings.manifest,
+        &listings.etag,
+        &headers,
+        params,
+        "text/csv; charset=utf-8",
+    )
+}
+
+async fn metadata_accessions(
+    State(state): State<SharedState>,
+    Query(params): Query<ListingParams>,
+    headers: HeaderMap,
+) -> Response<Body> {
+    let listings = Arc::clone(&state.index.get().listings);
+    listings::listing_response(
+        &listings.accessions,
+        &listings.etag,
+        &headers,
+        params,
+        "text/plain; charset=utf-8",
+    )
 }
 
 async fn metadata_stats(State(state): State<SharedState>) -> Response<Body> {
@@ -301,22 +937,58 @@ async fn metadata_stats(State(state): State<SharedState>) -> Response<Body> {
     (StatusCode::OK, Json(stats)).into_response()
 }
 
-async fn handle_error(error: BoxError) -> impl IntoResponse {
+async fn handle_error(error: BoxError) -> Response<Body> {
     if error.is::<tower::timeout::error::Elapsed>() {
-        return (StatusCode::REQUEST_TIMEOUT, Cow::from("request timed out"));
+        return (StatusCode::REQUEST_TIMEOUT, Cow::from("request timed out")).into_response();
     }
 
     if error.is::<tower::load_shed::error::Overloaded>() {
         return (
             StatusCode::SERVICE_UNAVAILABLE,
+            [(header::RETRY_AFTER, "5")],
             Cow::from("service is overloaded, try again later"),
-        );
+        )
+            .into_response();
     }
 
     (
         StatusCode::INTERNAL_SERVER_ERROR,
         Cow::from(format!("Unhandled internal error: {}", error)),
     )
+        .into_response()
+}
+
+#[test]
+fn search_limits_min_count() {
+    let limits = SearchLimits {
+        min_containment: Some(0.1),
+        max_results: None,
+        since: None,
+        downsampled: None,
+    };
+    assert_eq!(limits.min_count(50, 1000.0), 100);
+    assert_eq!(limits.min_count(500, 1000.0), 500);
+    assert_eq!(limits.min_count(50, 1234.0), 124);
+    assert_eq!(SearchLimits::default().min_count(50, 1000.0), 50);
+
+    // the server threshold shrinks with downsampled queries
+    let preview = SearchLimits {
+        downsampled: Some(10),
+        ..Default::default()
+    };
+    assert_eq!(preview.min_count(50, 1000.0), 5);
+    assert_eq!(preview.min_count(55, 1000.0), 5);
+}
+
+#[test]
+fn search_limits_since() {
+    let limits = SearchLimits {
+        since: Some(10),
+        ..Default::default()
+    };
+    assert!(!limits.includes(9));
+    assert!(limits.includes(10));
+    assert!(SearchLimits::default().includes(0));
 }
 
 #[test]
@@ -0,0 +1,137 @@
+use std::fmt::Write;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::time::Duration;
+
+/// Counters for the `/metrics` endpoint, in the Prometheus text format.
+#[derive(Default)]
+pub struct Metrics {
+    searches: AtomicU64,
+    /// time spent counting matches in the index (`counter_for_query`)
+    search_micros: AtomicU64,
+}
+
+impl Metrics {
+    pub fn record_search(&self, elapsed: Duration) {
+        self.searches.fetch_add(1, Ordering::Relaxed);
+        self.search_micros
+            .fetch_add(elapsed.as_micros() as u64, Ordering::Relaxed);
+    }
+}
+
+/// Values known by the server when `/metrics` is requested
+pub struct Snapshot {
+    pub ready: bool,
+    pub n_datasets: usize,
+    pub accession_cache: (u64, u64),
+}
+
+pub fn render(metrics: &Metrics, snapshot: Snapshot) -> String {
+    let mut out = String::new();
+    let mut metric = |name: &str, kind: &str, help: &str, value: String| {
+        let _ = writeln!(out, "# HELP {name} {help}");
+        let _ = writeln!(out, "# TYPE {name} {kind}");
+        let _ = writeln!(out, "{name} {value}");
+    };
+
+    metric(
+        "branchwater_ready",
+        "gauge",
+        "Whether the index is warmed up and taking searches",
+        (snapshot.ready as u8).to_string(),
+    );
+    metric(
+        "branchwater_index_datasets",
+        "gauge",
+        "Datasets in the index being served",
+        snapshot.n_datasets.to_string(),
+    );
+    metric(
+        "branchwater_searches_total",
+        "counter",
+        "Searches run against the index",
+        metrics.searches.load(Ordering::Relaxed).to_string(),
+    );
+    metric(
+        "branchwater_search_seconds_total",
+        "counter",
+        "Time spent reading the index for searches",
+        format!(
+            "{:.6}",
+            metrics.search_micros.load(Ordering::Relaxed) as f64 / 1e6
+        ),
+    );
+    let (hits, misses) = snapshot.accession_cache;
+    metric(
+        "branchwater_accession_cache_hits_total",
+        "counter",
+        "Searches by accession answered from the results cache",
+        hits.to_string(),
+    );
+    metric(
+        "branchwater_accession_cache_misses_total",
+        "counter",
+        "Searches by accession not in the results cache",
+        misses.to_string(),
+    );
+
+    // block reads go through the page cache: bytes read by the process
+    // against bytes that had to come from storage give its hit ratio
+    if let Some(io) = std::fs::read_to_string("/proc/self/io")
+        .ok()
+        .and_then(|s| parse_proc_io(&s))
+    {
+        metric(
+            "branchwater_read_bytes_total",
+            "counter",
+            "Bytes read by the server, from the page cache or storage",
+            io.0.to_string(),
+        );
+        metric(
+            "branchwater_storage_read_bytes_total",
+            "counter",
+            "Bytes read by the server that were not in the page cache",
+            io.1.to_string(),
+        );
+    }
+
+    out
+}
+
+/// `rchar` and `read_bytes` from `/proc/<pid>/io`
+fn parse_proc_io(content: &str) -> Option<(u64, u64)> {
+    let field = |name: &str| {
+        content
+            .lines()
+            .find_map(|line| line.strip_prefix(name)?.strip_prefix(':'))
+            .and_then(|v| v.trim().parse().ok())
+    };
+    Some((field("rchar")?, field("read_bytes")?))
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    #[test]
+    fn proc_io() {
+        let content = "rchar: 1000\nwchar: 10\nsyscr: 5\nsyscw: 1\nread_bytes: 200\nwrite_bytes: 0\ncancelled_write_bytes: 0\n";
+        assert_eq!(parse_proc_io(content), Some((1000, 200)));
+        assert_eq!(parse_proc_io("rchar: 1000\n"), None);
+    }
+
+    #[test]
+    fn render_metrics() {
+        let metrics = Metrics::default();
+        metrics.record_search(Duration::from_millis(1500));
+        let text = render(
+            &metrics,
+            Snapshot {
+                ready: true,
+                n_datasets: 42,
+                accession_cache: (3, 1),
+            },
+        );
+        assert!(text.contains("\nbranchwater_search_seconds_total 1.500000\n"));
+        assert!(text.contains("\nbranchwater_accession_cache_hits_total 3\n"));
+    }
+}
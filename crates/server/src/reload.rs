@@ -0,0 +1,200 @@
+use std::fs::File;
+use std::io::BufReader;
+use std::sync::{Arc, RwLock};
+use std::time::{Duration, Instant};
+
+use camino::{Utf8Path as Path, Utf8PathBuf as PathBuf};
+use color_eyre::eyre::Result;
+use sourmash::index::revindex::{prepare_query, RevIndex, RevIndexOps};
+use sourmash::selection::Selection;
+use sourmash::signature::Signature;
+
+use crate::accessions::AccessionTable;
+use crate::cache::ResultsCache;
+use crate::listings::Listings;
+use crate::stream::Matches;
+use crate::AccessionSearchKey;
+
+/// An opened index, with everything derived from its manifest.
+///
+/// Requests take a reference to the current version when they start and
+/// use it until they finish, so dataset ids are always resolved with the
+/// manifest they were searched in.
+pub struct IndexVersion {
+    /// name of the index directory, reported in `/metadata/stats`
+    pub version: String,
+    /// index directory, with symlinks resolved
+    pub path: PathBuf,
+    pub db: Arc<RevIndex>,
+    pub accessions: Arc<AccessionTable>,
+    pub listings: Arc<Listings>,
+    pub accession_cache: ResultsCache<AccessionSearchKey, Matches>,
+}
+
+/// The index version serving new requests, replaced as new versions are published.
+pub struct CurrentIndex {
+    current: RwLock<Arc<IndexVersion>>,
+}
+
+impl CurrentIndex {
+    pub fn new(index: IndexVersion) -> Self {
+        CurrentIndex {
+            current: RwLock::new(Arc::new(index)),
+        }
+    }
+
+    pub fn get(&self) -> Arc<IndexVersion> {
+        Arc::clone(&self.current.read().unwrap())
+    }
+
+    /// Switch new requests to `index`. The previous version is closed once
+    /// the requests still using it finish.
+    fn replace(&self, index: IndexVersion) {
+        *self.current.write().unwrap() = Arc::new(index);
+    }
+}
+
+/// Opens and warms up index versions.
+pub struct Opener {
+    pub location: Option<String>,
+    pub selection: Arc<Selection>,
+    pub accession_cache_size: usize,
+    pub warmup_queries: usize,
+    /// only datasets with at most this many hashes are used for warm-up queries
+    pub warmup_max_hashes: usize,
+    /// read the index files once before searching, in chunks of this many bytes
+    pub preload_chunk: Option<usize>,
+}
+
+impl Opener {
+    pub fn open(&self, path: &Path) -> Result<IndexVersion> {
+        let path = path.canonicalize_utf8()?;
+        let version = path.file_name().unwrap_or(path.as_str()).to_string();
+
+        let db = RevIndex::open(&path, true, self.location.as_deref())?;
+        let accessions = AccessionTable::from_manifest(db.collection().manifest());
+        tracing::info!(
+            "index {version}: resolved accessions for {} datasets",
+            accessions.len()
+        );
+        let listings = Listings::from_manifest(db.collection().manifest());
+
+        Ok(IndexVersion {
+            version,
+            path,
+            db: Arc::new(db),
+            accessions: Arc::new(accessions),
+            listings: Arc::new(listings),
+            accession_cache: ResultsCache::new(self.accession_cache_size),
+        })
+    }
+
+    /// Get an index ready for requests: load its files into the page cache
+    /// (if `preload_chunk` is set), then search with the stored signatures
+    /// of datasets spread over the index.
+    ///
+    /// Only small datasets (up to `warmup_max_hashes`) are searched: most are
+    /// metagenomes, and a search with one of them can take very long.
+    pub fn warm_up(&self, index: &IndexVersion) {
+        if let Some(chunk) = self.preload_chunk {
+            let start = Instant::now();
+            match preload_files(&index.path, chunk) {
+                Ok(bytes) => tracing::info!(
+                    "index {}: preloaded {} MiB in {:.1?}",
+                    index.version,
+                    bytes / (1024 * 1024),
+                    start.elapsed()
+                ),
+                Err(e) => tracing::warn!("index {}: could not preload: {e}", index.version),
+            }
+        }
+
+        let collection = index.db.collection();
+        let candidates: Vec<usize> = if self.warmup_queries > 0 {
+            collection
+                .manifest()
+                .iter()
+                .enumerate()
+                .filter(|(_, record)| *record.n_hashes() <= self.warmup_max_hashes)
+                .map(|(dataset_id, _)| dataset_id)
+                .collect()
+        } else {
+            vec![]
+        };
+        let n_queries = self.warmup_queries.min(candidates.len());
+        for i in 0..n_queries {
+            let dataset_id = candidates[i * candidates.len() / n_queries] as u32;
+            let Ok(sig) = collection.sig_for_dataset(dataset_id) else {
+                continue;
+            };
+            if let Some(mh) = prepare_query(Signature::from(sig), &self.selection) {
+                index.db.counter_for_query(&mh);
+            }
+        }
+        if n_queries > 0 {
+            tracing::info!("index {}: ran {n_queries} warm-up queries", index.version);
+        }
+    }
+}
+
+/// Read the table files of a RocksDB index sequentially, so their data,
+/// index and filter blocks are in the page cache before the first search.
+fn preload_files(path: &Path, chunk: usize) -> std::io::Result<u64> {
+    let mut bytes = 0;
+    for entry in path.read_dir_utf8()? {
+        let entry = entry?;
+        if entry.path().extension() == Some("sst") {
+            let mut file = BufReader::with_capacity(chunk, File::open(entry.path())?);
+            bytes += std::io::copy(&mut file, &mut std::io::sink())?;
+        }
+    }
+    Ok(bytes)
+}
+
+/// Check every `interval` whether `path` (usually a symlink to the
+/// directory of the current version) points to a new index, and switch
+/// to it once it is open and warmed up.
+pub async fn watch(
+    current: Arc<CurrentIndex>,
+    opener: Arc<Opener>,
+    path: PathBuf,
+    interval: Duration,
+) {
+    let mut ticks = tokio::time::interval(interval);
+    let mut failed: Option<PathBuf> = None;
+    loop {
+        ticks.tick().await;
+
+        let Ok(target) = path.canonicalize_utf8() else {
+            // e.g. while the symlink is being replaced
+            continue;
+        };
+        if target == current.get().path || failed.as_ref() == Some(&target) {
+            continue;
+        }
+
+        tracing::info!("opening new index version at {target}");
+        let opener = Arc::clone(&opener);
+        let opening = target.clone();
+        let opened = tokio::task::spawn_blocking(move || {
+            let index = opener.open(&opening)?;
+            opener.warm_up(&index);
+            Ok::<_, color_eyre::eyre::Report>(index)
+        });
+        match opened.await {
+            Ok(Ok(index)) => {
+                tracing::info!("switching to index version {}", index.version);
+                current.replace(index);
+                failed = None;
+            }
+            Ok(Err(e)) => {
+                tracing::error!("could not open index at {target}: {e}");
+                failed = Some(target);
+            }
+            Err(e) => {
+                tracing::error!("could not open index at {target}: {e}");
+                failed = Some(target);
+            }
+        }
+    }
+}
@@ -0,0 +1,92 @@
+use std::collections::HashMap;
+
+use sourmash::encodings::Idx;
+use sourmash::index::revindex::{RevIndex, RevIndexOps};
+use sourmash::sketch::minhash::KmerMinHash;
+
+/// Matches with at least `min_count` shared hashes, sorted by decreasing
+/// intersection size and truncated to the top `max_results`.
+pub fn select_matches(
+    counts: impl Iterator<Item = (Idx, usize)>,
+    min_count: usize,
+    max_results: Option<usize>,
+) -> Vec<(Idx, usize)> {
+    let by_size = |a: &(Idx, usize), b: &(Idx, usize)| b.1.cmp(&a.1).then(a.0.cmp(&b.0));
+
+    let mut matches: Vec<_> = counts.filter(|(_, size)| *size >= min_count).collect();
+    if let Some(k) = max_results {
+        if k > 0 && matches.len() > k {
+            // partition around the k-th match, only the top k are sorted
+            matches.select_nth_unstable_by(k - 1, by_size);
+            matches.truncate(k);
+        }
+    }
+    matches.sort_unstable_by(by_size);
+    matches
+}
+
+/// Intersection sizes with every dataset, for each query in a batch.
+///
+/// Hashes are grouped by the set of queries containing them, and each group
+/// is looked up once with `counter_for_query`. Every hash in the union of
+/// the queries is read from the index a single time, and the counts for a
+/// group are added to each query in it.
+pub fn batch_counts(db: &RevIndex, queries: &[KmerMinHash]) -> Vec<HashMap<Idx, usize>> {
+    let mut counts = vec![HashMap::new(); queries.len()];
+    let Some(first) = queries.first() else {
+        return counts;
+    };
+
+    let mut membership: HashMap<u64, Vec<u32>> = HashMap::new();
+    for (i, query) in queries.iter().enumerate() {
+        for hash in query.iter_mins() {
+            membership.entry(*hash).or_default().push(i as u32);
+        }
+    }
+
+    let mut groups: HashMap<Vec<u32>, Vec<u64>> = HashMap::new();
+    for (hash, members) in membership {
+        groups.entry(members).or_default().push(hash);
+    }
+
+    // same sketch parameters as the queries, without copying their hashes
+    let mut empty = first.clone();
+    empty.clear();
+
+    for (members, hashes) in groups {
+        let mut mh = empty.clone();
+        mh.add_many(&hashes).expect("error adding hashes");
+
+        let counter = db.counter_for_query(&mh);
+        for i in members {
+            let query_counts = &mut counts[i as usize];
+            for (dataset_id, size) in counter.iter() {
+                *query_counts.entry(*dataset_id).or_insert(0) += *size;
+            }
+        }
+    }
+
+    counts
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    #[test]
+    fn select_matches_sorted_and_filtered() {
+        let counts = vec![(0, 5), (1, 50), (2, 20), (3, 50), (4, 1)];
+        assert_eq!(
+            select_matches(counts.clone().into_iter(), 5, None),
+            vec![(1, 50), (3, 50), (2, 20), (0, 5)]
+        );
+        assert_eq!(
+            select_matches(counts.clone().into_iter(), 5, Some(2)),
+            vec![(1, 50), (3, 50)]
+        );
+        assert_eq!(
+            select_matches(counts.into_iter(), 30, Some(10)),
+            vec![(1, 50), (3, 50)]
+        );
+    }
+}
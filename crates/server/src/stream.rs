@@ -0,0 +1,216 @@
+use std::io::{self, Write};
+use std::sync::Arc;
+
+use arrow::array::{ArrayRef, Float64Array, StringArray};
+use arrow::datatypes::{DataType, Field, Schema};
+use arrow::ipc::writer::StreamWriter;
+use arrow::record_batch::RecordBatch;
+use axum::body::{Body, Bytes};
+use serde::Deserialize;
+use sourmash::encodings::Idx;
+use tokio::sync::mpsc;
+use tokio_stream::wrappers::ReceiverStream;
+use tower::BoxError;
+
+use crate::accessions::AccessionTable;
+
+/// Size of each chunk of the response body
+const CHUNK_SIZE: usize = 64 * 1024;
+
+/// Chunks waiting to be sent to the client. Once full, writing the
+/// response pauses until the client catches up.
+const CHANNEL_CAPACITY: usize = 8;
+
+/// Rows in each Arrow record batch
+const ARROW_BATCH_ROWS: usize = 8192;
+
+pub const ARROW_STREAM_MIME: &str = "application/vnd.apache.arrow.stream";
+
+#[derive(Deserialize, Debug, Default, Clone, Copy, PartialEq)]
+#[serde(rename_all = "lowercase")]
+pub enum Format {
+    #[default]
+    Csv,
+    Arrow,
+}
+
+impl Format {
+    pub fn content_type(&self) -> &'static str {
+        match self {
+            Format::Csv => "text/plain; charset=utf-8",
+            Format::Arrow => ARROW_STREAM_MIME,
+        }
+    }
+}
+
+/// Search matches, as (dataset index, intersection size) pairs
+pub struct Matches {
+    pub matches: Vec<(Idx, usize)>,
+    pub query_size: f64,
+}
+
+/// Matches for one query of a batch.
+///
+/// Shared with the results cache, so cached matches are streamed without a copy.
+pub struct QueryMatches {
+    pub name: String,
+    pub matches: Arc<Matches>,
+}
+
+/// `io::Write` adapter sending fixed-size chunks to a response body
+struct ChunkWriter {
+    tx: mpsc::Sender<Result<Bytes, BoxError>>,
+    buf: Vec<u8>,
+}
+
+impl ChunkWriter {
+    fn new(tx: mpsc::Sender<Result<Bytes, BoxError>>) -> Self {
+        ChunkWriter {
+            tx,
+            buf: Vec::with_capacity(CHUNK_SIZE),
+        }
+    }
+}
+
+impl Write for ChunkWriter {
+    fn write(&mut self, data: &[u8]) -> io::Result<usize> {
+        self.buf.extend_from_slice(data);
+        if self.buf.len() >= CHUNK_SIZE {
+            self.flush()?;
+        }
+        Ok(data.len())
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        if self.buf.is_empty() {
+            return Ok(());
+        }
+        let chunk = std::mem::replace(&mut self.buf, Vec::with_capacity(CHUNK_SIZE));
+        self.tx
+            .blocking_send(Ok(chunk.into()))
+            .map_err(|_| io::Error::new(io::ErrorKind::BrokenPipe, "client disconnected"))
+    }
+}
+
+/// Write results as CSV. With `tagged` the query name is the first column.
+fn write_csv(
+    mut wtr: ChunkWriter,
+    results: &[QueryMatches],
+    tagged: bool,
+    accessions: &AccessionTable,
+) -> Result<(), BoxError> {
+    if tagged {
+        writeln!(wtr, "query_name,SRA accession,containment")?;
+    } else {
+        writeln!(wtr, "SRA accession,containment")?;
+    }
+    for result in results {
+        let matches = &result.matches;
+        // query names are quoted, they can contain commas
+        let name = format!("\"{}\"", result.name.replace('"', "\"\""));
+        for (dataset_id, size) in &matches.matches {
+            let containment = *size as f64 / matches.query_size;
+            if tagged {
+                write!(wtr, "{name},")?;
+            }
+            writeln!(wtr, "{},{}", accessions.get(*dataset_id), containment)?;
+        }
+    }
+    wtr.flush()?;
+    Ok(())
+}
+
+/// Write results as an Arrow IPC stream. With `tagged` the query name is the first column.
+fn write_arrow(
+    wtr: ChunkWriter,
+    results: &[QueryMatches],
+    tagged: bool,
+    accessions: &AccessionTable,
+) -> Result<(), BoxError> {
+    let mut fields = vec![
+        Field::new("SRA_accession", DataType::Utf8, false),
+        Field::new("containment", DataType::Float64, false),
+    ];
+    if tagged {
+        fields.insert(0, Field::new("query_name", DataType::Utf8, false));
+    }
+    let schema = Arc::new(Schema::new(fields));
+
+    let mut writer = StreamWriter::try_new(wtr, &schema)?;
+    for result in results {
+        let matches = &result.matches;
+        for batch in matches.matches.chunks(ARROW_BATCH_ROWS) {
+            let accs =
+                StringArray::from_iter_values(batch.iter().map(|(idx, _)| accessions.get(*idx)));
+            let containment = Float64Array::from_iter_values(
+                batch
+                    .iter()
+                    .map(|(_, size)| *size as f64 / matches.query_size),
+            );
+
+            let mut columns = vec![
+                Arc::new(accs) as ArrayRef,
+                Arc::new(containment) as ArrayRef,
+            ];
+            if tagged {
+                let names = StringArray::from_iter_values(batch.iter().map(|_| &result.name));
+                columns.insert(0, Arc::new(names) as ArrayRef);
+            }
+
+            let batch = RecordBatch::try_new(schema.clone(), columns)?;
+            writer.write(&batch)?;
+        }
+    }
+    writer.finish()?;
+    writer.into_inner()?.flush()?;
+    Ok(())
+}
+
+/// Stream matches as a response body in `format`.
+///
+/// Rows are written on a blocking thread into a bounded channel, so only a
+/// few chunks of the response are held in memory at any time.
+pub fn matches_body(
+    matches: Arc<Matches>,
+    accessions: Arc<AccessionTable>,
+    format: Format,
+) -> Body {
+    let results = vec![QueryMatches {
+        name: String::new(),
+        matches,
+    }];
+    results_body(results, false, accessions, format)
+}
+
+/// Stream matches for a batch of queries, tagged by query name
+pub fn batch_body(
+    results: Vec<QueryMatches>,
+    accessions: Arc<AccessionTable>,
+    format: Format,
+) -> Body {
+    results_body(results, true, accessions, format)
+}
+
+fn results_body(
+    results: Vec<QueryMatches>,
+    tagged: bool,
+    accessions: Arc<AccessionTable>,
+    format: Format,
+) -> Body {
+    let (tx, rx) = mpsc::channel(CHANNEL_CAPACITY);
+
+    tokio::task::spawn_blocking(move || {
+        let wtr = ChunkWriter::new(tx.clone());
+        let res = match format {
+            Format::Csv => write_csv(wtr, &results, tagged, &accessions),
+            Format::Arrow => write_arrow(wtr, &results, tagged, &accessions),
+        };
+        if let Err(e) = res {
+            tracing::warn!("error streaming matches: {e}");
+            // abort the response, if the client is still listening
+            let _ = tx.blocking_send(Err(e));
+        }
+    });
+
+    Body::from_stream(ReceiverStream::new(rx))
+}
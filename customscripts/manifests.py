@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Columnar toolkit for sourmash manifests.
+
+Manifests are read lazily with Polars (several files are scanned in parallel),
+and results are streamed to disk, so it works on manifests with millions of
+records without loading them row by row.
+
+Subcommands:
+  diff     records in the input manifests that are NOT in the --against manifests
+  merge    concatenate manifests, dropping records with repeated md5
+  dedupe   drop records with repeated md5
+  filter   keep records for a ksize (and/or moltype)
+  sraids   unique dataset names (SRA accessions), one per line
+
+Every subcommand accepts -k/--ksize to restrict records to a single ksize.
+
+Examples:
+  python customscripts/manifests.py diff new.csv --against indexed.csv -o missing.csv
+  python customscripts/manifests.py merge part_*.csv -o manifest.csv
+  python customscripts/manifests.py sraids manifest.csv -k 21 -o bw_db/sraids
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import polars as pl
+
+# the manifest schema is shared with the catalog in metadata/
+sys.path.append(str(Path(__file__).resolve().parent.parent / "metadata"))
+from manifest_schema import MANIFEST_HEADER, MANIFEST_SCHEMA  # noqa: E402
+
+
+def scan_manifest(paths, *, schema=MANIFEST_SCHEMA):
+    """Lazily scan one or more manifest CSVs.
+
+    The '# SOURMASH-MANIFEST-VERSION' line is skipped if present,
+    and unknown columns (e.g. sha256) are read as strings.
+    """
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+
+    frames = [
+        pl.scan_csv(
+            path,
+            comment_prefix="#",
+            infer_schema_length=0,
+            schema_overrides=schema,
+        )
+        for path in paths
+    ]
+    return pl.concat(frames, how="diagonal_relaxed")
+
+
+def basename_expr(col="internal_location"):
+    """basename of a path column (e.g. 'sigs/xxxxx.sig' -> 'xxxxx.sig')"""
+    return pl.col(col).str.split("/").list.last()
+
+
+def select_records(lf, *, ksize=None, moltype=None):
+    if ksize is not None:
+        lf = lf.filter(pl.col("ksize") == ksize)
+    if moltype is not None:
+        lf = lf.filter(pl.col("moltype") == moltype)
+    return lf
+
+
+def diff(lf, against, *, key="name", basename=False):
+    """records in `lf` whose `key` is not present in `against`"""
+    key_expr = basename_expr(key) if basename else pl.col(key)
+
+    seen = against.select(key_expr.alias("_key")).unique()
+    return (lf
+        .with_columns(key_expr.alias("_key"))
+        .join(seen, on="_key", how="anti")
+        .drop("_key"))
+
+
+def dedupe(lf, *, key="md5"):
+    """keep the first record for each `key`"""
+    return lf.unique(subset=[key], keep="first", maintain_order=True)
+
+
+def sraids(lf):
+    """unique dataset names, in manifest order"""
+    return lf.select(pl.col("name")).unique(maintain_order=True)
+
+
+def sink(lf, output, *, header=True, include_header=True, line_terminator="\n"):
+    """stream a LazyFrame to `output` as CSV ('-' for stdout)
+
+    With `header` the sourmash manifest version line is written first.
+    """
+    if output in (None, "-"):
+        df = lf.collect()
+        if header:
+            sys.stdout.write(MANIFEST_HEADER.replace("\n", line_terminator))
+        df.write_csv(sys.stdout, include_header=include_header, line_terminator=line_terminator)
+        return
+
+    output = Path(output)
+    with tempfile.NamedTemporaryFile(dir=output.parent, suffix=".csv", delete=False) as tmp:
+        tmp_path = Path(tmp.name)
+
+    try:
+        lf.sink_csv(tmp_path, include_header=include_header, line_terminator=line_terminator)
+        with (output.open("w", encoding="utf-8", newline="") as out,
+              tmp_path.open("r", encoding="utf-8", newline="") as data):
+            if header:
+                out.write(MANIFEST_HEADER.replace("\n", line_terminator))
+            shutil.copyfileobj(data, out)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def cmd_diff(args):
+    lf = select_records(scan_manifest(args.manifests), ksize=args.ksize)
+    against = scan_manifest(args.against)
+    result = diff(lf, against, key=args.key, basename=args.basename)
+    if args.drop:
+        result = result.drop(args.drop, strict=False)
+    sink(result, args.output)
+
+
+def cmd_merge(args):
+    lf = select_records(scan_manifest(args.manifests), ksize=args.ksize)
+    if not args.keep_duplicates:
+        lf = dedupe(lf)
+    sink(lf, args.output)
+
+
+def cmd_dedupe(args):
+    lf = select_records(scan_manifest(args.manifests), ksize=args.ksize)
+    sink(dedupe(lf, key=args.key), args.output)
+
+
+def cmd_filter(args):
+    lf = select_records(scan_manifest(args.manifests), ksize=args.ksize, moltype=args.moltype)
+    sink(lf, args.output)
+
+
+def cmd_sraids(args):
+    lf = select_records(scan_manifest(args.manifests), ksize=args.ksize)
+    sink(sraids(lf), args.output, header=False, include_header=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar toolkit for sourmash manifests.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    def add_common(p):
+        p.add_argument("manifests", nargs="+", help="input manifest CSV(s)")
+        p.add_argument("-o", "--output", default="-", help="output path (default: stdout)")
+        p.add_argument("-k", "--ksize", type=int, default=None, help="only keep records with this ksize")
+
+    p_diff = sub.add_parser("diff", help="records NOT present in the --against manifests")
+    add_common(p_diff)
+    p_diff.add_argument("--against", nargs="+", required=True, help="manifest CSV(s) to compare against")
+    p_diff.add_argument("--key", default="name", help="column used to match records (default: name)")
+    p_diff.add_argument("--basename", action="store_true", help="match on the basename of the key column")
+    p_diff.add_argument("--drop", nargs="*", default=[], help="columns to drop from the output (e.g. sha256)")
+    p_diff.set_defaults(func=cmd_diff)
+
+    p_merge = sub.add_parser("merge", help="concatenate manifests, dropping repeated md5s")
+    add_common(p_merge)
+    p_merge.add_argument("--keep-duplicates", action="store_true", help="don't drop records with repeated md5")
+    p_merge.set_defaults(func=cmd_merge)
+
+    p_dedupe = sub.add_parser("dedupe", help="drop records with repeated md5")
+    add_common(p_dedupe)
+    p_dedupe.add_argument("--key", default="md5", help="column identifying duplicates (default: md5)")
+    p_dedupe.set_defaults(func=cmd_dedupe)
+
+    p_filter = sub.add_parser("filter", help="keep records for a ksize/moltype")
+    add_common(p_filter)
+    p_filter.add_argument("--moltype", default=None, help="only keep records with this moltype (e.g. DNA)")
+    p_filter.set_defaults(func=cmd_filter)
+
+    p_sraids = sub.add_parser("sraids", help="unique dataset names, one per line")
+    add_common(p_sraids)
+    p_sraids.set_defaults(func=cmd_sraids)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    main()
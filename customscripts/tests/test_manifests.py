@@ -0,0 +1,81 @@
+import polars as pl
+
+import find_missing_sraids
+import manifests
+
+HEADER = "internal_location,md5,md5short,ksize,moltype,num,scaled,n_hashes,with_abundance,name,filename\n"
+
+
+def write_manifest(path, records):
+    '''records as (md5, ksize, name)'''
+    lines = [
+        f"signatures/{md5}.sig.gz,{md5},{md5[:8]},{ksize},DNA,0,1000,10,TRUE,{name},-\n"
+        for md5, ksize, name in records
+    ]
+    path.write_text(manifests.MANIFEST_HEADER + HEADER + "".join(lines))
+    return path
+
+
+def test_sraids(tmp_path):
+    path = write_manifest(tmp_path / "manifest.csv", [
+        ("aaaa0001", 21, "SRR000002"),
+        ("aaaa0002", 31, "SRR000002"),
+        ("aaaa0003", 21, "SRR000001"),
+        ("aaaa0004", 21, "SRR000002"),
+    ])
+    out = tmp_path / "sraids"
+    manifests.main(["sraids", str(path), "-k", "21", "-o", str(out)])
+    assert out.read_text().splitlines() == ["SRR000002", "SRR000001"]
+
+
+
+def test_dedupe(tmp_path):
+    first = write_manifest(tmp_path / "first.csv", [("aaaa0001", 21, "SRR000001"), ("aaaa0002", 21, "SRR000002")])
+    second = write_manifest(tmp_path / "second.csv", [("aaaa0002", 21, "SRR000002"), ("aaaa0003", 21, "SRR000003")])
+    out = tmp_path / "merged.csv"
+    manifests.main(["merge", str(first), str(second), "-o", str(out)])
+
+    assert out.read_text().startswith(manifests.MANIFEST_HEADER)
+    merged = manifests.scan_manifest(out).collect()
+    assert merged["md5"].to_list() == ["aaaa0001", "aaaa0002", "aaaa0003"]
+    assert merged.schema["ksize"] == pl.Int64
+
+
+
+def test_diff(tmp_path):
+    new = write_manifest(tmp_path / "new.csv", [
+        ("aaaa0001", 21, "SRR000001"),
+        ("aaaa0002", 21, "SRR000002"),
+        ("aaaa0003", 31, "SRR000003"),
+    ])
+    indexed = write_manifest(tmp_path / "indexed.csv", [("bbbb0001", 21, "SRR000001")])
+
+    missing = manifests.diff(manifests.scan_manifest(new), manifests.scan_manifest(indexed)).collect()
+    assert missing["name"].to_list() == ["SRR000002", "SRR000003"]
+
+    by_location = manifests.diff(
+        manifests.select_records(manifests.scan_manifest(new), ksize=21),
+        manifests.scan_manifest(indexed),
+        key="internal_location",
+        basename=True,
+    ).collect()
+    assert by_location["md5"].to_list() == ["aaaa0001", "aaaa0002"]
+
+
+def test_find_missing_sraids(tmp_path):
+    file1 = tmp_path / "file1.csv"
+    file1.write_text(manifests.MANIFEST_HEADER + HEADER.rstrip("\n") + ",sha256\n"
+                     "sigs/a.sig,aaaa0001,aaaa,21,DNA,0,1000,10,TRUE,SRR000001,-,f00\n"
+                     "sigs/b.sig,aaaa0002,aaaa,not-a-ksize,DNA,0,1000,10,TRUE,SRR000002,-,f00\n"
+                     "sigs/c.sig,aaaa0003,aaaa,21,DNA,0,1000,10,TRUE,SRR000003,-,f00\n"
+                     "sigs/d.sig,aaaa0004,aaaa,31,DNA,0,1000,10,TRUE,SRR000004,-,f00\n")
+    file2 = tmp_path / "file2.csv"
+    file2.write_text("internal_location,md5\nc.sig,bbbb0003\n")
+    out = tmp_path / "missing.csv"
+    find_missing_sraids.main(["--file1", str(file1), "--file2", str(file2), "--out", str(out)])
+
+    # rows with a malformed ksize are skipped, and lines end with CRLF like csv.writer's
+    assert out.read_bytes() == (
+        HEADER.rstrip("\n").encode() + b"\r\n"
+        b"a.sig,aaaa0001,aaaa,21,DNA,0,1000,10,TRUE,SRR000001,-\r\n"
+    )
@@ -0,0 +1,112 @@
+"""Integer keys for SRA accessions.
+
+Run accessions are a three letter prefix (SRR, ERR, DRR, ...) followed by
+a zero-padded number, so they can be packed into a 64-bit integer:
+
+    bits 44-46: number of digits - 6
+    bits 47-61: prefix letters, base 26
+    bits  0-43: the number
+
+Keys for conforming accessions are always positive. Anything else gets a
+negative key assigned by `fallback_keys`, and is stored in the `acc_fallback`
+table of the metadata database.
+
+This module is shared by the metadata loader and the web app.
+"""
+
+import polars as pl
+
+PATTERN = r"^([A-Z]{3})([0-9]{6,13})$"
+
+MIN_DIGITS = 6
+NUMBER_BITS = 44
+DIGITS_BITS = 3
+PREFIX_SHIFT = NUMBER_BITS + DIGITS_BITS
+
+
+def encode(acc):
+    '''pack an accession into an integer key, or None if it doesn't conform'''
+    if (len(acc) < 3 + MIN_DIGITS or len(acc) > 3 + MIN_DIGITS + 2 ** DIGITS_BITS - 1
+            or not acc[:3].isascii() or not acc[:3].isupper() or not acc[:3].isalpha()
+            or not acc[3:].isascii() or not acc[3:].isdigit()):
+        return None
+
+    prefix = 0
+    for c in acc[:3]:
+        prefix = prefix * 26 + (ord(c) - ord("A"))
+    n_digits = len(acc) - 3
+
+    return (prefix << PREFIX_SHIFT) | ((n_digits - MIN_DIGITS) << NUMBER_BITS) | int(acc[3:])
+
+
+def decode(key):
+    '''recover the accession from an integer key (None for fallback keys)'''
+    if key is None or key < 0:
+        return None
+
+    number = key & ((1 << NUMBER_BITS) - 1)
+    n_digits = ((key >> NUMBER_BITS) & ((1 << DIGITS_BITS) - 1)) + MIN_DIGITS
+    prefix = key >> PREFIX_SHIFT
+
+    letters = ""
+    for _ in range(3):
+        prefix, c = divmod(prefix, 26)
+        letters = chr(ord("A") + c) + letters
+
+    return f"{letters}{number:0{n_digits}d}"
+
+
+def encode_expr(expr):
+    '''polars version of `encode`, null for non-conforming accessions'''
+    if isinstance(expr, str):
+        expr = pl.col(expr)
+
+    parts = expr.str.extract_groups(PATTERN)
+    prefix = parts.struct.field("1")
+    digits = parts.struct.field("2")
+
+    prefix_code = pl.lit(0, dtype=pl.Int64)
+    for i in range(3):
+        letter = prefix.str.slice(i, 1).str.encode("hex").str.to_integer(base=16).cast(pl.Int64)
+        prefix_code = prefix_code * 26 + (letter - ord("A"))
+
+    n_digits = digits.str.len_chars().cast(pl.Int64)
+
+    return (prefix_code * 2 ** PREFIX_SHIFT
+            + (n_digits - MIN_DIGITS) * 2 ** NUMBER_BITS
+            + digits.cast(pl.Int64))
+
+
+def fallback_keys(accs):
+    '''assign negative keys to non-conforming accessions
+
+    Returns a DataFrame with `acc` and `acc_key` columns.
+    '''
+    others = (pl.DataFrame({"acc": accs}, schema={"acc": pl.String})
+        .filter(encode_expr("acc").is_null() & pl.col("acc").is_not_null())
+        .unique(maintain_order=True))
+
+    return others.with_columns(
+        acc_key=-(pl.int_range(1, others.height + 1, dtype=pl.Int64)))
+
+
+class AccessionSet:
+    '''a set of accessions for fast membership tests on integer keys'''
+
+    def __init__(self, accs):
+        accs = pl.Series("acc", accs, dtype=pl.String)
+        keys = pl.select(encode_expr(pl.lit(accs))).to_series()
+
+        self.keys = keys.filter(keys.is_not_null()).unique().sort()
+        self.others = accs.filter(keys.is_null()).unique()
+
+    def __len__(self):
+        return len(self.keys) + len(self.others)
+
+    def contains(self, expr):
+        '''polars expression testing accessions in `expr` for membership'''
+        if isinstance(expr, str):
+            expr = pl.col(expr)
+
+        return (encode_expr(expr).is_in(self.keys.implode()).fill_null(False)
+                | expr.is_in(self.others.implode()).fill_null(False))
@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+
+import os
+from pathlib import Path
+
+import duckdb
+
+# columns that are never re-typed (join keys and similar)
+KEEP_COLUMNS = ("acc",)
+
+# a VARCHAR column becomes an ENUM if it has at most this many distinct values...
+ENUM_MAX_CARDINALITY = 65_535
+# ...and if each distinct value is repeated, on average, at least this many times
+ENUM_MIN_REPEATS = 2
+
+
+def quote(name):
+    '''quote an identifier for use in duckdb SQL'''
+    return '"' + name.replace('"', '""') + '"'
+
+
+def enum_type_name(column):
+    return quote(f"{column}_enum")
+
+
+def profile_columns(conn, table="src.metadata"):
+    '''collect non-null, distinct and date-parseable counts for every VARCHAR column
+
+    All columns are profiled in a single scan over the table.
+    '''
+    columns = conn.sql(f"DESCRIBE SELECT * FROM {table}").fetchall()
+    varchars = [name for (name, dtype, *_) in columns if dtype == "VARCHAR"]
+
+    if not varchars:
+        return {}
+
+    aggregates = []
+    for name in varchars:
+        col = quote(name)
+        aggregates += [
+            f"count({col})",
+            f"approx_count_distinct({col})",
+            f"count(TRY_CAST({col} AS DATE))",
+        ]
+
+    row = conn.sql(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone()
+
+    profile = {}
+    for i, name in enumerate(varchars):
+        non_null, n_distinct, n_dates = row[3 * i:3 * i + 3]
+        profile[name] = {
+            "non_null": non_null,
+            "n_distinct": n_distinct,
+            "n_dates": n_dates,
+        }
+
+    return profile
+
+
+def plan_types(profile, *, enum_max_cardinality=ENUM_MAX_CARDINALITY, enum_min_repeats=ENUM_MIN_REPEATS):
+    '''decide on a target type for each profiled column
+
+    Only lossless conversions are planned: a column becomes a DATE if every
+    non-null value parses as a date, and an ENUM if it has few distinct values.
+    Everything else stays as VARCHAR.
+    '''
+    plan = {}
+    for name, stats in profile.items():
+        if name in KEEP_COLUMNS or stats["non_null"] == 0:
+            continue
+
+        if stats["n_dates"] == stats["non_null"]:
+            plan[name] = "DATE"
+        elif (stats["n_distinct"] <= enum_max_cardinality
+              and stats["n_distinct"] * enum_min_repeats <= stats["non_null"]):
+            plan[name] = "ENUM"
+
+    return plan
+
+
+def typed_columns(conn, plan, table="src.metadata"):
+    '''build the SELECT list for the typed table, creating ENUM types as needed'''
+    columns = conn.sql(f"DESCRIBE SELECT * FROM {table}").fetchall()
+
+    select = []
+    for (name, dtype, *_) in columns:
+        col = quote(name)
+        target = plan.get(name)
+
+        if target == "ENUM":
+            conn.sql(f"""
+                CREATE TYPE {enum_type_name(name)} AS ENUM (
+                    SELECT DISTINCT {col} FROM {table} WHERE {col} IS NOT NULL ORDER BY {col}
+                )""")
+            select.append(f"CAST({col} AS {enum_type_name(name)}) AS {col}")
+        elif target == "DATE":
+            select.append(f"CAST({col} AS DATE) AS {col}")
+        elif name == "lat_lon_dd" and dtype.endswith("[]"):
+            # decimal degrees as two plain DOUBLE columns instead of a list
+            select.append(f"CAST({col}[1] AS DOUBLE) AS lat")
+            select.append(f"CAST({col}[2] AS DOUBLE) AS lon")
+        else:
+            select.append(col)
+
+    return select
+
+
+def main(
+    *,
+    database="/data/bw_db/metadata.duckdb",
+    output=None,
+    enum_max_cardinality=ENUM_MAX_CARDINALITY,
+    enum_min_repeats=ENUM_MIN_REPEATS,
+):
+    '''rewrite the metadata table in `database` with compact column types
+
+    If `output` is not given the typed database replaces `database`.
+    '''
+    database = Path(database)
+    target = Path(output) if output else database.with_suffix(".typed.duckdb")
+    target.unlink(missing_ok=True)
+
+    conn = duckdb.connect(database=str(target), read_only=False)
+    conn.sql(f"ATTACH '{database}' AS src (READ_ONLY)")
+
+    profile = profile_columns(conn)
+    plan = plan_types(profile,
+                      enum_max_cardinality=enum_max_cardinality,
+                      enum_min_repeats=enum_min_repeats)
+    select = typed_columns(conn, plan)
+
+    conn.sql(f"""
+        CREATE TABLE metadata AS
+            SELECT {', '.join(select)} FROM src.metadata;
+
+        CREATE UNIQUE INDEX acc_idx ON metadata (acc);
+    """)
+    if "acc_key" in conn.sql("SELECT * FROM metadata LIMIT 0").columns:
+        conn.sql("CREATE UNIQUE INDEX acc_key_idx ON metadata (acc_key)")
+
+    # other tables (e.g. acc_fallback) are copied as they are
+    tables = conn.sql("""
+        SELECT table_name FROM duckdb_tables()
+        WHERE database_name = 'src' AND table_name != 'metadata'
+    """).fetchall()
+    for (table,) in tables:
+        conn.sql(f"CREATE TABLE {quote(table)} AS SELECT * FROM src.{quote(table)}")
+    conn.sql("DETACH src")
+    conn.close()
+
+    for name, dtype in sorted(plan.items()):
+        print(f"{name}: VARCHAR -> {dtype} "
+              f"({profile[name]['n_distinct']:,} distinct / {profile[name]['non_null']:,} values)")
+
+    size_before = os.path.getsize(database)
+    size_after = os.path.getsize(target)
+    print(f"Typed {len(plan)} of {len(profile)} VARCHAR columns\n"
+          f"duckdb size before: {size_before / 1024 ** 2:.1f} MiB, "
+          f"after: {size_after / 1024 ** 2:.1f} MiB "
+          f"({100 * (1 - size_after / size_before):.1f}% smaller)")
+
+    if not output:
+        target.replace(database)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert metadata columns to compact types (ENUM, DATE, DOUBLE lat/lon)")
+    parser.add_argument("database", nargs="?", default="/data/bw_db/metadata.duckdb")
+    parser.add_argument("-o", "--output", default=None,
+                        help="write the typed database here instead of replacing the input")
+    parser.add_argument("--enum-max-cardinality", type=int, default=ENUM_MAX_CARDINALITY)
+    parser.add_argument("--enum-min-repeats", type=int, default=ENUM_MIN_REPEATS)
+
+    args = parser.parse_args()
+    main(database=args.database,
+         output=args.output,
+         enum_max_cardinality=args.enum_max_cardinality,
+         enum_min_repeats=args.enum_min_repeats)
@@ -6,6 +6,9 @@ from pathlib import Path
 import duckdb
 import polars as pl
 
+import accessions
+import column_types
+
 
 def harmonize_lat_lon(series):
     '''replace lat-lon with decimal degrees'''
@@ -41,6 +44,7 @@ def main(
     parquet_metadata="/data/bw_db/metadata.parquet",
     output="/data/bw_db/metadata.duckdb",
     force=False,
+    typed=False,
 ):
     orig_metadata = pl.scan_parquet(parquet_metadata)
     orig_metadata = orig_metadata.with_columns(
@@ -53,8 +57,19 @@ def main(
 
 
     df = orig_metadata.collect()
+
+    # integer accession keys, with negative keys for non-conforming accessions
+    fallback = accessions.fallback_keys(df.get_column("acc"))
+    df = (df
+        .join(fallback.rename({"acc_key": "fallback_key"}), on="acc", how="left")
+        .with_columns(
+            acc_key=pl.coalesce(accessions.encode_expr("acc"), pl.col("fallback_key"))
+        )
+        .drop("fallback_key"))
+
     conn = duckdb.connect(database=output, read_only=False)
     conn.register("orig_metadata", df)
+    conn.register("orig_fallback", fallback)
 
     # conn = duckdb.connect(database=output, read_only=False)
 
@@ -63,6 +78,10 @@ def main(
             SELECT * FROM orig_metadata;
 
         CREATE UNIQUE INDEX acc_idx ON metadata (acc);
+        CREATE UNIQUE INDEX acc_key_idx ON metadata (acc_key);
+
+        CREATE TABLE acc_fallback AS
+            SELECT * FROM orig_fallback;
     """)
 
     n_datasets = conn.sql("SELECT count(acc) FROM metadata").fetchall()[0][0];
@@ -72,6 +91,10 @@ def main(
           f"Full duckdb size is {n_mbytes} MiB, "
           f"average document size is {int((n_mbytes * 1024 ** 2) / n_datasets)} bytes")
 
+    if typed:
+        conn.close()
+        column_types.main(database=output)
+
 
 if __name__ == "__main__":
     import argparse
@@ -80,6 +103,8 @@ if __name__ == "__main__":
     parser.add_argument("parquet_metadata")
     parser.add_argument("-o", "--output", default="/data/bw_db/metadata.duckdb")
     parser.add_argument("--force", action="store_true", help="force reload duckdb")
+    parser.add_argument("--typed", action="store_true",
+                        help="convert columns to compact types (ENUM, DATE, DOUBLE lat/lon) after loading")
 
     args = parser.parse_args()
-    main(parquet_metadata=args.parquet_metadata, output=args.output, force=args.force)
+    main(parquet_metadata=args.parquet_metadata, output=args.output, force=args.force, typed=args.typed)
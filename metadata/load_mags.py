@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+
+"""MGnify MAG catalogue linkage, stored in the metadata DuckDB database.
+
+Loads the MGnify genome catalogues and the mapping of SRA runs to the MAGs
+built from them into indexed tables, so the web app can look up the MAGs
+linked to a run (and annotate search results) with index probes:
+
+- `mag_catalogues`: one row per catalogue, unique on `catalogue_id`
+- `run_mags`: one row per (run, MAG), indexed by `acc_key` and
+  `genome_accession`, sorted by `acc_key`
+- `run_mag_summary`: number of MAGs and catalogues per run, unique on
+  `acc_key`, joined with search results
+
+Run it after `load_duckdb.py`: runs are keyed like the metadata table,
+including the `acc_fallback` keys for non-conforming accessions.
+"""
+
+from pathlib import Path
+
+import duckdb
+import polars as pl
+
+import accessions
+
+CATALOGUE_COLUMNS = ("catalogue_id",)
+RUN_MAG_COLUMNS = ("run_accession", "catalogue_id", "genome_accession")
+
+
+def read_table(path, required):
+    '''CSV, TSV or parquet file, with (at least) the `required` columns'''
+    path = Path(path)
+    if path.suffix == ".parquet":
+        df = pl.read_parquet(path)
+    else:
+        separator = "\t" if path.suffix in (".tsv", ".txt") else ","
+        df = pl.read_csv(path, separator=separator, infer_schema_length=10000)
+
+    missing = [c for c in required if c not in df.columns]
+    if missing:
+        raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+    return df
+
+
+def main(*, catalogues, run_mags, database="/data/bw_db/metadata.duckdb"):
+    catalogue_df = read_table(catalogues, CATALOGUE_COLUMNS).unique("catalogue_id", keep="first")
+    run_mag_df = (read_table(run_mags, RUN_MAG_COLUMNS)
+        .rename({"run_accession": "acc"})
+        .unique(["acc", "catalogue_id", "genome_accession"], keep="first")
+        .with_columns(acc_key=accessions.encode_expr("acc")))
+
+    unknown = set(run_mag_df.get_column("catalogue_id").unique()) - set(catalogue_df.get_column("catalogue_id"))
+    if unknown:
+        print(f"WARNING: {len(unknown)} catalogues in {run_mags} are not in {catalogues}")
+
+    conn = duckdb.connect(database=database, read_only=False)
+    conn.register("orig_catalogues", catalogue_df)
+    conn.register("orig_run_mags", run_mag_df)
+
+    has_fallback = conn.sql(
+        "SELECT count(*) FROM information_schema.tables WHERE table_name = 'acc_fallback'"
+    ).fetchall()[0][0]
+    fallback_join = ("LEFT JOIN acc_fallback fb ON m.acc_key IS NULL AND m.acc = fb.acc"
+                     if has_fallback else "")
+    fallback_key = "coalesce(m.acc_key, fb.acc_key)" if has_fallback else "m.acc_key"
+
+    conn.sql(f"""
+        DROP TABLE IF EXISTS run_mag_summary;
+        DROP TABLE IF EXISTS run_mags;
+        DROP TABLE IF EXISTS mag_catalogues;
+
+        CREATE TABLE mag_catalogues AS
+            SELECT * FROM orig_catalogues ORDER BY catalogue_id;
+        CREATE UNIQUE INDEX mag_catalogues_idx ON mag_catalogues (catalogue_id);
+
+        CREATE TABLE run_mags AS
+            SELECT {fallback_key} AS acc_key, m.* EXCLUDE (acc_key)
+            FROM orig_run_mags m
+            {fallback_join}
+            ORDER BY 1, catalogue_id, genome_accession;
+        CREATE INDEX run_mags_acc_key_idx ON run_mags (acc_key);
+        CREATE INDEX run_mags_genome_idx ON run_mags (genome_accession);
+
+        CREATE TABLE run_mag_summary AS
+            SELECT
+                acc_key,
+                count(*) AS n_mags,
+                string_agg(DISTINCT catalogue_id, ',' ORDER BY catalogue_id) AS mag_catalogues
+            FROM run_mags
+            WHERE acc_key IS NOT NULL
+            GROUP BY acc_key;
+        CREATE UNIQUE INDEX run_mag_summary_idx ON run_mag_summary (acc_key);
+    """)
+
+    n_catalogues, = conn.sql("SELECT count(*) FROM mag_catalogues").fetchone()
+    n_links, n_runs = conn.sql("SELECT count(*), count(DISTINCT acc) FROM run_mags").fetchone()
+    print(f"{n_catalogues:,} catalogues, {n_links:,} MAGs linked to {n_runs:,} runs loaded into {database}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--catalogues", required=True,
+                        help="catalogues (CSV/TSV/parquet) with a catalogue_id column")
+    parser.add_argument("-r", "--run-mags", required=True,
+                        help="run to MAG mapping (CSV/TSV/parquet) with run_accession, "
+                             "catalogue_id and genome_accession columns")
+    parser.add_argument("-d", "--database", default="/data/bw_db/metadata.duckdb",
+                        help="metadata DuckDB database to add the tables to")
+
+    args = parser.parse_args()
+    main(catalogues=args.catalogues, run_mags=args.run_mags, database=args.database)
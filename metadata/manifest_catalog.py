@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+
+"""Catalog of indexed signatures, stored in DuckDB.
+
+Manifests (from `branchwater-index metadata` or the index server
+`/metadata/manifest` endpoint) are loaded into a `manifest` table keyed by
+accession and md5, so questions about the indexed collection don't need to
+re-read the CSVs. Appends are incremental: records already in the catalog
+are skipped.
+"""
+
+import sys
+from pathlib import Path
+
+import duckdb
+import polars as pl
+
+import accessions
+from manifest_schema import MANIFEST_SCHEMA
+
+CATALOG_TABLE = """
+    CREATE TABLE IF NOT EXISTS manifest (
+        acc VARCHAR,
+        acc_key BIGINT,
+        md5 VARCHAR,
+        ksize INTEGER,
+        moltype VARCHAR,
+        scaled INTEGER,
+        n_hashes BIGINT,
+        internal_location VARCHAR,
+        source VARCHAR,
+        added_at TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS manifest_acc_key_idx ON manifest (acc_key);
+    CREATE INDEX IF NOT EXISTS manifest_md5_idx ON manifest (md5);
+"""
+
+
+def read_manifest(path):
+    '''read a manifest CSV (with or without the version line) into the catalog schema'''
+    df = pl.read_csv(
+        path,
+        comment_prefix="#",
+        infer_schema_length=0,
+        schema_overrides=MANIFEST_SCHEMA,
+    )
+
+    return df.select(
+        acc=pl.col("name"),
+        acc_key=accessions.encode_expr("name"),
+        md5=pl.col("md5"),
+        ksize=pl.col("ksize").cast(pl.Int32),
+        moltype=pl.col("moltype"),
+        scaled=pl.col("scaled").cast(pl.Int32),
+        n_hashes=pl.col("n_hashes"),
+        internal_location=pl.col("internal_location"),
+        source=pl.lit(str(path)),
+    )
+
+
+def connect(catalog, *, metadata=None, read_only=False):
+    conn = duckdb.connect(database=str(catalog), read_only=read_only)
+    if not read_only:
+        conn.sql(CATALOG_TABLE)
+    if metadata:
+        conn.sql(f"ATTACH '{metadata}' AS meta (READ_ONLY)")
+    return conn
+
+
+def add(conn, paths):
+    '''append manifests to the catalog, skipping records already present'''
+    for path in paths:
+        records = read_manifest(path)
+        conn.register("new_records", records)
+
+        before = conn.sql("SELECT count(*) FROM manifest").fetchone()[0]
+        conn.sql("""
+            INSERT INTO manifest
+            SELECT new.*, now() AS added_at
+            FROM (SELECT DISTINCT * FROM new_records) new
+            ANTI JOIN manifest old
+            ON new.md5 = old.md5 AND new.internal_location = old.internal_location
+        """)
+        after = conn.sql("SELECT count(*) FROM manifest").fetchone()[0]
+        conn.unregister("new_records")
+
+        print(f"{path}: {after - before:,} new records ({len(records) - (after - before):,} already in catalog)",
+              file=sys.stderr)
+
+
+# accessions that don't fit the integer encoding have no acc_key in the
+# catalog; the metadata keys them through its acc_fallback table
+FALLBACK_JOIN = """
+        LEFT JOIN meta.acc_fallback fb
+        ON manifest.acc_key IS NULL AND manifest.acc = fb.acc"""
+
+# named queries for the CLI
+QUERIES = {
+    "stats": """
+        SELECT ksize, moltype, scaled,
+               count(*) AS n_records,
+               count(DISTINCT acc) AS n_accessions,
+               sum(n_hashes) AS total_hashes
+        FROM manifest
+        GROUP BY ALL
+        ORDER BY ALL
+    """,
+    "accessions": """
+        SELECT DISTINCT acc FROM manifest ORDER BY acc
+    """,
+    "duplicates": """
+        SELECT md5, count(*) AS n_records, string_agg(DISTINCT acc, ';') AS accessions
+        FROM manifest
+        GROUP BY md5
+        HAVING count(*) > 1
+        ORDER BY n_records DESC
+    """,
+    "bioprojects": f"""
+        SELECT meta.metadata.bioproject,
+               count(DISTINCT manifest.acc) AS n_accessions,
+               sum(manifest.n_hashes) AS total_hashes
+        FROM manifest
+        {FALLBACK_JOIN}
+        JOIN meta.metadata ON coalesce(manifest.acc_key, fb.acc_key) = meta.metadata.acc_key
+        GROUP BY ALL
+        ORDER BY total_hashes DESC
+    """,
+    "unmatched": f"""
+        SELECT DISTINCT manifest.acc
+        FROM manifest
+        {FALLBACK_JOIN}
+        ANTI JOIN meta.metadata ON coalesce(manifest.acc_key, fb.acc_key) = meta.metadata.acc_key
+        ORDER BY manifest.acc
+    """,
+}
+
+
+def check(conn, accs_file):
+    '''accessions from `accs_file` (one per line) that are not in the catalog yet'''
+    accs = pl.DataFrame({"acc": Path(accs_file).read_text().split()})
+    conn.register("candidates", accs.with_columns(acc_key=accessions.encode_expr("acc")))
+
+    # integer keys for regular accessions, plain strings for everything else
+    return conn.sql("""
+        SELECT c.acc FROM candidates c
+        ANTI JOIN manifest m ON c.acc_key = m.acc_key
+        WHERE c.acc_key IS NOT NULL
+        UNION
+        SELECT c.acc FROM candidates c
+        ANTI JOIN manifest m ON c.acc = m.acc
+        WHERE c.acc_key IS NULL
+        ORDER BY acc
+    """)
+
+
+def write(relation, output=None):
+    relation.pl().write_csv(output or sys.stdout)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Catalog of indexed signatures in DuckDB")
+    parser.add_argument("-c", "--catalog", default="/data/bw_db/catalog.duckdb",
+                        help="DuckDB file holding the catalog")
+    parser.add_argument("-m", "--metadata", default=None,
+                        help="metadata DuckDB to attach for joins (needed by 'bioprojects' and 'unmatched')")
+    parser.add_argument("-o", "--output", default=None, help="save query results to this CSV (default: stdout)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_add = sub.add_parser("add", help="append manifests to the catalog")
+    p_add.add_argument("manifests", nargs="+")
+    p_add.add_argument("--replace", action="store_true", help="drop existing records first")
+
+    for name in QUERIES:
+        sub.add_parser(name, help=f"run the '{name}' query")
+
+    p_check = sub.add_parser("check", help="list accessions from a file that are not in the catalog yet")
+    p_check.add_argument("accs", help="file with accessions, one per line")
+
+    p_sql = sub.add_parser("sql", help="run an arbitrary SQL query against the catalog")
+    p_sql.add_argument("query")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "add":
+        conn = connect(args.catalog)
+        if args.replace:
+            conn.sql("DELETE FROM manifest")
+        add(conn, args.manifests)
+        conn.close()
+        return
+
+    conn = connect(args.catalog, metadata=args.metadata, read_only=True)
+    if args.cmd == "check":
+        write(check(conn, args.accs), args.output)
+    elif args.cmd == "sql":
+        write(conn.sql(args.query), args.output)
+    else:
+        write(conn.sql(QUERIES[args.cmd]), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Column types of sourmash manifest CSVs.
+
+Shared by the manifest catalog and the manifest toolkit in customscripts/.
+"""
+
+import polars as pl
+
+MANIFEST_HEADER = "# SOURMASH-MANIFEST-VERSION: 1.0\n"
+
+MANIFEST_SCHEMA = {
+    "internal_location": pl.String,
+    "md5": pl.String,
+    "md5short": pl.String,
+    "ksize": pl.Int64,
+    "moltype": pl.String,
+    "num": pl.Int64,
+    "scaled": pl.Int64,
+    "n_hashes": pl.Int64,
+    "with_abundance": pl.String,
+    "name": pl.String,
+    "filename": pl.String,
+}
@@ -7,6 +7,8 @@ import sys
 from prepare_bq import main as bq_main
 from prepare_sra import main as sra_main
 from load_duckdb import main as duckdb_main
+from manifest_catalog import main as catalog_main
+from load_mags import main as mags_main
 
 
 def run_bq(args: argparse.Namespace):
@@ -37,6 +39,19 @@ def run_duckdb(args: argparse.Namespace):
         parquet_metadata=args.parquet_metadata,
         output=args.output,
         force=args.force,
+        typed=args.typed,
+    )
+
+
+def run_catalog(args: argparse.Namespace):
+    catalog_main(args.catalog_args)
+
+
+def run_mags(args: argparse.Namespace):
+    mags_main(
+        catalogues=args.catalogues,
+        run_mags=args.run_mags,
+        database=args.database,
     )
 
 
@@ -75,8 +90,21 @@ def main():
     p_duck.add_argument("parquet_metadata", nargs="?", default="/data/bw_db/metadata.parquet", help="Path to input parquet metadata")
     p_duck.add_argument("--output", "-o", default="/data/bw_db/metadata.duckdb", help="Output DuckDB file path")
     p_duck.add_argument("--force", action="store_true", help="Force recreate DuckDB file if exists")
+    p_duck.add_argument("--typed", action="store_true", help="Convert columns to compact types (ENUM, DATE, DOUBLE lat/lon) after loading")
     p_duck.set_defaults(func=run_duckdb)
 
+    # Manifest catalog (arguments are passed through to manifest_catalog.py)
+    p_cat = sub.add_parser("catalog", help="Build and query the DuckDB catalog of indexed signatures", add_help=False)
+    p_cat.add_argument("catalog_args", nargs=argparse.REMAINDER, help="Arguments for manifest_catalog.py")
+    p_cat.set_defaults(func=run_catalog)
+
+    # MGnify MAG linkage
+    p_mags = sub.add_parser("mags", help="Load MGnify MAG catalogues and run-to-MAG links into DuckDB")
+    p_mags.add_argument("--catalogues", "-c", required=True, help="Catalogues (CSV/TSV/parquet) with a catalogue_id column")
+    p_mags.add_argument("--run-mags", "-r", required=True, help="Run to MAG mapping (CSV/TSV/parquet) with run_accession, catalogue_id and genome_accession columns")
+    p_mags.add_argument("--database", "-d", default="/data/bw_db/metadata.duckdb", help="Metadata DuckDB database to add the tables to")
+    p_mags.set_defaults(func=run_mags)
+
     args = parser.parse_args()
 
     # If user passed --key-path explicitly, mark overridden (support older argparse versions)
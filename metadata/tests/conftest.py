@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the metadata scripts are run from their own directory
+sys.path.insert(0, str(Path(__file__).parent.parent))
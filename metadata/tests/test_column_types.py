@@ -0,0 +1,80 @@
+import datetime
+
+import duckdb
+import pytest
+
+import column_types
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.sql("""
+        CREATE TABLE metadata AS SELECT * FROM (VALUES
+            ('SRR1', 'WGS', '2020-01-01', 'Homo sapiens', 'a'),
+            ('SRR2', 'WGS', '2021-06-30', 'Mus musculus', 'b'),
+            ('SRR3', 'AMPLICON', NULL, 'Homo sapiens', 'c'),
+            ('SRR4', 'WGS', '2019-12-31', NULL, 'd'),
+            ('SRR5', 'AMPLICON', 'missing', 'Homo sapiens', 'e'),
+            ('SRR6', 'WGS', '2022-02-02', 'Mus musculus', 'f')
+        ) t(acc, assay_type, collection_date_sam, organism, notes)
+    """)
+    return conn
+
+
+def test_profile_columns(conn):
+    profile = column_types.profile_columns(conn, table="metadata")
+    assert set(profile) == {"acc", "assay_type", "collection_date_sam", "organism", "notes"}
+    assert profile["organism"]["non_null"] == 5
+    assert profile["organism"]["n_distinct"] == 2
+    # 'missing' doesn't parse as a date
+    assert profile["collection_date_sam"]["non_null"] == 5
+    assert profile["collection_date_sam"]["n_dates"] == 4
+
+
+def test_plan_types_enum_cutoff():
+    profile = {
+        "acc": {"non_null": 100, "n_distinct": 1, "n_dates": 0},
+        "assay_type": {"non_null": 100, "n_distinct": 10, "n_dates": 0},
+        "notes": {"non_null": 100, "n_distinct": 100, "n_dates": 0},
+        "empty": {"non_null": 0, "n_distinct": 0, "n_dates": 0},
+    }
+    # acc is a join key, notes has no repeats, empty has nothing to type
+    assert column_types.plan_types(profile) == {"assay_type": "ENUM"}
+
+    # at the cardinality cutoff, but not past it
+    assert column_types.plan_types(profile, enum_max_cardinality=10) == {"assay_type": "ENUM"}
+    assert column_types.plan_types(profile, enum_max_cardinality=9) == {}
+    # and only if values repeat often enough
+    assert column_types.plan_types(profile, enum_min_repeats=10) == {"assay_type": "ENUM"}
+    assert column_types.plan_types(profile, enum_min_repeats=11) == {}
+
+
+def test_plan_types_dates(conn):
+    plan = column_types.plan_types(column_types.profile_columns(conn, table="metadata"))
+    # one unparseable value keeps the column as VARCHAR
+    assert "collection_date_sam" not in plan
+    assert plan == {"assay_type": "ENUM", "organism": "ENUM"}
+
+    conn.sql("UPDATE metadata SET collection_date_sam = NULL WHERE collection_date_sam = 'missing'")
+    plan = column_types.plan_types(column_types.profile_columns(conn, table="metadata"))
+    assert plan["collection_date_sam"] == "DATE"
+
+
+def test_typed_columns_keep_values(conn):
+    conn.sql("UPDATE metadata SET collection_date_sam = NULL WHERE collection_date_sam = 'missing'")
+    before = conn.sql("SELECT * FROM metadata ORDER BY acc").fetchall()
+
+    plan = column_types.plan_types(column_types.profile_columns(conn, table="metadata"))
+    select = column_types.typed_columns(conn, plan, table="metadata")
+    typed = conn.sql(f"SELECT {', '.join(select)} FROM metadata ORDER BY acc")
+
+    types = dict(zip(typed.columns, map(str, typed.types)))
+    assert types["assay_type"].startswith("ENUM")
+    assert types["collection_date_sam"] == "DATE"
+    assert types["notes"] == "VARCHAR"
+
+    after = typed.fetchall()
+    assert len(after) == len(before)
+    for old, new in zip(before, after):
+        assert [str(v) if isinstance(v, datetime.date) else v for v in new] == list(old)
@@ -0,0 +1,46 @@
+import duckdb
+import polars as pl
+
+import accessions
+import manifest_catalog
+from manifest_schema import MANIFEST_HEADER
+
+HEADER = "internal_location,md5,md5short,ksize,moltype,num,scaled,n_hashes,with_abundance,name,filename\n"
+
+
+def write_manifest(path, records):
+    '''records as (md5, ksize, name)'''
+    lines = [
+        f"signatures/{md5}.sig.gz,{md5},{md5[:8]},{ksize},DNA,0,1000,10,TRUE,{name},-\n"
+        for md5, ksize, name in records
+    ]
+    path.write_text(MANIFEST_HEADER + HEADER + "".join(lines))
+    return path
+
+
+def test_catalog_fallback_keys(tmp_path):
+    fallback = accessions.fallback_keys(["weird"])
+    metadata = (pl.DataFrame({"acc": ["SRR000001", "weird"], "bioproject": ["PRJ1", "PRJ2"]})
+        .join(fallback.rename({"acc_key": "fallback_key"}), on="acc", how="left")
+        .with_columns(acc_key=pl.coalesce(accessions.encode_expr("acc"), "fallback_key"))
+        .drop("fallback_key"))
+    meta = duckdb.connect(str(tmp_path / "metadata.duckdb"))
+    meta.register("orig_metadata", metadata)
+    meta.register("orig_fallback", fallback)
+    meta.sql("CREATE TABLE metadata AS SELECT * FROM orig_metadata;"
+             "CREATE TABLE acc_fallback AS SELECT * FROM orig_fallback;")
+    meta.close()
+
+    path = write_manifest(tmp_path / "manifest.csv", [
+        ("aaaa0001", 21, "SRR000001"),
+        ("aaaa0002", 21, "weird"),
+        ("aaaa0003", 21, "SRR000003"),
+    ])
+    catalog = tmp_path / "catalog.duckdb"
+    manifest_catalog.main(["-c", str(catalog), "add", str(path)])
+
+    conn = manifest_catalog.connect(catalog, metadata=tmp_path / "metadata.duckdb", read_only=True)
+    unmatched = conn.sql(manifest_catalog.QUERIES["unmatched"]).pl()
+    assert unmatched["acc"].to_list() == ["SRR000003"]
+    bioprojects = conn.sql(manifest_catalog.QUERIES["bioprojects"]).pl().sort("bioproject")
+    assert bioprojects["bioproject"].to_list() == ["PRJ1", "PRJ2"]
@@ -0,0 +1,209 @@
+#! /usr/bin/env python
+
+"""Attribute coverage of the SRA metadata, computed locally.
+
+Replaces the BigQuery job in count_attr.py: every column and every `jattr`
+key is counted in a single pass over the SRA metadata Parquet files (the
+public S3 dataset or a local mirror), one file per worker. Counts for each
+file are cached, so reruns only scan files that are new or have changed.
+
+The outputs have the same schema as before (attributeList.csv + counts and
+percentage), so prepare_sra.py/prepare_bq.py and createform.py work as is.
+"""
+
+import hashlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import polars as pl
+import pyarrow.fs
+
+# keys of the flat `jattr` JSON object. Escaped quotes never match, so keys
+# can't be picked up from inside values.
+JATTR_KEY = r'"([^"\\]+)"\s*:'
+
+PARTIAL_SCHEMA = {"kind": pl.String, "name": pl.String, "counts": pl.Int64}
+
+
+def list_sources(sra_metadata):
+    '''Parquet files under `sra_metadata` with their size and modification time'''
+    if sra_metadata.startswith("s3://"):
+        fs = pyarrow.fs.S3FileSystem(anonymous=True)
+        base = sra_metadata.removeprefix("s3://")
+        prefix = "s3://"
+    else:
+        fs = pyarrow.fs.LocalFileSystem()
+        base = os.path.abspath(sra_metadata)
+        prefix = ""
+
+    infos = fs.get_file_info(pyarrow.fs.FileSelector(base.rstrip("/"), recursive=True))
+    return sorted(
+        (prefix + info.path, info.size, info.mtime_ns)
+        for info in infos
+        if info.type == pyarrow.fs.FileType.File
+        and info.size > 0
+        and not os.path.basename(info.path).startswith(("_", "."))
+    )
+
+
+def cache_path(cache_dir, source, size, mtime_ns, accs_digest):
+    key = f"{source}|{size}|{mtime_ns}|{accs_digest}"
+    return Path(cache_dir) / f"{hashlib.sha1(key.encode()).hexdigest()}.parquet"
+
+
+def profile_file(source, accs=None):
+    '''non-null counts for every column and every jattr key in one file
+
+    Both aggregates are collected together, so the file is only read once.
+    '''
+    storage_options = {"skip_signature": "true"} if source.startswith("s3://") else None
+    lf = pl.scan_parquet(source, storage_options=storage_options)
+    if accs is not None:
+        lf = lf.join(accs.lazy(), on="acc", how="semi")
+
+    columns = (lf
+        .select(pl.len().alias(""), pl.all().exclude("jattr").count())
+        .unpivot(variable_name="name", value_name="counts")
+        .select(
+            kind=pl.when(pl.col("name") == "").then(pl.lit("rows")).otherwise(pl.lit("column")),
+            name="name",
+            counts=pl.col("counts").cast(pl.Int64),
+        ))
+
+    keys = (lf
+        .select(name=pl.col("jattr").str.extract_all(JATTR_KEY)
+                .list.eval(pl.element().str.extract(JATTR_KEY, 1))
+                .list.unique())
+        .explode("name")
+        .drop_nulls()
+        .group_by("name")
+        .agg(counts=pl.len().cast(pl.Int64))
+        .select(kind=pl.lit("jattr"), name="name", counts="counts"))
+
+    columns, keys = pl.collect_all([columns, keys])
+    return pl.concat([columns, keys]).cast(PARTIAL_SCHEMA)
+
+
+def cached_profile(source, size, mtime_ns, *, cache_dir, accs=None, accs_digest=""):
+    path = cache_path(cache_dir, source, size, mtime_ns, accs_digest)
+    if path.exists():
+        return pl.read_parquet(path), True
+
+    partial = profile_file(source, accs)
+
+    tmp = path.with_suffix(".tmp")
+    partial.write_parquet(tmp)
+    tmp.replace(path)
+    return partial, False
+
+
+def attribute_key(attributes):
+    '''expression for the column or jattr key holding each attribute
+
+    Mirrors the selection in prepare_sra.py: jattr attributes get a '_sam'
+    suffix unless `not_sam` is set, and lat_lon is read in decimal degrees.
+    '''
+    name = pl.col("HarmonizedName")
+    in_jattr = pl.col("in_jattr").cast(pl.String) == "1"
+    not_sam = pl.col("not_sam").cast(pl.String) == "1"
+
+    return attributes.with_columns(
+        kind=pl.when(in_jattr).then(pl.lit("jattr")).otherwise(pl.lit("column")),
+        name=(pl.when(~in_jattr | not_sam).then(name)
+              .when(name.str.contains("lat_lon")).then(name + "_sam_s_dpl34")
+              .otherwise(name + "_sam")),
+    )
+
+
+def main(
+    *,
+    sra_metadata="s3://sra-pub-metadata-us-east-1/sra/metadata/",
+    accs=None,
+    attributes="attributeList.csv",
+    cache_dir=".attr_cache",
+    output="attrcounts.csv",
+    filtered_output="attrcounts_4.5percent.csv",
+    min_percentage=4.5,
+    profile_output=None,
+    jobs=8,
+):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    acc_df, accs_digest = None, ""
+    if accs:
+        acc_df = pl.read_csv(accs, has_header=False, new_columns=["acc"]).unique()
+        accs_digest = hashlib.sha1(Path(accs).read_bytes()).hexdigest()
+        print(f"Restricting counts to {acc_df.height:,} accessions from {accs}")
+
+    sources = list_sources(sra_metadata)
+    print(f"Profiling {len(sources):,} files from {sra_metadata}")
+
+    partials, n_cached = [], 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(cached_profile, source, size, mtime_ns,
+                            cache_dir=cache_dir, accs=acc_df, accs_digest=accs_digest): source
+            for (source, size, mtime_ns) in sources
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            partial, cached = future.result()
+            partials.append(partial)
+            n_cached += cached
+            print(f"\r{i}/{len(sources)} files ({n_cached} cached)", end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+    profile = (pl.concat(partials)
+        .group_by("kind", "name")
+        .agg(pl.col("counts").sum()))
+    n_rows = profile.filter(pl.col("kind") == "rows").get_column("counts").sum()
+    profile = (profile
+        .filter(pl.col("kind") != "rows")
+        .with_columns(percentage=pl.col("counts") / n_rows * 100)
+        .sort("kind", "counts", "name", descending=[False, True, False]))
+
+    if profile_output:
+        profile.write_csv(profile_output)
+
+    attributes = pl.read_csv(attributes, infer_schema_length=0).rename({"": "Unnamed: 7"}, strict=False)
+    attrcounts = (attribute_key(attributes)
+        .join(profile, on=["kind", "name"], how="left")
+        .with_columns(pl.col("counts").fill_null(0), pl.col("percentage").fill_null(0.0))
+        .select(*attributes.columns, "counts", "percentage"))
+    attrcounts.write_csv(output)
+
+    filtered = attrcounts.filter(pl.col("percentage") > min_percentage)
+    filtered.write_csv(filtered_output)
+
+    print(f"Counted {profile.height:,} columns and jattr keys over {n_rows:,} accessions")
+    print(f"{filtered.height} attributes have data available for >{min_percentage}% of accessions.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Count attribute coverage in the SRA metadata")
+    parser.add_argument("-s", "--sra-metadata", default="s3://sra-pub-metadata-us-east-1/sra/metadata/",
+                        help="SRA metadata Parquet files (S3 prefix or local mirror)")
+    parser.add_argument("-a", "--acc", default=None,
+                        help="only count these accessions (one per line, e.g. /data/bw_db/sraids)")
+    parser.add_argument("--attributes", default="attributeList.csv")
+    parser.add_argument("--cache-dir", default=".attr_cache", help="per-file partial counts, reused on reruns")
+    parser.add_argument("-o", "--output", default="attrcounts.csv")
+    parser.add_argument("--filtered-output", default="attrcounts_4.5percent.csv")
+    parser.add_argument("--min-percentage", type=float, default=4.5)
+    parser.add_argument("--profile-output", default=None,
+                        help="also save counts for every column and jattr key, listed or not")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="files profiled in parallel")
+
+    args = parser.parse_args()
+    main(sra_metadata=args.sra_metadata,
+         accs=args.acc,
+         attributes=args.attributes,
+         cache_dir=args.cache_dir,
+         output=args.output,
+         filtered_output=args.filtered_output,
+         min_percentage=args.min_percentage,
+         profile_output=args.profile_output,
+         jobs=args.jobs)
@@ -0,0 +1,92 @@
+import json
+
+import polars as pl
+import pytest
+
+import profile_attr
+
+# with a byte order mark, like attributeList.csv
+ATTRIBUTES = """\ufeffName,HarmonizedName,NCBI_provided_description,Format,not_sam,data_origin,in_jattr,
+organism,organism,x,x,1,bq,0,
+geo_loc_name_country_calc,geo_loc_name_country_calc,x,x,1,bq,1,
+env_biome,env_biome,x,x,0,bq,1,
+host,host,x,x,0,bq,1,
+"""
+
+
+@pytest.fixture
+def sra_metadata(tmp_path):
+    metadata = tmp_path / "metadata"
+    metadata.mkdir()
+    pl.DataFrame({
+        "acc": ["SRR1", "SRR2", "SRR3"],
+        "organism": ["Homo sapiens", None, "Mus musculus"],
+        "jattr": [
+            json.dumps({"geo_loc_name_country_calc": "USA", "env_biome_sam": "soil"}),
+            # a key repeated in the same record is counted once
+            '{"env_biome_sam": "water", "env_biome_sam": "lake"}',
+            # keys are never picked up from inside values
+            json.dumps({"note": 'a "env_biome_sam": inside'}),
+        ],
+    }).write_parquet(metadata / "part-0.parquet")
+    pl.DataFrame({
+        "acc": ["SRR4"],
+        "organism": ["Homo sapiens"],
+        "jattr": [json.dumps({"geo_loc_name_country_calc": "UK"})],
+    }).write_parquet(metadata / "part-1.parquet")
+
+    (tmp_path / "attributeList.csv").write_text(ATTRIBUTES, encoding="utf-8")
+    return tmp_path
+
+
+def run(tmp_path, **kwargs):
+    profile_attr.main(
+        sra_metadata=str(tmp_path / "metadata"),
+        attributes=str(tmp_path / "attributeList.csv"),
+        cache_dir=str(tmp_path / "cache"),
+        output=str(tmp_path / "attrcounts.csv"),
+        filtered_output=str(tmp_path / "filtered.csv"),
+        profile_output=str(tmp_path / "profile.csv"),
+        jobs=2,
+        **kwargs,
+    )
+    counts = pl.read_csv(tmp_path / "attrcounts.csv")
+    return {name: (n, pct) for name, n, pct in
+            counts.select("HarmonizedName", "counts", "percentage").iter_rows()}
+
+
+def test_attribute_coverage(sra_metadata):
+    assert run(sra_metadata, min_percentage=60) == {
+        "organism": (3, 75.0),
+        "geo_loc_name_country_calc": (2, 50.0),
+        "env_biome": (2, 50.0),
+        "host": (0, 0.0),
+    }
+    filtered = pl.read_csv(sra_metadata / "filtered.csv")
+    assert filtered["HarmonizedName"].to_list() == ["organism"]
+
+    # every column and jattr key, listed in attributeList.csv or not
+    profile = pl.read_csv(sra_metadata / "profile.csv")
+    counts = {(kind, name): n for kind, name, n, _ in profile.iter_rows()}
+    assert counts == {
+        ("column", "acc"): 4,
+        ("column", "organism"): 3,
+        ("jattr", "geo_loc_name_country_calc"): 2,
+        ("jattr", "env_biome_sam"): 2,
+        ("jattr", "note"): 1,
+    }
+
+    # reruns read the per-file counts from the cache
+    assert len(list((sra_metadata / "cache").iterdir())) == 2
+    assert run(sra_metadata)["organism"] == (3, 75.0)
+
+
+def test_accession_subset(sra_metadata):
+    accs = sra_metadata / "sraids"
+    accs.write_text("SRR1\nSRR2\n")
+    assert run(sra_metadata, accs=str(accs)) == {
+        "organism": (1, 50.0),
+        "geo_loc_name_country_calc": (1, 50.0),
+        "env_biome": (2, 100.0),
+        "host": (0, 0.0),
+    }